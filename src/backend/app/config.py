@@ -14,6 +14,22 @@ def db_login():
         "host": os.getenv("DB_HOST", "localhost"),
         "port": int(os.getenv("DB_PORT", 3306))
     }
+
+def db_pool_settings():
+    # One connection per waitress thread and per mail worker unless overridden
+    threads = int(os.getenv("THREADS", 4)) + int(os.getenv("MAIL_WORKERS", 2))
+    return {
+        "size": int(os.getenv("DB_POOL_SIZE", threads)),
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+        "borrow_timeout": float(os.getenv("DB_POOL_TIMEOUT", 5)),
+        "ping_interval": float(os.getenv("DB_POOL_PING_INTERVAL", 30)),
+    }
+
+def auth_cache_settings():
+    return {
+        "maxsize": int(os.getenv("AUTH_CACHE_SIZE", 10000)),
+        "ttl": float(os.getenv("AUTH_CACHE_TTL", 60)),
+    }
     
 VALID_TABLES = {
     "users",
@@ -24,5 +40,8 @@ VALID_TABLES = {
     "chats",
     "participants",
     "messages",
-    "refresh_tokens"
+    "refresh_tokens",
+    "ws_outbox",
+    "membership_changes",
+    "mail_queue"
 }
\ No newline at end of file
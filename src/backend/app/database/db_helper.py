@@ -1,35 +1,65 @@
 import logging
+import threading
 from flask import g
 import os
 from dotenv import load_dotenv
-from mariadb import connect, Error
-from app.config import VALID_TABLES
+from mariadb import Error
+from app.config import VALID_TABLES, db_pool_settings
+from app.database.pool import ConnectionPool, PoolTimeout
+from app.errors import ServiceUnavailable
 from functools import wraps
 
 load_dotenv()
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """
+    :return: The process-wide connection pool, created on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect_kwargs={
+                        "host": os.getenv("DB_HOST", "localhost"),
+                        "user": os.getenv("DB_USER", "root"),
+                        "password": os.getenv("DB_PASSWORD", ""),
+                        "database": os.getenv("DB_NAME", "chatcli"),
+                        "port": int(os.getenv("DB_PORT", 3306)),
+                        "autocommit": True,
+                    },
+                    **db_pool_settings(),
+                )
+    return _pool
+
+def pool_stats() -> dict:
+    """
+    :return: Counters of the connection pool (empty if it was never used).
+    """
+    return _pool.stats() if _pool is not None else {}
+
 def get_db():
     """
-    :return: A MySQL database connection stored in Flask's 'g' object.
+    :return: A pooled database connection stored in Flask's 'g' object.
     """
     if 'db' not in g:
-        g.db = connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            user=os.getenv("DB_USER", "root"),
-            password=os.getenv("DB_PASSWORD", ""),
-            database=os.getenv("DB_NAME", "chatcli"),
-            port=int(os.getenv("DB_PORT", 3306)),
-            autocommit=True,
-        )
+        try:
+            g.db = get_pool().acquire()
+        except PoolTimeout as e:
+            logging.error(f"[get_db] {e}")
+            raise ServiceUnavailable("Database is busy, please try again.")
     return g.db
 
 def close_db():
     """
-    Close the DB connection if it exists in 'g'.
+    Return the DB connection in 'g' to the pool, if there is one.
     """
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
 
 def transactional(fn):
     """
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from mariadb import connect, Error
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be borrowed within the borrow timeout."""
+
+
+class _Entry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MariaDB connections for the waitress worker threads.
+
+    Connections are handed out LIFO so the warmest ones get reused, pinged
+    when they sat idle longer than `ping_interval`, and recycled once they
+    are older than `max_lifetime` seconds.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs: dict,
+        size: int = 4,
+        max_lifetime: float = 1800.0,
+        borrow_timeout: float = 5.0,
+        ping_interval: float = 30.0,
+    ):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.borrow_timeout = borrow_timeout
+        self.ping_interval = ping_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle: deque[_Entry] = deque()
+        self._in_use: dict[int, _Entry] = {}
+        self._total = 0
+        self._closed = False
+        self._counters = {
+            "borrows": 0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "expired": 0,
+            "health_check_failures": 0,
+            "wait_time_total": 0.0,
+        }
+
+    # ---- internals ----
+
+    def _create(self) -> _Entry:
+        conn = connect(**self._connect_kwargs)
+        with self._cond:
+            self._counters["created"] += 1
+        return _Entry(conn)
+
+    def _discard(self, entry: _Entry) -> None:
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._counters["closed"] += 1
+            self._cond.notify()
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.max_lifetime > 0 and now - entry.created_at > self.max_lifetime
+
+    def _validate(self, entry: _Entry) -> bool:
+        """
+        Return True if the idle connection can be handed out again.
+        """
+        now = time.monotonic()
+        if self._expired(entry, now):
+            with self._cond:
+                self._counters["expired"] += 1
+            return False
+        if now - entry.last_used > self.ping_interval:
+            try:
+                entry.conn.ping()
+            except Error as e:
+                logger.warning("Dropping pooled connection that failed health check: %s", e)
+                with self._cond:
+                    self._counters["health_check_failures"] += 1
+                return False
+        return True
+
+    # ---- public API ----
+
+    def acquire(self):
+        """
+        Borrow a connection, blocking up to `borrow_timeout` seconds.
+        Raises PoolTimeout if none became available in time.
+        """
+        started = time.monotonic()
+        deadline = started + self.borrow_timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._total < self.size:
+                        self._total += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.borrow_timeout}s"
+                        )
+                    self._cond.wait(remaining)
+
+            if entry is not None and not self._validate(entry):
+                # Keep the slot, replace the connection
+                try:
+                    entry.conn.close()
+                except Exception:
+                    pass
+                with self._cond:
+                    self._counters["closed"] += 1
+                entry = None
+
+            if entry is None:
+                try:
+                    entry = self._create()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            entry.last_used = time.monotonic()
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                self._counters["borrows"] += 1
+                self._counters["wait_time_total"] += entry.last_used - started
+            return entry.conn
+
+    def release(self, conn, discard: bool = False) -> None:
+        """
+        Return a borrowed connection. Any open transaction is rolled back
+        and autocommit restored so the next borrower gets a clean session.
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            logger.warning("Releasing a connection that does not belong to the pool")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+
+        if not discard:
+            try:
+                if not conn.autocommit:
+                    conn.rollback()
+                    conn.autocommit = True
+            except Error as e:
+                logger.warning("Discarding pooled connection after reset failure: %s", e)
+                discard = True
+
+        if discard or self._closed or self._expired(entry, time.monotonic()):
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self) -> None:
+        """
+        Close all idle connections and refuse further borrows.
+        Connections still in use are closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self) -> dict:
+        with self._cond:
+            borrows = self._counters["borrows"]
+            return {
+                "size": self.size,
+                "open": self._total,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                **self._counters,
+                "avg_wait_ms": round(1000 * self._counters["wait_time_total"] / borrows, 3) if borrows else 0.0,
+            }
@@ -39,4 +39,8 @@ class UnprocessableEntity(APIError):
 
 class TooManyRequests(APIError):
     status_code = 429
-    default_message = "Too many requests."
\ No newline at end of file
+    default_message = "Too many requests."
+
+class ServiceUnavailable(APIError):
+    status_code = 503
+    default_message = "Service temporarily unavailable."
@@ -0,0 +1,25 @@
+from functools import wraps
+from flask import request, g
+from app.services.base_services import authenticate_token
+from app.errors import BadRequest, Unauthorized
+
+
+def require_session(fn):
+    """
+    Route decorator: authenticates the `session_token` in the JSON body once
+    and stores the resolved identity in `g.user` for the route to pass on.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True)
+        if not data:
+            raise BadRequest("Invalid JSON format.")
+        token = data.get("session_token")
+        if not isinstance(token, str) or not token.strip():
+            raise BadRequest("Session token is required.")
+        user = authenticate_token(token.strip())
+        if not user:
+            raise Unauthorized("Invalid or expired session token.")
+        g.user = user
+        return fn(*args, **kwargs)
+    return wrapper
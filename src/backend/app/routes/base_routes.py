@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify, render_template
-from app.services.base_services import verify_connection, subscribe
+from app.services.base_services import verify_connection, subscribe, server_stats
 from app.errors import BadRequest
 
 base = Blueprint("base", __name__)
@@ -21,6 +21,10 @@ def route_verify_connection():
     result = verify_connection(data)
     return jsonify(result)
 
+@base.route("/stats", methods=["GET"])
+def route_stats():
+    return jsonify(server_stats())
+
 @base.route("/subscribe", methods=["GET", "POST"])
 def route_subscribe():
     # Parse JSON only for POST
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from app.services.chat_services import (
     fetch_chats,
     create_chat,
@@ -6,6 +6,7 @@ from app.services.chat_services import (
     add_participant,
     remove_participant,
     get_messages,
+    sync_messages,
     archive_chat,
     get_members,
     fetch_archived,
@@ -13,6 +14,7 @@ from app.services.chat_services import (
 )
 from app.errors import BadRequest
 from app.extensions import limiter
+from app.routes.auth import require_session
 
 chat = Blueprint("chat", __name__, url_prefix="/chat")
 
@@ -21,83 +23,102 @@ def index():
     return "chat's index route"
 
 @chat.route("/fetch-chats", methods=["POST"])
+@require_session
 def route_fetch_chats():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = fetch_chats(data)
+    result = fetch_chats(data, g.user)
     return jsonify(result)
 
 @chat.route("/create-chat", methods=["POST"])
+@require_session
 def route_create_chat():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = create_chat(data)
+    result = create_chat(data, g.user)
     return jsonify(result), 201
 
 @chat.route("/create-group", methods=["POST"])
+@require_session
 def route_create_group():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = create_group(data)
+    result = create_group(data, g.user)
     return jsonify(result), 201
 
 @chat.route("/add-members", methods=["POST"])
+@require_session
 def route_add_members():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = add_participant(data)
+    result = add_participant(data, g.user)
     return jsonify(result)
 
 @chat.route("/remove-members", methods=["POST"])
+@require_session
 def route_remove_members():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = remove_participant(data)
+    result = remove_participant(data, g.user)
     return jsonify(result)
 
 @chat.route("/messages", methods=["POST"])
+@require_session
 def route_messages():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = get_messages(data)
+    result = get_messages(data, g.user)
+    return jsonify(result)
+
+@chat.route("/sync", methods=["POST"])
+@require_session
+def route_sync():
+    data = request.get_json(silent=True)
+    if not data:
+        raise BadRequest("Invalid JSON format.")
+    result = sync_messages(data, g.user)
     return jsonify(result)
 
 @chat.route("/archive-chat", methods=["POST"])
 @limiter.limit("10 per minute")
+@require_session
 def route_archive_chat():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = archive_chat(data)
+    result = archive_chat(data, g.user)
     return jsonify(result)
 
 @chat.route("/get-members", methods=["POST"])
+@require_session
 def route_get_members():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = get_members(data)
+    result = get_members(data, g.user)
     return jsonify(result)
 
 @chat.route("/fetch-archived", methods=["POST"])
+@require_session
 def route_fetch_archived():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = fetch_archived(data)
+    result = fetch_archived(data, g.user)
     return jsonify(result)
 
 @chat.route("/unarchive-chat", methods=["POST"])
 @limiter.limit("10 per minute")
+@require_session
 def route_unarchive_chat():
     data = request.get_json(silent=True)
     if not data:
         raise BadRequest("Invalid JSON format.")
-    result = unarchive_chat(data)
+    result = unarchive_chat(data, g.user)
     return jsonify(result)
\ No newline at end of file
@@ -1,6 +1,7 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from app.services.user_services import *
 from app.extensions import limiter
+from app.routes.auth import require_session
 import app.errors as errors
 
 user = Blueprint("user", __name__, url_prefix="/user")
@@ -87,47 +88,52 @@ def route_refresh_token():
 
 @user.route("/profile", methods=["POST"])
 @limiter.limit("10 per minute")
+@require_session
 def route_profile():
     data = request.get_json(silent=True)
     if not data:
         raise errors.BadRequest("Invalid JSON format.")
-    result = profile(data)
+    result = profile(data, g.user)
     return jsonify(result)
 
 
 @user.route("/submit-profile", methods=["POST"])
 @limiter.limit("10 per minute")
+@require_session
 def route_submit_profile():
     data = request.get_json(silent=True)
     if not data:
         raise errors.BadRequest("Invalid JSON format.")
-    result = submit_profile(data)
+    result = submit_profile(data, g.user)
     return jsonify(result)
 
 
 @user.route("/change-password", methods=["POST"])
 @limiter.limit("5 per minute")
+@require_session
 def route_change_password():
     data = request.get_json(silent=True)
     if not data:
         raise errors.BadRequest("Invalid JSON format.")
-    result = change_password(data)
+    result = change_password(data, g.user)
     return jsonify(result)
 
 @user.route("/logout", methods=["POST"])
 @limiter.limit("5 per minute")
+@require_session
 def route_logout():
     data = request.get_json(silent=True)
     if not data:
         raise errors.BadRequest("Invalid JSON format.")
-    result = logout(data)
+    result = logout(data, g.user)
     return jsonify(result)
 
 @user.route("/logout-all", methods=["POST"])
 @limiter.limit("5 per minute")
+@require_session
 def route_logout_all():
     data = request.get_json(silent=True)
     if not data:
         raise errors.BadRequest("Invalid JSON format.")
-    result = logout_all(data)
+    result = logout_all(data, g.user)
     return jsonify(result)
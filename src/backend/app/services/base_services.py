@@ -1,41 +1,69 @@
 import hashlib
+import os
 import mariadb
 from flask import current_app
 
-from app.errors import BadRequest, Conflict, APIError
-from app.database.db_helper import fetch_records, insert_record
+from app.config import auth_cache_settings
+from app.errors import BadRequest, Conflict, NotFound, APIError
+from app.database.db_helper import fetch_records, insert_record, get_db, pool_stats
+from common.cache import TTLCache
 
 # module logger
 import logging
 logger = logging.getLogger(__name__)
 
+# token hash -> identity row (see authenticate_token) for recently validated sessions
+auth_cache = TTLCache(**auth_cache_settings())
 
-def authenticate_token(session_token: str) -> str | None:
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def invalidate_session(session_token: str) -> None:
+    """
+    Forget a single cached session. Call after revoking it.
+    """
+    auth_cache.pop(hash_token(session_token))
+
+
+def invalidate_user_sessions(user_id: int) -> None:
+    """
+    Forget every cached session of a user. Call after revoking their tokens
+    or changing anything the cache carries (username, disabled, deleted).
     """
-    Given a plain session token, returns the associated username if valid; otherwise None.
+    auth_cache.pop_where(lambda ident: ident["userID"] == user_id)
+
+
+def authenticate_token(session_token: str) -> dict | None:
+    """
+    Given a plain session token, returns the identity of its user if valid; otherwise None.
+    Identity: { userID, username, email, email_verified, disabled, deleted }
+    Valid sessions are cached for AUTH_CACHE_TTL seconds.
     """
     if not session_token:
         return None
     try:
-        token_hash = hashlib.sha256(session_token.encode("utf-8")).hexdigest()
-        sessions = fetch_records(
-            table="session_tokens",
-            where_clause="session_token = %s AND revoked = FALSE AND expires_at > CURRENT_TIMESTAMP()",
-            params=(token_hash,),
-            fetch_all=True
-        )
-        if not sessions:
-            return None
-        user_id = sessions[0]["userID"]
-        users = fetch_records(
-            table="users",
-            where_clause="userID = %s AND email_verified = TRUE AND disabled = FALSE",
-            params=(user_id,),
-            fetch_all=True
+        token_hash = hash_token(session_token)
+        cached = auth_cache.get(token_hash)
+        if cached is not None:
+            return cached
+        cur = get_db().cursor(dictionary=True)
+        cur.execute(
+            """
+            SELECT u.userID, u.username, u.email, u.email_verified, u.disabled, u.deleted
+            FROM session_tokens s
+            JOIN users u ON u.userID = s.userID
+            WHERE s.session_token = %s AND s.revoked = FALSE AND s.expires_at > CURRENT_TIMESTAMP()
+              AND u.email_verified = TRUE AND u.disabled = FALSE
+            """,
+            (token_hash,)
         )
-        if not users:
+        user = cur.fetchone()
+        if not user:
             return None
-        return users[0]["username"]
+        auth_cache.set(token_hash, user)
+        return user
     except Exception as e:
         logger.error("Error authenticating token: %s", e, exc_info=e)
         return None
@@ -49,6 +77,15 @@ def verify_connection(data: dict) -> dict:
     return {"message": "Server is reachable!"}
 
 
+def server_stats() -> dict:
+    """
+    Internal counters for monitoring. Only exposed when EXPOSE_STATS=true.
+    """
+    if os.getenv("EXPOSE_STATS") != "true":
+        raise NotFound()
+    return {"db_pool": pool_stats(), "auth_cache": auth_cache.stats()}
+
+
 def subscribe(data: dict) -> dict:
     """
     Subscribes an email address.
@@ -2,7 +2,7 @@ import mariadb
 from flask import current_app
 
 from app.errors import BadRequest, Unauthorized, Forbidden, NotFound, Conflict, APIError
-from app.services.base_services import authenticate_token
+from app.services.outbox_services import publish_event
 from app.database.db_helper import (
     transactional,
     fetch_records,
@@ -10,29 +10,12 @@ from app.database.db_helper import (
 )
 
 
-def fetch_chats(data: dict) -> dict:
+def fetch_chats(data: dict, user: dict) -> dict:
     """
     data: { session_token: str }
     Returns: { response: [ { chatID, name, type }, ... ] }
     """
-    session_token = data.get("session_token")
-    if not session_token:
-        raise BadRequest("Session token is required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-
-    # fetch user ID
-    users = fetch_records(
-        table="users",
-        where_clause="LOWER(username) = %s",
-        params=(username.lower(),),
-        fetch_all=True
-    )
-    if not users:
-        raise NotFound("User not found.")
-    user_id = users[0]["userID"]
+    user_id = user["userID"]
 
     try:
         conn = get_db()
@@ -93,37 +76,46 @@ def fetch_chats(data: dict) -> dict:
     return {"response": response}
 
 
-def get_messages(data: dict) -> dict:
+def get_messages(data: dict, user: dict) -> dict:
     """
-    data: { session_token: str, chatID: int, limit (optional) }
-    Returns: { messages: [ ... ] }
+    data: { session_token: str, chatID: int, limit (optional),
+            before_id (optional), after_id (optional) }
+    Returns: { messages: [ ... ], has_more: bool, next_cursor: int | None }
+
+    Pages are keyed on messageID and always returned oldest first.
+    Without a cursor the newest `limit` messages are returned; pass
+    next_cursor back as before_id to scroll further back. With after_id
+    the page holds the messages that follow it, and next_cursor is the
+    after_id for the following page.
     """
-    username = (data.get("username") or "").lower()
-    session_token = data.get("session_token")
     chat_id = data.get("chatID")
     limit = data.get("limit", 50)
+    before_id = data.get("before_id")
+    after_id = data.get("after_id")
 
     # validate inputs
-    if not session_token or chat_id is None:
-        raise BadRequest("session_token and chatID are required.")
+    if chat_id is None:
+        raise BadRequest("chatID is required.")
     try:
         limit = int(limit)
     except (ValueError, TypeError):
         raise BadRequest("limit must be an integer.")
     if limit < 1 or limit > 200:
         raise BadRequest("limit must be between 1 and 200.")
+    if before_id is not None and after_id is not None:
+        raise BadRequest("Use either before_id or after_id, not both.")
+    try:
+        before_id = int(before_id) if before_id is not None else None
+        after_id = int(after_id) if after_id is not None else None
+    except (ValueError, TypeError):
+        raise BadRequest("before_id and after_id must be integers.")
 
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-
-    user_lower = username.lower()
     # check participation
     try:
         parts = fetch_records(
             table="participants",
-            where_clause="chatID = %s AND userID = (SELECT userID FROM users WHERE LOWER(username) = %s)",
-            params=(chat_id, user_lower),
+            where_clause="chatID = %s AND userID = %s",
+            params=(chat_id, user["userID"]),
             fetch_all=True
         )
     except mariadb.Error as e:
@@ -132,20 +124,32 @@ def get_messages(data: dict) -> dict:
     if not parts:
         raise NotFound("Chat not found or access denied.")
 
-    # fetch messages
+    # fetch one extra row to learn whether another page exists
+    # (served by idx_msg_chat_id on (chatID, messageID))
+    if after_id is not None:
+        where, params, order = "chatID = %s AND messageID > %s", (chat_id, after_id), "messageID ASC"
+    elif before_id is not None:
+        where, params, order = "chatID = %s AND messageID < %s", (chat_id, before_id), "messageID DESC"
+    else:
+        where, params, order = "chatID = %s", (chat_id,), "messageID DESC"
     try:
         rows = fetch_records(
             table="messages",
-            where_clause="chatID = %s",
-            params=(chat_id,),
-            order_by="timestamp DESC",
-            limit=limit,
+            where_clause=where,
+            params=params,
+            order_by=order,
+            limit=limit + 1,
             fetch_all=True
         )
     except mariadb.Error as e:
         current_app.logger.error("DB error fetching messages", exc_info=e)
         raise APIError()
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+
     user_ids = list({r["userID"] for r in rows})
     id_to_username = {}
     if user_ids:
@@ -166,36 +170,119 @@ def get_messages(data: dict) -> dict:
             "message": r["message"],
             "timestamp": r["timestamp"].isoformat()
         }
-        for r in reversed(rows)
+        for r in rows
     ]
 
-    return {"messages": messages}
+    next_cursor = None
+    if has_more:
+        next_cursor = rows[-1]["messageID"] if after_id is not None else rows[0]["messageID"]
+
+    return {"messages": messages, "has_more": has_more, "next_cursor": next_cursor}
+
+
+SYNC_MAX_LIMIT = 1000
+SYNC_MAX_CURSORS = 500
+
+
+def sync_messages(data: dict, user: dict) -> dict:
+    """
+    data: { session_token: str,
+            cursors (optional): { chatID: last_seen_messageID, ... },
+            since_id (optional): int, limit (optional), continuation (optional) }
+    Returns: { messages: [ ... ], has_more: bool, continuation: int | None }
+
+    Catch-up for reconnecting clients: every message newer than the caller's
+    last-seen ID, across all chats they are in, in one query ordered by
+    messageID. `cursors` gives a high-water mark per chat; `since_id` is
+    the mark for every chat not listed there. Pass `continuation` back with
+    the same cursors to fetch the rest when has_more is true.
+    """
+    cursors = data.get("cursors") or {}
+    since_id = data.get("since_id")
+    limit = data.get("limit", 500)
+    continuation = data.get("continuation")
+
+    if not isinstance(cursors, dict):
+        raise BadRequest("cursors must be an object of chatID -> messageID.")
+    if not cursors and since_id is None:
+        raise BadRequest("cursors or since_id is required.")
+    if len(cursors) > SYNC_MAX_CURSORS:
+        raise BadRequest(f"At most {SYNC_MAX_CURSORS} cursors are allowed.")
+    try:
+        cursors = {int(cid): int(mid) for cid, mid in cursors.items()}
+        since_id = int(since_id) if since_id is not None else None
+        continuation = int(continuation) if continuation is not None else None
+        limit = int(limit)
+    except (ValueError, TypeError):
+        raise BadRequest("cursors, since_id, continuation and limit must be integers.")
+    if limit < 1 or limit > SYNC_MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {SYNC_MAX_LIMIT}.")
+
+    branches = []
+    params = [user["userID"]]
+    for cid, mid in cursors.items():
+        branches.append("(m.chatID = %s AND m.messageID > %s)")
+        params += [cid, mid]
+    if since_id is not None:
+        if cursors:
+            fmt = ",".join(["%s"] * len(cursors))
+            branches.append(f"(m.chatID NOT IN ({fmt}) AND m.messageID > %s)")
+            params += [*cursors.keys(), since_id]
+        else:
+            branches.append("m.messageID > %s")
+            params.append(since_id)
+
+    sql = f"""
+        SELECT m.messageID, m.chatID, m.userID, u.username, m.message, m.timestamp
+        FROM messages m
+        JOIN participants p ON p.chatID = m.chatID AND p.userID = %s
+        JOIN users u ON u.userID = m.userID
+        WHERE ({" OR ".join(branches)})
+    """
+    if continuation is not None:
+        sql += " AND m.messageID > %s"
+        params.append(continuation)
+    sql += " ORDER BY m.messageID ASC LIMIT %s"
+    params.append(limit + 1)
+
+    try:
+        cur = get_db().cursor(dictionary=True)
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall()
+    except mariadb.Error as e:
+        current_app.logger.error("DB error syncing messages", exc_info=e)
+        raise APIError()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [
+        {
+            "messageID": r["messageID"],
+            "chatID": r["chatID"],
+            "userID": r["userID"],
+            "username": r["username"],
+            "message": r["message"],
+            "timestamp": r["timestamp"].isoformat()
+        }
+        for r in rows
+    ]
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "continuation": rows[-1]["messageID"] if has_more else None,
+    }
 
 
 @transactional
-def archive_chat(data: dict) -> dict:
+def archive_chat(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, chatID: int }
     Returns: { message: str }
     """
-    session_token = data.get("session_token")
     chat_id = data.get("chatID")
-    if not session_token or chat_id is None:
-        raise BadRequest("Session token and chatID are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-
-    users = fetch_records(
-        table="users",
-        where_clause="LOWER(username) = %s",
-        params=(username.lower(),),
-        fetch_all=True
-    )
-    if not users:
-        raise NotFound("User not found.")
-    user_id = users[0]["userID"]
+    if chat_id is None:
+        raise BadRequest("chatID is required.")
+    user_id = user["userID"]
 
     try:
         conn = get_db()
@@ -204,6 +291,7 @@ def archive_chat(data: dict) -> dict:
             "UPDATE participants SET archived = 1 WHERE chatID = %s AND userID = %s",
             (chat_id, user_id)
         )
+        publish_event("chat_archived", chatID=chat_id, userID=user_id)
         conn.commit()
     except Exception as e:
         current_app.logger.error("Error archiving chat", exc_info=e)
@@ -212,19 +300,83 @@ def archive_chat(data: dict) -> dict:
     return {"message": "Chat archived"}
 
 
-def get_members(data: dict) -> dict:
+# Membership changes kept per chat for get_members(since_version); callers
+# further behind than this get the full member list instead
+MEMBER_LOG_VERSIONS = 200
+
+
+def _record_membership_change(cur, chat_id: int, action: str, user_ids: list[int]) -> int:
     """
-    data: { session_token: str, chatID: int }
-    Returns: { members: [username, ...] }
+    Internal: bumps the chat's member_version and logs the change under it.
+    Must run in the transaction that changes participants; the UPDATE locks
+    the chat row, so concurrent edits get consecutive versions.
+    Returns the new version.
     """
-    session_token = data.get("session_token")
-    chat_id = data.get("chatID")
-    if not session_token or chat_id is None:
-        raise BadRequest("session_token and chatID are required.")
+    cur.execute("UPDATE chats SET member_version = member_version + 1 WHERE chatID = %s", (chat_id,))
+    cur.execute("SELECT member_version FROM chats WHERE chatID = %s", (chat_id,))
+    version = cur.fetchone()[0]
+    cur.executemany(
+        "INSERT INTO membership_changes (chatID, version, userID, action) VALUES (%s,%s,%s,%s)",
+        [(chat_id, version, uid, action) for uid in user_ids]
+    )
+    cur.execute(
+        "DELETE FROM membership_changes WHERE chatID = %s AND version <= %s",
+        (chat_id, version - MEMBER_LOG_VERSIONS)
+    )
+    return version
 
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid session token.")
+
+def _member_delta(chat_id: int, since_version: int) -> dict:
+    """
+    Internal: net membership change after since_version, as username lists.
+    """
+    try:
+        cur = get_db().cursor(dictionary=True)
+        cur.execute(
+            """
+            SELECT mc.userID, mc.action, u.username
+            FROM membership_changes mc
+            JOIN users u ON u.userID = mc.userID
+            WHERE mc.chatID = %s AND mc.version > %s
+            ORDER BY mc.version
+            """,
+            (chat_id, since_version)
+        )
+        rows = cur.fetchall()
+    except mariadb.Error as e:
+        current_app.logger.error("DB error loading membership changes", exc_info=e)
+        raise APIError()
+
+    last = {}
+    for r in rows:
+        last[r["userID"]] = (r["action"], r["username"])
+    return {
+        "added": [name for action, name in last.values() if action == "added"],
+        "removed": [name for action, name in last.values() if action == "removed"],
+    }
+
+
+def get_members(data: dict, user: dict) -> dict:
+    """
+    data: { session_token: str, chatID: int, since_version (optional): int }
+    Returns: { version: int, members: [username, ...] }
+          or { version: int, up_to_date: true }
+          or { version: int, added: [username, ...], removed: [username, ...] }
+
+    since_version is the version of a member list the caller already has;
+    only the changes since then are returned, or the full list if they are
+    no longer in the change log. Applying added/removed as set operations
+    to that list gives the members at `version`.
+    """
+    chat_id = data.get("chatID")
+    if chat_id is None:
+        raise BadRequest("chatID is required.")
+    since_version = data.get("since_version")
+    if since_version is not None:
+        try:
+            since_version = int(since_version)
+        except (ValueError, TypeError):
+            raise BadRequest("since_version must be an integer.")
 
     grp = fetch_records(
         table="chats",
@@ -236,14 +388,20 @@ def get_members(data: dict) -> dict:
         raise NotFound("Group not found.")
     
     parts_self = fetch_records(
-    table="participants",
-    where_clause="chatID = %s AND userID = (SELECT userID FROM users WHERE LOWER(username) = %s)",
-    params=(chat_id, username.lower()),
-    fetch_all=True
+        table="participants",
+        where_clause="chatID = %s AND userID = %s",
+        params=(chat_id, user["userID"]),
+        fetch_all=True
     )
     if not parts_self:
         raise NotFound("Chat not found or access denied.")
 
+    version = grp[0]["member_version"]
+    if since_version == version:
+        return {"version": version, "up_to_date": True}
+    if since_version is not None and version - MEMBER_LOG_VERSIONS <= since_version < version:
+        return {"version": version, **_member_delta(chat_id, since_version)}
+
     parts = fetch_records(
         table="participants",
         where_clause="chatID=%s",
@@ -252,7 +410,7 @@ def get_members(data: dict) -> dict:
     )
     ids = [p["userID"] for p in parts]
     if not ids:
-        return {"members": []}
+        return {"version": version, "members": []}
 
     fmt = ",".join(["%s"] * len(ids))
     users = fetch_records(
@@ -262,25 +420,20 @@ def get_members(data: dict) -> dict:
         fetch_all=True
     )
     names = [u["username"] for u in users]
-    return {"members": names}
+    return {"version": version, "members": names}
 
 
 @transactional
-def add_participant(data: dict) -> dict:
+def add_participant(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, chatID: int, members: [str, ...] }
     Returns: { chatID: int }
     """
-    session_token = data.get("session_token")
     chat_id = data.get("chatID")
     new_users = data.get("members", [])
 
-    if not session_token or chat_id is None or not isinstance(new_users, list) or not new_users:
-        raise BadRequest("session_token, chatID and members list are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid session token.")
+    if chat_id is None or not isinstance(new_users, list) or not new_users:
+        raise BadRequest("chatID and members list are required.")
 
     grp = fetch_records(
         table="chats",
@@ -294,45 +447,48 @@ def add_participant(data: dict) -> dict:
     placeholders = ",".join(["%s"] * len(new_users))
     rows = fetch_records(
         table="users",
-        where_clause=f"LOWER(username) IN ({placeholders})",
+        where_clause=f"username_key IN ({placeholders})",
         params=tuple(u.lower() for u in new_users),
         fetch_all=True
     )
     if len(rows) != len(new_users):
         raise NotFound("One or more users not found.")
-    user_ids = [r["userID"] for r in rows]
+    names = {r["userID"]: r["username"] for r in rows}
 
     conn = get_db()
     cur = conn.cursor()
-    for uid in set(user_ids):
+    added = []
+    for uid in names:
         try:
             cur.execute(
                 "INSERT INTO participants (chatID, userID) VALUES (%s,%s)",
                 (chat_id, uid)
             )
+            added.append(uid)
         except mariadb.Error:
             pass
+    if added:
+        version = _record_membership_change(cur, chat_id, "added", added)
+        publish_event(
+            "member_added", chatID=chat_id, version=version, userIDs=added,
+            usernames=[names[uid] for uid in added], byUserID=user["userID"]
+        )
     conn.commit()
 
     return {"chatID": chat_id}
 
 
 @transactional
-def remove_participant(data: dict) -> dict:
+def remove_participant(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, chatID: int, members: [str, ...] }
     Returns: { chatID: int }
     """
-    session_token = data.get("session_token")
     chat_id = data.get("chatID")
     rem_users = data.get("members", [])
 
-    if not session_token or chat_id is None or not isinstance(rem_users, list) or not rem_users:
-        raise BadRequest("session_token, chatID and members list are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid session token.")
+    if chat_id is None or not isinstance(rem_users, list) or not rem_users:
+        raise BadRequest("chatID and members list are required.")
 
     grp = fetch_records(
         table="chats",
@@ -346,20 +502,32 @@ def remove_participant(data: dict) -> dict:
     placeholders = ",".join(["%s"] * len(rem_users))
     rows = fetch_records(
         table="users",
-        where_clause=f"LOWER(username) IN ({placeholders})",
+        where_clause=f"username_key IN ({placeholders})",
         params=tuple(u.lower() for u in rem_users),
         fetch_all=True
     )
     if len(rows) != len(rem_users):
         raise NotFound("One or more users not found.")
-    user_ids = [r["userID"] for r in rows]
+    names = {r["userID"]: r["username"] for r in rows}
 
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        f"DELETE FROM participants WHERE chatID=%s AND userID IN ({placeholders})",
-        (chat_id, *user_ids)
+        f"SELECT userID FROM participants WHERE chatID=%s AND userID IN ({placeholders}) FOR UPDATE",
+        (chat_id, *names)
     )
+    removed = [r[0] for r in cur.fetchall()]
+    if removed:
+        fmt = ",".join(["%s"] * len(removed))
+        cur.execute(
+            f"DELETE FROM participants WHERE chatID=%s AND userID IN ({fmt})",
+            (chat_id, *removed)
+        )
+        version = _record_membership_change(cur, chat_id, "removed", removed)
+        publish_event(
+            "member_removed", chatID=chat_id, version=version, userIDs=removed,
+            usernames=[names[uid] for uid in removed], byUserID=user["userID"]
+        )
     conn.commit()
 
     return {"chatID": chat_id}
@@ -395,6 +563,7 @@ def _create_chat_logic(sender_id: int, receiver_id: int) -> int:
             """,
             (chat_id, sender_id, receiver_id)
         )
+        publish_event("chat_created", chatID=chat_id, creatorID=sender_id)
         return chat_id
 
     cursor.execute("INSERT INTO chats (type) VALUES ('private')")
@@ -404,41 +573,31 @@ def _create_chat_logic(sender_id: int, receiver_id: int) -> int:
             "INSERT INTO participants (chatID, userID) VALUES (%s,%s)",
             (chat_id, uid)
         )
+    publish_event("chat_created", chatID=chat_id, creatorID=sender_id)
     return chat_id
 
 
-def create_chat(data: dict) -> dict:
+def create_chat(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, receiver: str }
     Returns: { chatID: int }
     """
-    session_token = data.get("session_token")
     receiver = (data.get("receiver") or "").lower()
-    if not session_token or not receiver:
-        raise BadRequest("Session token and receiver are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-    if username.lower() == receiver:
+    if not receiver:
+        raise BadRequest("Receiver is required.")
+    if user["username"].lower() == receiver:
         raise BadRequest("Cannot chat with yourself.")
 
     try:
-        sender = fetch_records(
-            table="users",
-            where_clause="LOWER(username) = %s",
-            params=(username.lower(),),
-            fetch_all=True
-        )
         rec = fetch_records(
             table="users",
-            where_clause="LOWER(username) = %s",
+            where_clause="username_key = %s",
             params=(receiver,),
             fetch_all=True
         )
-        if not sender or not rec:
+        if not rec:
             raise NotFound("User not found.")
-        chat_id = _create_chat_logic(sender[0]["userID"], rec[0]["userID"])
+        chat_id = _create_chat_logic(user["userID"], rec[0]["userID"])
     except APIError:
         raise
     except Exception as e:
@@ -467,44 +626,32 @@ def _create_group_logic(owner_id: int, group_name: str, member_ids: list[int]) -
             "INSERT INTO participants (chatID, userID) VALUES (%s,%s)",
             (chat_id, uid)
         )
+    publish_event("chat_created", chatID=chat_id, creatorID=owner_id)
     return chat_id
 
 
-def create_group(data: dict) -> dict:
+def create_group(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, name: str, members: [str, ...] }
     Returns: { chatID: int }
     """
-    session_token = data.get("session_token")
     name = (data.get("name") or "").strip()
     members = data.get("members")
-    if not session_token or not name or not isinstance(members, list) or not members:
-        raise BadRequest("token, name and members list are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid session token.")
+    if not name or not isinstance(members, list) or not members:
+        raise BadRequest("name and members list are required.")
 
     try:
-        owner = fetch_records(
-            table="users",
-            where_clause="LOWER(username) = %s",
-            params=(username.lower(),),
-            fetch_all=True
-        )
-        if not owner:
-            raise NotFound("User not found.")
         ph = ",".join(["%s"] * len(members))
         rows = fetch_records(
             table="users",
-            where_clause=f"LOWER(username) IN ({ph})",
+            where_clause=f"username_key IN ({ph})",
             params=tuple(u.lower() for u in members),
             fetch_all=True
         )
         if len(rows) != len(members):
             raise NotFound("One or more members not found.")
         member_ids = [r["userID"] for r in rows]
-        chat_id = _create_group_logic(owner[0]["userID"], name, member_ids)
+        chat_id = _create_group_logic(user["userID"], name, member_ids)
     except APIError:
         raise
     except Exception as e:
@@ -514,28 +661,12 @@ def create_group(data: dict) -> dict:
     return {"chatID": chat_id}
 
 
-def fetch_archived(data: dict) -> dict:
+def fetch_archived(data: dict, user: dict) -> dict:
     """
     data: { session_token: str }
     Returns: { response: [ { chatID, name, type }, ... ] }
     """
-    session_token = data.get("session_token")
-    if not session_token:
-        raise BadRequest("Session token is required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-
-    users = fetch_records(
-        table="users",
-        where_clause="LOWER(username) = %s",
-        params=(username.lower(),),
-        fetch_all=True
-    )
-    if not users:
-        raise NotFound("User not found.")
-    user_id = users[0]["userID"]
+    user_id = user["userID"]
 
     try:
         conn = get_db()
@@ -571,29 +702,15 @@ def fetch_archived(data: dict) -> dict:
     return {"response": response}
 
 
-def unarchive_chat(data: dict) -> dict:
+def unarchive_chat(data: dict, user: dict) -> dict:
     """
     data: { session_token: str, chatID: int }
     Returns: { message: str }
     """
-    session_token = data.get("session_token")
     chat_id = data.get("chatID")
-    if not session_token or chat_id is None:
-        raise BadRequest("Session token and chatID are required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Unable to verify user!")
-
-    users = fetch_records(
-        table="users",
-        where_clause="LOWER(username) = %s",
-        params=(username.lower(),),
-        fetch_all=True
-    )
-    if not users:
-        raise NotFound("User not found.")
-    user_id = users[0]["userID"]
+    if chat_id is None:
+        raise BadRequest("chatID is required.")
+    user_id = user["userID"]
 
     try:
         conn = get_db()
@@ -602,6 +719,7 @@ def unarchive_chat(data: dict) -> dict:
             "UPDATE participants SET archived = 0 WHERE chatID = %s AND userID = %s",
             (chat_id, user_id)
         )
+        publish_event("chat_unarchived", chatID=chat_id, userID=user_id)
         conn.commit()
     except Exception as e:
         current_app.logger.error("Error unarchiving chat", exc_info=e)
@@ -0,0 +1,345 @@
+import logging
+import os
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from dotenv import load_dotenv
+
+from app.database.db_helper import get_db, close_db, insert_record
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Outbound mail goes through the mail_queue table instead of being sent
+# inside the request. Background worker threads claim due rows with a
+# lease (so several workers and server processes can share the table),
+# send them over an SMTP session they keep logged in between mails, and
+# retry failures with exponential backoff. Mail that is never sent stays
+# in the table as 'failed' with its last error.
+#
+# Every claim gets its own lease token in locked_by. A worker renews the
+# lease while it works through a batch, skips mails whose lease it lost and
+# only records outcomes for rows still holding its token, so a batch that
+# outlives its lease is not sent twice or recorded by two workers.
+#
+# For local runs point MAIL_SMTP_* at the stand-in server (smtp_standin.py).
+WORKERS = int(os.getenv("MAIL_WORKERS", 2))
+BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 10))
+POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 2))
+LEASE = int(os.getenv("MAIL_LEASE", 120)) # seconds a claimed batch is reserved for its worker
+# Renew the lease once less than this is left; one mail must fit in it
+LEASE_RENEW_BELOW = LEASE / 2
+MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 8))
+BACKOFF_BASE = float(os.getenv("MAIL_BACKOFF_BASE", 5))
+BACKOFF_MAX = float(os.getenv("MAIL_BACKOFF_MAX", 1800))
+RETENTION_DAYS = int(os.getenv("MAIL_RETENTION_DAYS", 7))
+
+SMTP_HOST = os.getenv("MAIL_SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("MAIL_SMTP_PORT", 465))
+SMTP_SSL = os.getenv("MAIL_SMTP_SSL", "true") == "true"
+SMTP_STARTTLS = os.getenv("MAIL_SMTP_STARTTLS") == "true"
+SMTP_TIMEOUT = float(os.getenv("MAIL_SMTP_TIMEOUT", 30))
+# Servers drop idle sessions; close ours before they do
+SMTP_IDLE_TIMEOUT = float(os.getenv("MAIL_SMTP_IDLE_TIMEOUT", 60))
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_workers: list["MailWorker"] = []
+_counters = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "lease_lost": 0, "smtp_logins": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _counters_lock:
+        _counters[name] += n
+
+
+def enqueue(subject: str, body: str, recipient: str) -> int:
+    """
+    Store a mail for the workers and wake them. Inside a @transactional
+    function it is only sent if the transaction commits.
+
+    :return: The mailID of the queued mail
+    """
+    mail_id = insert_record("mail_queue", {"recipient": recipient, "subject": subject, "body": body})
+    _count("queued")
+    _wakeup.set()
+    return mail_id
+
+
+class PermanentFailure(Exception):
+    """The server rejected the mail for good; retrying will not help."""
+
+
+def _refusals(e: smtplib.SMTPRecipientsRefused) -> str:
+    return "; ".join(f"{rcpt}: {code} {msg!r}" for rcpt, (code, msg) in e.recipients.items())
+
+
+class SMTPSession:
+    """
+    One logged-in SMTP connection, reused for every mail a worker sends and
+    re-established when the server dropped it or it sat idle too long.
+    """
+
+    def __init__(self):
+        self.user = os.getenv("EMAIL_USER")
+        self.password = os.getenv("EMAIL_PASSWORD")
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        if SMTP_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_STARTTLS:
+                server.starttls()
+        if self.user and self.password:
+            try:
+                server.login(self.user, self.password)
+            except smtplib.SMTPException:
+                server.close()
+                raise
+            _count("smtp_logins")
+        return server
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def send(self, recipient: str, subject: str, body: str) -> None:
+        """
+        Raises PermanentFailure for rejections, anything else is worth a retry.
+        """
+        msg = MIMEMultipart()
+        msg["From"] = self.user or "chatcli@localhost"
+        msg["To"] = recipient
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "plain"))
+
+        for attempt in (1, 2):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.sendmail(msg["From"], recipient, msg.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # a reused session may have been dropped; reconnect once
+                self._server = None
+                if attempt == 2:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                # 450/451/452 (greylisting, full mailbox) are worth retrying
+                if all(code >= 500 for code, _ in e.recipients.values()):
+                    raise PermanentFailure(_refusals(e))
+                raise
+            except smtplib.SMTPResponseException as e:
+                # smtplib resets the transaction, so the session stays usable
+                # unless the server is shutting it down
+                if e.smtp_code == 421:
+                    self.close()
+                elif 500 <= e.smtp_code < 600:
+                    raise PermanentFailure(f"{e.smtp_code} {e.smtp_error!r}")
+                raise
+
+
+def _claim(token: str) -> list[dict]:
+    """
+    Reserve up to BATCH_SIZE due mails under the lease `token`.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        UPDATE mail_queue
+        SET locked_by = %s, locked_until = NOW() + INTERVAL %s SECOND
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+          AND (locked_until IS NULL OR locked_until < NOW())
+        ORDER BY mailID
+        LIMIT %s
+        """,
+        (token, LEASE, BATCH_SIZE)
+    )
+    if not cur.rowcount:
+        return []
+    cur = conn.cursor(dictionary=True)
+    cur.execute(
+        "SELECT mailID, recipient, subject, body, attempts FROM mail_queue "
+        "WHERE locked_by = %s AND status = 'pending' ORDER BY mailID",
+        (token,)
+    )
+    return cur.fetchall()
+
+
+def _renew(token: str) -> set[int]:
+    """
+    Extend the lease `token` and return the mailIDs it still holds.
+    """
+    conn = get_db()
+    conn.cursor().execute(
+        "UPDATE mail_queue SET locked_until = NOW() + INTERVAL %s SECOND WHERE locked_by = %s AND status = 'pending'",
+        (LEASE, token)
+    )
+    cur = conn.cursor(dictionary=True)
+    cur.execute("SELECT mailID FROM mail_queue WHERE locked_by = %s AND status = 'pending'", (token,))
+    return {row["mailID"] for row in cur.fetchall()}
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before the next try after `attempts` failed ones, with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _record(token: str, results: list[tuple[dict, str | None, bool]]) -> None:
+    """
+    Store the outcome of a batch: (mail, error or None, permanent). Rows no
+    longer held by the lease `token` belong to another worker and are left alone.
+    """
+    cur = get_db().cursor()
+    for mail, error, permanent in results:
+        if error is None:
+            cur.execute(
+                "UPDATE mail_queue SET status = 'sent', sent_at = NOW(), locked_by = NULL, locked_until = NULL "
+                "WHERE mailID = %s AND locked_by = %s",
+                (mail["mailID"], token)
+            )
+            _count("sent")
+        else:
+            attempts = mail["attempts"] + 1
+            if permanent or attempts >= MAX_ATTEMPTS:
+                cur.execute(
+                    "UPDATE mail_queue SET status = 'failed', attempts = %s, last_error = %s, "
+                    "locked_by = NULL, locked_until = NULL WHERE mailID = %s AND locked_by = %s",
+                    (attempts, error[:255], mail["mailID"], token)
+                )
+                _count("failed")
+                logger.error("Giving up on mail %s to %s: %s", mail["mailID"], mail["recipient"], error)
+            else:
+                cur.execute(
+                    "UPDATE mail_queue SET attempts = %s, last_error = %s, "
+                    "next_attempt_at = NOW() + INTERVAL %s SECOND, locked_by = NULL, locked_until = NULL "
+                    "WHERE mailID = %s AND locked_by = %s",
+                    (attempts, error[:255], int(backoff(attempts)), mail["mailID"], token)
+                )
+                _count("retried")
+                logger.warning("Mail %s to %s failed (attempt %s): %s", mail["mailID"], mail["recipient"], attempts, error)
+        if not cur.rowcount:
+            _count("lease_lost")
+            logger.warning("Lease on mail %s expired before its outcome was stored", mail["mailID"])
+
+
+def _prune() -> None:
+    get_db().cursor().execute(
+        "DELETE FROM mail_queue WHERE status = 'sent' AND sent_at < NOW() - INTERVAL %s DAY",
+        (RETENTION_DAYS,)
+    )
+
+
+class MailWorker(threading.Thread):
+    """
+    Drains mail_queue until stop_workers() is called. Database work runs in
+    short app contexts so the pooled connection is not held during SMTP.
+    """
+
+    def __init__(self, app, index: int):
+        super().__init__(name=f"mail-worker-{index}", daemon=True)
+        self.app = app
+        self.worker_id = f"{socket.gethostname()[:16]}-{uuid.uuid4().hex[:12]}"
+        self.smtp = SMTPSession()
+        self._last_prune = 0.0
+
+    def _db(self, fn, *args):
+        with self.app.app_context():
+            try:
+                return fn(*args)
+            finally:
+                close_db()
+
+    def run_once(self) -> int:
+        """
+        Claim and send one batch. Returns how many mails it handled.
+        """
+        token = f"{self.worker_id}-{uuid.uuid4().hex[:12]}"
+        leased_at = time.monotonic()
+        batch = self._db(_claim, token)
+        held = {mail["mailID"] for mail in batch}
+        results = []
+        for mail in batch:
+            if time.monotonic() - leased_at > LEASE - LEASE_RENEW_BELOW:
+                leased_at = time.monotonic()
+                held = self._db(_renew, token)
+            if mail["mailID"] not in held:
+                # reclaimed by another worker after our lease ran out
+                _count("lease_lost")
+                continue
+            try:
+                self.smtp.send(mail["recipient"], mail["subject"], mail["body"])
+                results.append((mail, None, False))
+            except PermanentFailure as e:
+                results.append((mail, str(e), True))
+            except smtplib.SMTPRecipientsRefused as e:
+                results.append((mail, _refusals(e), False))
+            except smtplib.SMTPResponseException as e:
+                results.append((mail, f"{e.smtp_code} {e.smtp_error!r}", False))
+            except (smtplib.SMTPException, OSError) as e:
+                self.smtp.close()
+                results.append((mail, f"{type(e).__name__}: {e}", False))
+        if results:
+            self._db(_record, token, results)
+        return len(batch)
+
+    def run(self) -> None:
+        while not _stop.is_set():
+            try:
+                if self.run_once() >= BATCH_SIZE:
+                    continue
+                if time.monotonic() - self._last_prune >= 3600:
+                    self._last_prune = time.monotonic()
+                    self._db(_prune)
+            except Exception as e:
+                logger.error("Mail worker %s failed: %s", self.name, e, exc_info=e)
+            self.smtp.close_if_idle()
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+        self.smtp.close()
+
+
+def start_workers(app, count: int = WORKERS) -> None:
+    if LEASE_RENEW_BELOW < 2 * SMTP_TIMEOUT:
+        logger.warning("MAIL_LEASE=%s is short for MAIL_SMTP_TIMEOUT=%s; slow mails may be sent twice",
+                       LEASE, SMTP_TIMEOUT)
+    _stop.clear()
+    for i in range(count):
+        worker = MailWorker(app, i)
+        worker.start()
+        _workers.append(worker)
+    logger.info("Started %s mail workers (SMTP %s:%s)", count, SMTP_HOST, SMTP_PORT)
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    _stop.set()
+    _wakeup.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+
+def mail_queue_stats() -> dict:
+    with _counters_lock:
+        return {**_counters, "workers": sum(1 for w in _workers if w.is_alive())}
@@ -1,7 +1,4 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import logging
 from dotenv import load_dotenv
 
@@ -10,41 +7,27 @@ load_dotenv()
 URL = os.getenv("PUB_URL", '127.0.0.1')
 
 from app.errors import APIError
+from app.services.mail_queue import enqueue
 
 logger = logging.getLogger(__name__)
 
 
-def send_email(subject: str, body: str, recipient: str) -> None:
+def send_email(subject: str, body: str, recipient: str) -> int:
     """
-    Send an email via configured SMTP server.
+    Queue an email for the mail workers (see mail_queue.py), which send it
+    over a reused SMTP session and retry it if the server is unavailable.
 
-    Raises APIError on failure.
+    Raises APIError if it could not be queued.
 
     :param subject:   Email subject
     :param body:      Email body (plain text)
     :param recipient: Recipient email address
+    :return: The mailID of the queued mail
     """
-    email_acc = os.getenv("EMAIL_USER")
-    email_pssw = os.getenv("EMAIL_PASSWORD")
-
-    msg = MIMEMultipart()
-    msg['From'] = email_acc
-    msg['To'] = recipient
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(email_acc, email_pssw)
-            server.sendmail(email_acc, recipient, msg.as_string())
-    except smtplib.SMTPAuthenticationError as e:
-        logger.error("SMTP auth failed for %s: %s", recipient, e, exc_info=e)
-        raise APIError("Email service authentication failed.")
-    except smtplib.SMTPConnectError as e:
-        logger.error("SMTP connection failed: %s", e, exc_info=e)
-        raise APIError("Email service unavailable.")
+        return enqueue(subject, body, recipient)
     except Exception as e:
-        logger.error("Failed to send email to %s: %s", recipient, e, exc_info=e)
+        logger.error("Failed to queue email to %s: %s", recipient, e, exc_info=e)
         raise APIError("Failed to send email.")
 
 
@@ -0,0 +1,20 @@
+import json
+import logging
+
+from app.database.db_helper import insert_record
+
+logger = logging.getLogger(__name__)
+
+
+def publish_event(event: str, **payload) -> None:
+    """
+    Queue a change event for the WebSocket server, which polls ws_outbox and
+    turns it into targeted WebSocket messages (see websockets/change_feed.py).
+
+    Inside a @transactional function the row commits or rolls back together
+    with the change it describes.
+
+    :param event:   Event name, e.g. "chat_created"
+    :param payload: JSON-serializable event fields (IDs, not usernames, where possible)
+    """
+    insert_record("ws_outbox", {"event": event, "payload": json.dumps(payload, default=str)})
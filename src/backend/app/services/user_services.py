@@ -10,7 +10,11 @@ import os
 
 from app.errors import BadRequest, Unauthorized, Forbidden, NotFound, Conflict, APIError
 from app.database.db_helper import fetch_records, insert_record, update_records
-from app.services.base_services import authenticate_token
+from app.services.base_services import (
+    invalidate_session,
+    invalidate_user_sessions,
+)
+from app.services.outbox_services import publish_event
 from app.services.mail_services import (
     send_verification_email,
     send_password_reset_email,
@@ -57,8 +61,8 @@ def register(data: dict) -> dict:
         # check existing user
         users = fetch_records(
             table="users",
-            where_clause="LOWER(username) = LOWER(%s)",
-            params=(username,),
+            where_clause="username_key = %s",
+            params=(username.lower(),),
             fetch_all=True
         )
 
@@ -139,7 +143,7 @@ def verify_email(data: dict) -> dict:
         row = fetch_records(
             table="email_tokens",
             where_clause=(
-                "userID = (SELECT userID FROM users WHERE LOWER(username) = LOWER(%s)) "
+                "userID = (SELECT userID FROM users WHERE username_key = %s) "
                 "AND revoked = FALSE AND expires_at > %s"
             ),
             params=(username, datetime.now(timezone.utc)),
@@ -186,8 +190,8 @@ def resend_verification(data: dict) -> dict:
     try:
         users = fetch_records(
             table="users",
-            where_clause="LOWER(username) = LOWER(%s)",
-            params=(username,),
+            where_clause="username_key = %s",
+            params=(username.lower(),),
             fetch_all=True
         )
         if not users:
@@ -241,7 +245,7 @@ def login(data: dict) -> dict:
     try:
         users = fetch_records(
             table="users",
-            where_clause="username = %s AND email_verified = 1 AND disabled = 0",
+            where_clause="username_key = %s AND email_verified = 1 AND disabled = 0",
             params=(username,),
             fetch_all=True
         )
@@ -262,6 +266,9 @@ def login(data: dict) -> dict:
             where_clause="userID = %s",
             where_params=(user["userID"],)
         )
+        invalidate_user_sessions(user["userID"])
+        # sockets opened with the new token must survive the event
+        publish_event("sessions_revoked", userID=user["userID"], keep=access_hash)
         insert_record(
             "session_tokens",
             {
@@ -402,8 +409,8 @@ def reset_password_request(data: dict) -> dict:
     try:
         users = fetch_records(
             table="users",
-            where_clause="LOWER(username) = LOWER(%s)",
-            params=(username,),
+            where_clause="username_key = %s",
+            params=(username.lower(),),
             fetch_all=True
         )
         if not users:
@@ -428,8 +435,7 @@ def reset_password_request(data: dict) -> dict:
         current_app.logger.error("Error during password-reset request", exc_info=e)
         raise APIError()
 
-    if not send_password_reset_email(user["username"], reset_plain, user["email"]):
-        raise APIError("Failed to send password reset email.")
+    send_password_reset_email(user["username"], reset_plain, user["email"])
 
     return {"message": "Password reset email sent!"}
 
@@ -474,8 +480,8 @@ def reset_password(data: dict) -> dict:
         # verify user match
         users = fetch_records(
             table="users",
-            where_clause="userID = %s AND LOWER(username) = LOWER(%s)",
-            params=(row["userID"], username),
+            where_clause="userID = %s AND username_key = %s",
+            params=(row["userID"], username.lower()),
             fetch_all=True
         )
         if not users:
@@ -504,64 +510,27 @@ def reset_password(data: dict) -> dict:
     return {"message": "Password reset successfully"}
 
 
-def profile(data: dict) -> dict:
+def profile(data: dict, user: dict) -> dict:
     """
     Returns user profile for valid session token.
     """
-    token = (data.get("session_token") or "").strip()
-    if not token:
-        raise BadRequest("Session token is required.")
+    return {"username": user["username"], "email": user.get("email") or ""}
 
-    username = authenticate_token(token)
-    if not username:
-        raise Unauthorized("Invalid or expired session token.")
 
-    try:
-        user = fetch_records(
-            table="users",
-            where_clause="username = %s",
-            params=(username,),
-            fetch_all=False
-        )
-        if not user:
-            raise NotFound("User not found.")
-    except APIError:
-        raise
-    except Exception as e:
-        current_app.logger.error("Error fetching profile", exc_info=e)
-        raise APIError()
-
-    return {"username": user["username"], "email": user.get("email", "")}  
-
-
-def submit_profile(data: dict) -> dict:
+def submit_profile(data: dict, user: dict) -> dict:
     """
     Updates or disables/deletes user profile.
     """
-    token      = (data.get("session_token") or "").strip()
     new_u      = (data.get("username") or "").strip()
     new_e      = (data.get("email") or "").strip()
     disable    = bool(data.get("disable"))
     delete_acc = bool(data.get("delete"))
 
-    if not token:
-        raise BadRequest("Session token is required.")
-
-    username = authenticate_token(token)
-    if not username:
-        raise Unauthorized("Invalid or expired session token.")
+    username = user["username"]
 
     try:
-        user = fetch_records(
-            table="users",
-            where_clause="username = %s",
-            params=(username,),
-            fetch_all=False
-        )
-        if not user:
-            raise NotFound("User not found.")
         userID   = user["userID"]
-        old_email = user.get("email", "")
+        old_email = user.get("email") or ""
 
         # handle delete
         if delete_acc:
@@ -617,6 +586,8 @@ def submit_profile(data: dict) -> dict:
                 where_clause="userID = %s",
                 where_params=(userID,),
             )
+            invalidate_user_sessions(userID)
+            publish_event("user_deactivated", userID=userID)
 
             return {"disable": False, "delete": True, "message": "Account deleted."}
 
@@ -643,6 +614,8 @@ def submit_profile(data: dict) -> dict:
                 where_clause="userID = %s",
                 where_params=(userID,),
             )
+            invalidate_user_sessions(userID)
+            publish_event("user_deactivated", userID=userID)
 
             return {"disable": True, "delete": False, "message": "Account disabled."}
 
@@ -661,6 +634,10 @@ def submit_profile(data: dict) -> dict:
                 where_clause="userID = %s",
                 where_params=(userID,)
             )
+            # cached identities carry the old username
+            invalidate_user_sessions(userID)
+            if "username" in update_data:
+                publish_event("profile_updated", userID=userID, username=new_u, old_username=username)
             if "email" in update_data:
                 code = f"{random.randint(100000, 999999):06d}"
                 expiry = datetime.now(timezone.utc) + timedelta(minutes=5)
@@ -683,16 +660,13 @@ def submit_profile(data: dict) -> dict:
         raise APIError()
 
 
-def change_password(data: dict) -> dict:
+def change_password(data: dict, user: dict) -> dict:
     """
     Changes the user's password.
     """
-    token        = (data.get("session_token") or "").strip()
     old_password = (data.get("current_password") or "").strip()
     new_password = (data.get("new_password") or "").strip()
 
-    if not token:
-        raise BadRequest("Session token is required.")
     if not old_password:
         raise BadRequest("Old password is required.")
     if not new_password:
@@ -700,15 +674,12 @@ def change_password(data: dict) -> dict:
     if new_password == old_password:
         raise BadRequest("New password cannot be the same as old password.")
 
-    username = authenticate_token(token)
-    if not username:
-        raise Unauthorized("Invalid or expired session token.")
-
     try:
+        # the cached identity does not carry the password hash
         user = fetch_records(
             table="users",
-            where_clause="username = %s",
-            params=(username,),
+            where_clause="userID = %s",
+            params=(user["userID"],),
             fetch_all=False
         )
         if not user:
@@ -743,6 +714,8 @@ def change_password(data: dict) -> dict:
             where_clause="userID = %s",
             where_params=(user["userID"],)
         )
+        invalidate_user_sessions(user["userID"])
+        publish_event("sessions_revoked", userID=user["userID"])
 
     except APIError:
         raise
@@ -752,30 +725,17 @@ def change_password(data: dict) -> dict:
 
     return {"message": "Password changed successfully."}
 
-def logout(data: dict) -> dict:
+def logout(data: dict, user: dict) -> dict:
     """
     Revokes all tokens for the user.
     """
     session_token = (data.get("session_token") or "").strip()
     refresh_token = (data.get("refresh_token") or "").strip()
-    if not session_token: raise BadRequest("Session token is required.")
     if not refresh_token: raise BadRequest("Refresh token is required.")
     session_hash = hashlib.sha256(session_token.encode()).hexdigest()
     refresh_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
 
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid or expired session token.")
-
     try:
-        user = fetch_records(
-            table="users",
-            where_clause="username = %s",
-            params=(username,),
-            fetch_all=False
-        )
-        if not user:
-            raise NotFound("User not found.")
         userID = user["userID"]
 
         update_records(
@@ -790,6 +750,8 @@ def logout(data: dict) -> dict:
             where_clause="token = %s AND userID = %s",
             where_params=(refresh_hash, userID)
         )
+        invalidate_session(session_token)
+        publish_event("sessions_revoked", userID=userID, session=session_hash)
 
     except APIError:
         raise
@@ -799,27 +761,11 @@ def logout(data: dict) -> dict:
 
     return {"message": "Logged out successfully."}
 
-def logout_all(data: dict) -> dict:
+def logout_all(data: dict, user: dict) -> dict:
     """
     Revokes all tokens for the user across all sessions.
     """
-    session_token = (data.get("session_token") or "").strip()
-    if not session_token:
-        raise BadRequest("Session token is required.")
-
-    username = authenticate_token(session_token)
-    if not username:
-        raise Unauthorized("Invalid or expired session token.")
-
     try:
-        user = fetch_records(
-            table="users",
-            where_clause="username = %s",
-            params=(username,),
-            fetch_all=False
-        )
-        if not user:
-            raise NotFound("User not found.")
         userID = user["userID"]
 
         update_records(
@@ -834,6 +780,8 @@ def logout_all(data: dict) -> dict:
             where_clause="userID = %s",
             where_params=(userID,)
         )
+        invalidate_user_sessions(userID)
+        publish_event("sessions_revoked", userID=userID)
 
     except APIError:
         raise
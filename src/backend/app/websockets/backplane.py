@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import uuid
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# Backplane between WebSocket server processes. Every node delivers to its
+# own sockets directly and publishes the same event for the other nodes,
+# which deliver it to theirs.
+#
+#   WS_BACKPLANE=local   single process (default); events stay in-process
+#   WS_BACKPLANE=socket  nodes connect to a broker (`python backplane.py broker`)
+#                        at WS_BACKPLANE_ADDRESS: "host:port" or "unix:/path"
+BACKEND = os.getenv("WS_BACKPLANE", "local")
+ADDRESS = os.getenv("WS_BACKPLANE_ADDRESS", "127.0.0.1:8790")
+QUEUE_SIZE = int(os.getenv("WS_BACKPLANE_QUEUE_SIZE", 10000))
+RECONNECT_DELAY = 1.0
+# Broker frames are JSON lines; keep in line with the inbound frame limits
+LINE_LIMIT = 1024 * 1024
+
+NODE_ID = uuid.uuid4().hex[:12]
+
+
+class Backplane(ABC):
+    """
+    Fan-out of events to the *other* nodes. `handler(event)` is the
+    coroutine that delivers an event published elsewhere to local sockets.
+    `nodes` is the current set of live node ids (including this one), kept
+    up to date from the "nodes" / "node_up" / "node_down" events, which are
+    passed on to the handler as well.
+    """
+
+    def __init__(self, node_id: str = NODE_ID):
+        self.node_id = node_id
+        self.nodes: set[str] = {node_id}
+        self._handler = None
+        self._counters = {"published": 0, "received": 0, "dropped": 0, "handler_errors": 0}
+
+    async def start(self, handler) -> None:
+        self._handler = handler
+
+    async def stop(self) -> None:
+        self._handler = None
+
+    @abstractmethod
+    async def publish(self, event: dict, to: str | None = None) -> None:
+        """
+        Send `event` to every other node, or only to node `to`.
+        """
+
+    async def _dispatch(self, event: dict) -> None:
+        self._counters["received"] += 1
+        op = event.get("op")
+        if op == "nodes":
+            self.nodes = set(event["nodes"]) | {self.node_id}
+        elif op == "node_up":
+            self.nodes.add(event["node"])
+        elif op == "node_down":
+            self.nodes.discard(event["node"])
+        if self._handler is None:
+            return
+        try:
+            await self._handler(event)
+        except Exception as e:
+            self._counters["handler_errors"] += 1
+            logger.error("Backplane handler failed for %s: %s", event.get("op"), e, exc_info=e)
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "node": self.node_id, "nodes": len(self.nodes), **self._counters}
+
+
+class InProcessBackplane(Backplane):
+    """
+    Nodes attached to the same hub share events without any I/O. With one
+    node (the normal single-process setup) publishing costs nothing; several
+    nodes on one hub are handy for exercising multi-node paths in one process.
+    """
+
+    _default_hub: list["InProcessBackplane"] = []
+
+    def __init__(self, node_id: str = NODE_ID, hub: list | None = None):
+        super().__init__(node_id)
+        self._hub = self._default_hub if hub is None else hub
+
+    async def start(self, handler) -> None:
+        await super().start(handler)
+        self._hub.append(self)
+        await self._dispatch({"op": "nodes", "nodes": [n.node_id for n in self._hub], "origin": self.node_id})
+        await self.publish({"op": "node_up", "node": self.node_id})
+
+    async def stop(self) -> None:
+        if self in self._hub:
+            self._hub.remove(self)
+            for node in list(self._hub):
+                await node._dispatch({"op": "node_down", "node": self.node_id, "origin": self.node_id})
+        await super().stop()
+
+    async def publish(self, event: dict, to: str | None = None) -> None:
+        event.setdefault("origin", self.node_id)
+        self._counters["published"] += 1
+        for node in list(self._hub):
+            if node is not self and (to is None or node.node_id == to):
+                await node._dispatch(event)
+
+
+def _parse_address(address: str):
+    if address.startswith("unix:"):
+        return {"path": address[len("unix:"):]}
+    host, _, port = address.rpartition(":")
+    return {"host": host or "127.0.0.1", "port": int(port)}
+
+
+async def _open_connection(address: str):
+    kw = _parse_address(address)
+    if "path" in kw:
+        return await asyncio.open_unix_connection(kw["path"], limit=LINE_LIMIT)
+    return await asyncio.open_connection(kw["host"], kw["port"], limit=LINE_LIMIT)
+
+
+class SocketBackplane(Backplane):
+    """
+    Client of the line-based broker below. Publishing never blocks on the
+    network: events go to a bounded queue drained by a writer task, and the
+    connection is re-established in the background if the broker restarts
+    (events published while disconnected are dropped and counted).
+    """
+
+    def __init__(self, address: str = ADDRESS, node_id: str = NODE_ID, queue_size: int = QUEUE_SIZE):
+        super().__init__(node_id)
+        self.address = address
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._connected = asyncio.Event()
+        self._task = None
+        self._counters["reconnects"] = 0
+
+    async def start(self, handler) -> None:
+        await super().start(handler)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await super().stop()
+
+    async def publish(self, event: dict, to: str | None = None) -> None:
+        if not self._connected.is_set():
+            self._counters["dropped"] += 1
+            return
+        event.setdefault("origin", self.node_id)
+        if to is not None:
+            event["to"] = to
+        try:
+            self._queue.put_nowait(event)
+            self._counters["published"] += 1
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await _open_connection(self.address)
+            except OSError as e:
+                logger.warning("Backplane broker %s unreachable: %s", self.address, e)
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            writer.write((json.dumps({"op": "hello", "node": self.node_id}) + "\n").encode())
+            self._connected.set()
+            logger.info("Backplane node %s connected to %s", self.node_id, self.address)
+            sender = asyncio.create_task(self._send(writer))
+            try:
+                await self._receive(reader)
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                logger.warning("Backplane connection lost: %s", e)
+            finally:
+                self._connected.clear()
+                sender.cancel()
+                writer.close()
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                    self._counters["dropped"] += 1
+            # Cut off from the others until the broker is back
+            await self._dispatch({"op": "nodes", "nodes": [self.node_id], "origin": self.node_id})
+            self._counters["reconnects"] += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _send(self, writer) -> None:
+        while True:
+            event = await self._queue.get()
+            writer.write((json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n").encode())
+            if self._queue.empty():
+                await writer.drain()
+
+    async def _receive(self, reader) -> None:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            event = json.loads(line)
+            if event.get("origin") != self.node_id:
+                await self._dispatch(event)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "address": self.address,
+            "connected": self._connected.is_set(),
+            "queued": self._queue.qsize(),
+        }
+
+
+def create(backend: str = BACKEND) -> Backplane:
+    if backend == "local":
+        return InProcessBackplane()
+    if backend == "socket":
+        return SocketBackplane()
+    raise ValueError("WS_BACKPLANE must be 'local' or 'socket'")
+
+
+# ---- broker ----
+
+class _NodeLink:
+    """
+    The broker's side of one node connection: lines for the node are
+    queued and written by their own task, which waits for the socket to
+    drain without holding up the readers of the other nodes.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer = writer
+        self.node_id = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.task = asyncio.create_task(self._write())
+
+    def send(self, line: bytes) -> None:
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            if not self.dropped:
+                logger.warning("Node %s is not keeping up; dropping lines for it", self.node_id)
+            self.dropped += 1
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                self.writer.write(await self.queue.get())
+                if self.queue.empty():
+                    await self.writer.drain()
+        except (OSError, ConnectionError) as e:
+            logger.warning("Writing to node %s failed: %s", self.node_id, e)
+            self.writer.close()
+
+    def close(self) -> None:
+        self.task.cancel()
+        self.writer.close()
+
+async def run_broker(address: str = ADDRESS, queue_size: int = QUEUE_SIZE) -> None:
+    """
+    Relay every line from one node to all other nodes, or to the single
+    node named in its top-level "to" field. A joining node is told who is
+    there ({"op": "nodes"}) and the others get {"op": "node_up"}; when a node
+    goes away the others get {"op": "node_down", "node": ...} so they can
+    forget what it owned (e.g. its online users).
+
+    Each node has its own bounded outgoing queue and writer task, so a slow
+    node only delays itself; lines that do not fit in its queue are dropped
+    and counted, as SocketBackplane does when publishing.
+    """
+    links: dict[asyncio.StreamWriter, _NodeLink] = {}
+    by_id: dict[str, _NodeLink] = {}
+
+    def relay(line: bytes, source) -> None:
+        for link in list(links.values()):
+            if link.writer is not source:
+                link.send(line)
+
+    def broker_event(event: dict) -> bytes:
+        return (json.dumps({**event, "origin": "broker"}) + "\n").encode()
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        link = links[writer] = _NodeLink(writer, queue_size)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                event = json.loads(line)
+                if link.node_id is None:
+                    link.node_id = event.get("node")
+                    by_id[link.node_id] = link
+                    logger.info("Node %s joined (%s connected)", link.node_id, len(links))
+                    link.send(broker_event({"op": "nodes", "nodes": list(by_id)}))
+                    relay(broker_event({"op": "node_up", "node": link.node_id}), writer)
+                    continue
+                to = event.get("to") if isinstance(event, dict) else None
+                if isinstance(to, str):
+                    target = by_id.get(to)
+                    if target is not None:
+                        target.send(line)
+                    continue
+                relay(line, writer)
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            logger.warning("Node %s dropped: %s", link.node_id, e)
+        finally:
+            links.pop(writer, None)
+            link.close()
+            # A stale link of a node that already reconnected must not report it down
+            if link.node_id and by_id.get(link.node_id) is link:
+                by_id.pop(link.node_id, None)
+                logger.info("Node %s left (%s connected, %s lines dropped)", link.node_id, len(links), link.dropped)
+                relay(broker_event({"op": "node_down", "node": link.node_id}), None)
+            elif link.node_id:
+                logger.info("Stale link of node %s closed (%s lines dropped)", link.node_id, link.dropped)
+
+    kw = _parse_address(address)
+    if "path" in kw:
+        if os.path.exists(kw["path"]):
+            os.remove(kw["path"])
+        server = await asyncio.start_unix_server(serve, kw["path"], limit=LINE_LIMIT)
+    else:
+        server = await asyncio.start_server(serve, kw["host"], kw["port"], limit=LINE_LIMIT)
+    logger.info("Backplane broker listening on %s", address)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "broker":
+        print("usage: python backplane.py broker [address]")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_broker(sys.argv[2] if len(sys.argv) > 2 else ADDRESS))
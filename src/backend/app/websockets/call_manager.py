@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from fastapi import WebSocket
+import outbound
+
+logger = logging.getLogger(__name__)
+
+# Call state of this node: the sessions, the current call of each chat and
+# the signaling sockets in each call's room. Sessions are replicated to the
+# other nodes (services.sync_call), including which users are in the room.
+# A room holds dedicated /call/{call_id} sockets as well as chat sockets
+# that joined it to multiplex signaling (see calls.join_signaling).
+#
+# A session goes away when it is ended or declined, when its caller's chat
+# socket disconnects while it is still ringing, when nobody answers within
+# RING_TIMEOUT, or when an accepted call has nobody in its room for
+# IDLE_TIMEOUT. Without the last three, abandoned calls kept their chat
+# CHAT_BUSY and their state in memory forever.
+RING_TIMEOUT = float(os.getenv("CALL_RING_TIMEOUT", 45))
+IDLE_TIMEOUT = float(os.getenv("CALL_IDLE_TIMEOUT", 60))
+SWEEP_INTERVAL = float(os.getenv("CALL_SWEEP_INTERVAL", 5))
+
+
+class CallSession:
+    __slots__ = ("call_id", "chatID", "initiator", "state", "peers", "since", "empty_since")
+
+    def __init__(self, call_id: str, chatID: int, initiator: str, state: str = "ringing"):
+        self.call_id = call_id
+        self.chatID = chatID
+        self.initiator = initiator
+        self.state = state
+        self.peers: set[str] = set() # usernames in the signaling room, on any node
+        self.since = time.monotonic() # when it entered its current state
+        self.empty_since: float | None = self.since
+
+    def to_dict(self) -> dict:
+        return {"chatID": self.chatID, "initiator": self.initiator, "state": self.state, "peers": sorted(self.peers)}
+
+
+sessions: dict[str, CallSession] = {} # call_id -> session
+chat_calls: dict[int, str] = {} # chatID -> call_id of its current call
+rooms: dict[str, dict[WebSocket, str]] = {} # call_id -> {signaling socket on this node: username}
+muxed: dict[WebSocket, set[str]] = {} # chat socket -> call_ids whose rooms it joined
+_counters = {"started": 0, "ended": 0, "no_answer": 0, "idle": 0, "caller_left": 0}
+
+
+def start(chatID: int, initiator: str) -> CallSession:
+    session = CallSession(str(uuid.uuid4()), chatID, initiator)
+    sessions[session.call_id] = session
+    chat_calls[chatID] = session.call_id
+    _counters["started"] += 1
+    return session
+
+
+def get(call_id: str) -> CallSession | None:
+    return sessions.get(call_id)
+
+
+def for_chat(chatID: int) -> CallSession | None:
+    call_id = chat_calls.get(chatID)
+    return sessions.get(call_id) if call_id else None
+
+
+def set_state(session: CallSession, state: str) -> None:
+    session.state = state
+    session.since = time.monotonic()
+    if not session.peers:
+        session.empty_since = session.since
+
+
+def end(chatID: int) -> CallSession | None:
+    """
+    Forget the current call of a chat. Returns it, if there was one.
+    """
+    call_id = chat_calls.pop(chatID, None)
+    session = sessions.pop(call_id, None) if call_id else None
+    if session is not None:
+        _counters["ended"] += 1
+    return session
+
+
+def _set_peers(session: CallSession, peers: set[str]) -> None:
+    session.peers = peers
+    if peers:
+        session.empty_since = None
+    elif session.empty_since is None:
+        session.empty_since = time.monotonic()
+
+
+def apply_remote(chatID: int, call_id: str | None, data: dict | None) -> str | None:
+    """
+    Mirror the current call of a chat as published by another node.
+    Returns the id of a call this replaced or ended, if any.
+    """
+    old = chat_calls.get(chatID)
+    if not call_id or not data:
+        chat_calls.pop(chatID, None)
+        if old:
+            sessions.pop(old, None)
+        return old
+    if old and old != call_id:
+        sessions.pop(old, None)
+    else:
+        old = None
+    session = sessions.get(call_id)
+    if session is None:
+        session = sessions[call_id] = CallSession(call_id, chatID, data.get("initiator"), data.get("state", "ringing"))
+    elif session.state != data.get("state"):
+        set_state(session, data["state"])
+    _set_peers(session, set(data.get("peers") or ()))
+    chat_calls[chatID] = call_id
+    return old
+
+
+def join_room(call_id: str, ws: WebSocket, username: str, multiplexed: bool = False) -> CallSession | None:
+    rooms.setdefault(call_id, {})[ws] = username
+    if multiplexed:
+        muxed.setdefault(ws, set()).add(call_id)
+    session = sessions.get(call_id)
+    if session is not None:
+        _set_peers(session, session.peers | {username})
+    return session
+
+
+def leave_room(call_id: str, ws: WebSocket) -> list[WebSocket] | None:
+    """
+    Remove a signaling socket from its room. Returns the sockets left in the
+    room, or None if it was not in it.
+    """
+    room = rooms.get(call_id)
+    if room is None or ws not in room:
+        return None
+    username = room.pop(ws)
+    if not room:
+        rooms.pop(call_id, None)
+    calls = muxed.get(ws)
+    if calls is not None:
+        calls.discard(call_id)
+        if not calls:
+            muxed.pop(ws, None)
+    session = sessions.get(call_id)
+    if session is not None and username not in room.values():
+        _set_peers(session, session.peers - {username})
+    return list(room)
+
+
+def relay(call_id: str, data, sender: WebSocket | None = None) -> int:
+    """
+    Send a signaling payload to everyone in the room but `sender`: as is to
+    /call sockets, wrapped in a call_signal frame to chat sockets. Each
+    form is encoded once. Returns the number of sockets it was queued for.
+    """
+    raw = wrapped = None
+    sent = 0
+    for peer in list(rooms.get(call_id, ())):
+        if peer is sender:
+            continue
+        if peer in muxed:
+            if wrapped is None:
+                wrapped = outbound.encode({"type": "call_signal", "call_id": call_id, "data": data})
+            outbound.send(peer, wrapped)
+        else:
+            if raw is None:
+                raw = outbound.encode(data)
+            outbound.send(peer, raw)
+        sent += 1
+    return sent
+
+
+async def close_room(call_id: str) -> None:
+    """
+    Close the /call sockets of a call that is over (their endpoint removes
+    them from the room) and drop the chat sockets from it.
+    """
+    for ws in list(rooms.get(call_id, ())):
+        if ws in muxed:
+            leave_room(call_id, ws)
+            continue
+        try:
+            await ws.close(code=1000)
+        except Exception as e:
+            logger.debug("Closing call socket of %s failed: %s", call_id, e)
+
+
+def ringing_started_by(username: str) -> list[CallSession]:
+    return [s for s in sessions.values() if s.state == "ringing" and s.initiator == username]
+
+
+def expire() -> list[tuple[CallSession, str]]:
+    """
+    Sessions that timed out, with the reason. They are not removed here;
+    whoever ends them tells the participants first.
+    """
+    now = time.monotonic()
+    expired = []
+    for session in sessions.values():
+        if session.state == "ringing" and now - session.since >= RING_TIMEOUT:
+            expired.append((session, "no_answer"))
+        elif session.state == "active" and session.empty_since is not None and now - session.empty_since >= IDLE_TIMEOUT:
+            expired.append((session, "idle"))
+    return expired
+
+
+def count(reason: str) -> None:
+    _counters[reason] += 1
+
+
+async def run_periodically(on_expired) -> None:
+    """
+    Background task: hand timed-out sessions to `on_expired(session, reason)`,
+    a coroutine function.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        for session, reason in expire():
+            try:
+                await on_expired(session, reason)
+            except Exception as e:
+                logger.error("Failed to expire call %s: %s", session.call_id, e, exc_info=e)
+
+
+def call_stats() -> dict:
+    return {
+        **_counters,
+        "sessions": len(sessions),
+        "ringing": sum(1 for s in sessions.values() if s.state == "ringing"),
+        "active": sum(1 for s in sessions.values() if s.state == "active"),
+        "rooms": len(rooms),
+        "room_sockets": sum(len(room) for room in rooms.values()),
+        "multiplexed_sockets": len(muxed),
+    }
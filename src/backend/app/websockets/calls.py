@@ -1,22 +1,20 @@
 import logging
-import uuid
 import mariadb
-import db_helper as db
 import services
+import membership
+import call_manager
+import sharding
 
 logger = logging.getLogger(__name__)
 
 
-async def call_invite(caller: str, chatID: int) -> None:
+async def call_invite(user: dict, chatID: int) -> None:
     """Start a new call in the given chat, if allowed."""
+    caller = user["username"]
     # Basic validation: ensure chat exists and caller is a participant
     try:
-        participants_rows = await db.fetch_records(
-            table="participants",
-            where_clause="chatID = %s",
-            params=(chatID,),
-        )
-        if not participants_rows:
+        members = await membership.get(chatID)
+        if not members.user_ids:
             await services.send_to_user(caller, {
                 "type": "call_error",
                 "chatID": chatID,
@@ -24,13 +22,7 @@ async def call_invite(caller: str, chatID: int) -> None:
             })
             return
 
-        user_row = await db.fetch_records(
-            table="users",
-            where_clause="username = %s AND disabled = FALSE AND deleted = FALSE",
-            params=(caller,),
-            fetch_all=False,
-        )
-        if not user_row or user_row["userID"] not in [row["userID"] for row in participants_rows]:
+        if user["userID"] not in members.user_ids:
             await services.send_to_user(caller, {
                 "type": "call_error",
                 "chatID": chatID,
@@ -47,25 +39,17 @@ async def call_invite(caller: str, chatID: int) -> None:
         return
 
     # Check if a call is already pending/active for this chat
-    existing_cid = services.pending_calls.get(chatID)
-    if existing_cid:
-        existing = services.call_sessions.get(existing_cid)
-        if existing and existing.get("state") != "ended":
-            await services.send_to_user(caller, {
-                "type": "call_error",
-                "chatID": chatID,
-                "code": "CHAT_BUSY",
-            })
-            return
+    if call_manager.for_chat(chatID):
+        await services.send_to_user(caller, {
+            "type": "call_error",
+            "chatID": chatID,
+            "code": "CHAT_BUSY",
+        })
+        return
 
     # Create new call session
-    call_id = str(uuid.uuid4())
-    services.call_sessions[call_id] = {
-        "chatID": chatID,
-        "initiator": caller,
-        "state": "ringing",
-    }
-    services.pending_calls[chatID] = call_id
+    call_id = call_manager.start(chatID, caller).call_id
+    await services.sync_call(chatID)
 
     # Notify the entire chat (group or private)
     payload = {
@@ -81,7 +65,7 @@ async def call_invite(caller: str, chatID: int) -> None:
 
 async def call_accept(username: str, chatID: int, call_id: str) -> None:
     """Accept a pending call for the given chat and call id."""
-    current_cid = services.pending_calls.get(chatID)
+    current_cid = call_manager.chat_calls.get(chatID)
     if not current_cid or current_cid != call_id:
         await services.send_to_user(username, {
             "type": "call_error",
@@ -91,7 +75,7 @@ async def call_accept(username: str, chatID: int, call_id: str) -> None:
         })
         return
 
-    session = services.call_sessions.get(call_id)
+    session = call_manager.get(call_id)
     if not session:
         await services.send_to_user(username, {
             "type": "call_error",
@@ -101,7 +85,7 @@ async def call_accept(username: str, chatID: int, call_id: str) -> None:
         })
         return
 
-    if session.get("chatID") != chatID:
+    if session.chatID != chatID:
         await services.send_to_user(username, {
             "type": "call_error",
             "chatID": chatID,
@@ -110,7 +94,7 @@ async def call_accept(username: str, chatID: int, call_id: str) -> None:
         })
         return
 
-    state = session.get("state")
+    state = session.state
     if state != "ringing":
         await services.send_to_user(username, {
             "type": "call_error",
@@ -122,15 +106,15 @@ async def call_accept(username: str, chatID: int, call_id: str) -> None:
         return
 
     # Mark the call as active
-    session["state"] = "active"
-    services.call_sessions[call_id] = session
+    call_manager.set_state(session, "active")
+    await services.sync_call(chatID)
 
     # Broadcast updated state to the whole chat
     await services.broadcast_call_to_chat_participants(chatID, {
         "type": "call_state",
         "chatID": chatID,
         "call_id": call_id,
-        "initiator": session.get("initiator"),
+        "initiator": session.initiator,
         "state": "active",
     })
 
@@ -140,55 +124,121 @@ async def call_accept(username: str, chatID: int, call_id: str) -> None:
         "chatID": chatID,
         "call_id": call_id,
         "accepted_by": username,
-        "initiator": session.get("initiator"),
+        "initiator": session.initiator,
     })
 
 
 async def call_decline(username: str, chatID: int) -> None:
     """Decline the current call for this chat (if any)."""
-    call_id = services.pending_calls.get(chatID)
-    if not call_id:
+    session = call_manager.for_chat(chatID)
+    if not session:
         return
 
-    session = services.call_sessions.get(call_id)
     payload = {
         "type": "call_declined",
         "chatID": chatID,
-        "call_id": call_id,
+        "call_id": session.call_id,
         "by": username,
-        "initiator": session.get("initiator") if session else None,
+        "initiator": session.initiator,
     }
     await services.broadcast_call_to_chat_participants(chatID, payload)
 
-    services.pending_calls.pop(chatID, None)
-    if call_id in services.call_sessions:
-        services.call_sessions.pop(call_id, None)
+    call_manager.end(chatID)
+    await services.sync_call(chatID)
+    await call_manager.close_room(session.call_id)
 
 
 async def call_end(username: str, chatID: int) -> None:
     """End the current call for this chat (if any)."""
-    call_id = services.pending_calls.get(chatID)
-    if not call_id:
+    session = call_manager.for_chat(chatID)
+    if not session:
         await services.send_to_user(username, {
             "type": "call_error",
             "chatID": chatID,
             "code": "CALL_NOT_FOUND",
         })
         return
+    await _finish(session, ended_by=username)
 
-    session = services.call_sessions.get(call_id)
-    if session:
-        session["state"] = "ended"
-        services.call_sessions[call_id] = session
 
+async def _finish(session: call_manager.CallSession, ended_by: str | None = None, reason: str | None = None) -> None:
+    """Tell the chat a call is over and drop its state everywhere."""
     payload = {
         "type": "call_ended",
-        "chatID": chatID,
-        "call_id": call_id,
-        "ended_by": username,
-        "initiator": session.get("initiator") if session else None,
+        "chatID": session.chatID,
+        "call_id": session.call_id,
+        "ended_by": ended_by,
+        "initiator": session.initiator,
     }
-    await services.broadcast_call_to_chat_participants(chatID, payload)
+    if reason:
+        payload["reason"] = reason
+        call_manager.count(reason)
+    await services.broadcast_call_to_chat_participants(session.chatID, payload)
+
+    call_manager.end(session.chatID)
+    await services.sync_call(session.chatID)
+    await call_manager.close_room(session.call_id)
+
+
+async def expire_call(session: call_manager.CallSession, reason: str) -> None:
+    """
+    End a call that timed out. Every node sees the same sessions, so only
+    the chat's owner node acts on it.
+    """
+    if sharding.is_owner(session.chatID):
+        await _finish(session, reason=reason)
+
+
+async def caller_disconnected(username: str) -> None:
+    """End the calls a user was still ringing when their chat socket went away."""
+    for session in call_manager.ringing_started_by(username):
+        await _finish(session, ended_by=username, reason="caller_left")
+
+
+# ---- signaling over the chat socket ----
+# Instead of opening /call/{call_id}, a client can join the call's room with
+# its chat socket and send {"type": "call_signal", "call_id", "data"}; peers
+# get the data as is on /call sockets, wrapped the same way on chat sockets.
+
+async def join_signaling(user: dict, ws, call_id: str) -> dict:
+    session = call_manager.get(call_id)
+    if not session or session.state not in ("ringing", "active"):
+        return {
+            "type": "call_ws_error",
+            "call_id": call_id,
+            "code": "CALL_NOT_ACTIVE" if session else "CALL_NOT_FOUND",
+        }
+    if not await membership.is_member(session.chatID, user["userID"]):
+        return {"type": "call_ws_error", "call_id": call_id, "code": "NOT_IN_CHAT"}
+    call_manager.join_room(call_id, ws, user["username"], multiplexed=True)
+    await services.sync_call(session.chatID)
+    return {"type": "call_joined", "call_id": call_id}
+
+
+async def signal(username: str, ws, call_id: str, data) -> dict | None:
+    room = call_manager.rooms.get(call_id)
+    if not room or ws not in room:
+        return {"type": "call_ws_error", "call_id": call_id, "code": "NOT_IN_CALL"}
+    call_manager.relay(call_id, data, sender=ws)
+    session = call_manager.get(call_id)
+    # peers whose signaling sockets are on other nodes
+    if session and session.peers - set(room.values()):
+        await services.bus.publish({"op": "call_signal", "call_id": call_id, "data": data, "sender": username})
+
+
+async def leave_signaling(call_id: str, ws) -> None:
+    """
+    Take a signaling socket (of either kind) out of a call room and tell
+    the peers. Safe to call more than once.
+    """
+    if call_manager.leave_room(call_id, ws) is None:
+        return
+    call_manager.relay(call_id, {"type": "leave"})
+    session = call_manager.get(call_id)
+    if session:
+        await services.sync_call(session.chatID)
+
 
-    services.pending_calls.pop(chatID, None)
-    services.call_sessions.pop(call_id, None)
\ No newline at end of file
+async def leave_all_signaling(ws) -> None:
+    for call_id in list(call_manager.muxed.get(ws, ())):
+        await leave_signaling(call_id, ws)
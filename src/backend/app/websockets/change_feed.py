@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from db_helper import fetch_query, delete_records
+import outbound
+import presence
+import membership
+import services
+
+logger = logging.getLogger(__name__)
+
+# Consumer of ws_outbox, the change feed written by the REST API
+# (app/services/outbox_services.py). Every node polls it on its own and
+# turns each event into targeted messages for its local sockets, so REST
+# mutations reach clients without them having to poll or refetch.
+POLL_INTERVAL = float(os.getenv("WS_OUTBOX_POLL_MS", 250)) / 1000
+BATCH_SIZE = int(os.getenv("WS_OUTBOX_BATCH", 500))
+RETENTION = int(os.getenv("WS_OUTBOX_RETENTION", 3600))
+PRUNE_INTERVAL = 60.0
+# AUTO_INCREMENT ids are handed out before commit, so a lower id can become
+# visible after a higher one. A missing id is waited for this long before
+# it is assumed to belong to a rolled-back transaction.
+GAP_TIMEOUT = float(os.getenv("WS_OUTBOX_GAP_TIMEOUT", 5))
+
+# Close codes: 1008 sends the client back to the login screen,
+# 1012 makes it reconnect (and re-authenticate) right away
+WS_1008_POLICY_VIOLATION = 1008
+WS_1012_SERVICE_RESTART = 1012
+
+_floor = 0 # every eventID <= _floor has been handled (or given up on)
+_seen: set[int] = set() # handled eventIDs above _floor
+_gap_since: float | None = None
+_counters = {"events": 0, "errors": 0, "skipped_gaps": 0, "pruned": 0}
+
+
+# ---- event handlers ----
+
+def _send_to_user_ids(user_ids, payload: dict) -> None:
+    frame = outbound.encode(payload)
+    for uid in user_ids:
+        name = presence.usernames.get(uid)
+        if name:
+            services._deliver(name, frame)
+
+
+async def _chat_created(e: dict) -> None:
+    membership.invalidate(e["chatID"])
+    await presence.refresh_chat(e["chatID"])
+    creator = e.get("creatorID")
+    _send_to_user_ids(
+        presence.chat_members.get(e["chatID"], set()) - {creator},
+        {"type": "chat_created", "chatID": e["chatID"], "creator": presence.usernames.get(creator)},
+    )
+
+
+async def _members_changed(e: dict, kind: str) -> None:
+    chatID = e["chatID"]
+    membership.invalidate(chatID)
+    before = set(presence.chat_members.get(chatID, ()))
+    names = e.get("usernames")
+    if names is None:
+        # written before events carried the delta
+        await presence.refresh_chat(chatID)
+        names = [presence.usernames[uid] for uid in e["userIDs"] if uid in presence.usernames]
+    elif kind == "member_added":
+        for uid, name in zip(e["userIDs"], names):
+            presence.add_member(chatID, uid, name)
+    else:
+        for uid in e["userIDs"]:
+            presence.remove_member(chatID, uid)
+    after = presence.chat_members.get(chatID, set())
+    if kind == "member_removed":
+        for name in names:
+            services.unsubscribe_user(name, chatID)
+    # removed members still hear about their own removal
+    _send_to_user_ids(before | after, {
+        "type": kind,
+        "chatID": chatID,
+        "version": e.get("version"),
+        "usernames": names,
+        "by": presence.usernames.get(e.get("byUserID")),
+    })
+
+
+async def _archive_changed(e: dict, kind: str) -> None:
+    _send_to_user_ids([e["userID"]], {"type": kind, "chatID": e["chatID"]})
+
+
+async def _profile_updated(e: dict) -> None:
+    user_id = e["userID"]
+    services.forget_identity(user_id)
+    membership.invalidate_user(user_id)
+    contacts = presence.contacts(user_id)
+    presence.usernames[user_id] = e["username"]
+    _send_to_user_ids(contacts, {
+        "type": "profile_updated",
+        "username": e["username"],
+        "old_username": e.get("old_username"),
+    })
+    # Open sockets are registered under the old name; reconnecting fixes that
+    if e.get("old_username"):
+        await services.disconnect_user(e["old_username"], WS_1012_SERVICE_RESTART, "Profile updated")
+
+
+async def _sessions_revoked(e: dict) -> None:
+    # "session": only that token was revoked (logout); "keep": all but that one (login)
+    await services.revoke_sessions(
+        e["userID"], WS_1008_POLICY_VIOLATION, "Session revoked",
+        session=e.get("session"), keep=e.get("keep"),
+    )
+
+
+async def _user_deactivated(e: dict) -> None:
+    await _sessions_revoked(e)
+    membership.invalidate_user(e["userID"])
+    # load_user only sees active users, so this drops them from every chat
+    await presence.load_user(e["userID"])
+
+
+HANDLERS = {
+    "chat_created": _chat_created,
+    "member_added": lambda e: _members_changed(e, "member_added"),
+    "member_removed": lambda e: _members_changed(e, "member_removed"),
+    "chat_archived": lambda e: _archive_changed(e, "chat_archived"),
+    "chat_unarchived": lambda e: _archive_changed(e, "chat_unarchived"),
+    "profile_updated": _profile_updated,
+    "sessions_revoked": _sessions_revoked,
+    "user_deactivated": _user_deactivated,
+}
+
+
+# ---- polling ----
+
+async def start() -> None:
+    """
+    Begin after the newest existing event; older ones were for clients of
+    a previous run.
+    """
+    global _floor
+    row = await fetch_query("SELECT COALESCE(MAX(eventID), 0) AS max_id FROM ws_outbox", fetch_all=False)
+    _floor = row["max_id"]
+
+
+async def poll() -> int:
+    """
+    Handle new events once. Returns how many were handled.
+    """
+    rows = await fetch_query(
+        "SELECT eventID, event, payload FROM ws_outbox WHERE eventID > %s ORDER BY eventID LIMIT %s",
+        (_floor, BATCH_SIZE),
+    )
+    handled = 0
+    for row in rows:
+        if row["eventID"] in _seen:
+            continue
+        _seen.add(row["eventID"])
+        handled += 1
+        _counters["events"] += 1
+        handler = HANDLERS.get(row["event"])
+        if handler is None:
+            logger.warning("Ignoring unknown outbox event %s", row["event"])
+            continue
+        try:
+            await handler(json.loads(row["payload"]))
+        except Exception as e:
+            _counters["errors"] += 1
+            logger.error("Failed to handle outbox event %s: %s", row["eventID"], e, exc_info=e)
+    _advance()
+    return handled
+
+
+def _advance() -> None:
+    global _floor, _gap_since
+    while _seen:
+        nxt = _floor + 1
+        if nxt in _seen:
+            _seen.discard(nxt)
+            _floor = nxt
+            _gap_since = None
+            continue
+        now = time.monotonic()
+        if _gap_since is None:
+            _gap_since = now
+        if now - _gap_since < GAP_TIMEOUT:
+            break
+        # give up on the missing ids below the lowest handled one
+        lowest = min(_seen)
+        _counters["skipped_gaps"] += lowest - nxt
+        _floor = lowest - 1
+        _gap_since = None
+
+
+async def run_periodically() -> None:
+    last_prune = time.monotonic()
+    while True:
+        try:
+            if await poll() >= BATCH_SIZE:
+                continue
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                _counters["pruned"] += await delete_records(
+                    "ws_outbox", "created_at < NOW() - INTERVAL %s SECOND", (RETENTION,)
+                )
+        except Exception as e:
+            logger.error("Outbox poll failed: %s", e, exc_info=e)
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def change_feed_stats() -> dict:
+    return {**_counters, "position": _floor, "pending_gap": _gap_since is not None}
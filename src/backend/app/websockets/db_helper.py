@@ -1,6 +1,9 @@
+import asyncio
+import time
 import asyncmy
 import os
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from asyncmy.cursors import DictCursor
 
@@ -18,17 +21,82 @@ DB_CONFIG = {
     "autocommit": True,
 }
 
+POOL_CONFIG = {
+    "minsize": int(os.getenv("WS_DB_POOL_MIN", 2)),
+    "maxsize": int(os.getenv("WS_DB_POOL_MAX", 20)),
+    "pool_recycle": int(os.getenv("WS_DB_POOL_RECYCLE", 1800)),
+}
+ACQUIRE_TIMEOUT = float(os.getenv("WS_DB_ACQUIRE_TIMEOUT", 5))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_counters = {
+    "acquires": 0,
+    "timeouts": 0,
+    "wait_time_total": 0.0,
+}
+
+async def init_pool():
+    """
+    Create the shared connection pool. Called once on FastAPI startup.
+    """
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncmy.create_pool(**DB_CONFIG, **POOL_CONFIG)
+            logger.info(
+                "DB pool ready (min=%s, max=%s)",
+                POOL_CONFIG["minsize"], POOL_CONFIG["maxsize"],
+            )
+    return _pool
+
+async def close_pool():
+    """
+    Drain and close the shared pool. Called on FastAPI shutdown.
+    """
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            await _pool.wait_closed()
+            _pool = None
+            logger.info("DB pool closed")
+
+def pool_stats() -> dict:
+    """
+    Current pool occupancy plus acquire counters.
+    """
+    stats = {**_counters, **POOL_CONFIG}
+    if _pool is not None:
+        stats["size"] = _pool.size
+        stats["free"] = _pool.freesize
+    if _counters["acquires"]:
+        stats["avg_wait_ms"] = round(1000 * _counters["wait_time_total"] / _counters["acquires"], 3)
+    return stats
+
+@asynccontextmanager
 async def get_conn():
     """
-    Acquire an aiomysql connection using environment configuration.
-    Raises an exception if connection fails.
+    Borrow a connection from the shared pool for the duration of the block.
+    Raises asyncio.TimeoutError if none is free within ACQUIRE_TIMEOUT.
     """
+    pool = _pool or await init_pool()
+    started = time.monotonic()
     try:
-        conn = await asyncmy.connect(**DB_CONFIG)
-        return conn
+        conn = await asyncio.wait_for(pool.acquire(), timeout=ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _counters["timeouts"] += 1
+        logger.error("Timed out acquiring DB connection after %ss", ACQUIRE_TIMEOUT)
+        raise
     except Exception as e:
         logger.error("Failed to connect to database: %s", e, exc_info=e)
         raise
+    _counters["acquires"] += 1
+    _counters["wait_time_total"] += time.monotonic() - started
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
 
 async def fetch_records(
     table: str,
@@ -51,22 +119,18 @@ async def fetch_records(
         sql += " LIMIT %s"
         params = (*params, limit)
 
-    conn = None
     try:
-        conn = await get_conn()
-        async with conn.cursor(cursor=DictCursor) as cur:
-            await cur.execute(sql, params)
-            if fetch_all:
-                rows = await cur.fetchall()
-            else:
-                rows = await cur.fetchone()
-            return rows
+        async with get_conn() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
+                await cur.execute(sql, params)
+                if fetch_all:
+                    rows = await cur.fetchall()
+                else:
+                    rows = await cur.fetchone()
+                return rows
     except Exception as e:
         logger.error("Error fetching records from %s: %s", table, e, exc_info=e)
         raise
-    finally:
-        if conn:
-            conn.close()
 
 async def insert_record(table: str, data: dict) -> int:
     """
@@ -76,19 +140,59 @@ async def insert_record(table: str, data: dict) -> int:
     cols = ", ".join(f"`{col}`" for col in data.keys())
     placeholders = ", ".join(["%s"] * len(data))
     sql = f"INSERT INTO `{table}` ({cols}) VALUES ({placeholders})"
-    conn = None
     try:
-        conn = await get_conn()
-        async with conn.cursor() as cur:
-            await cur.execute(sql, tuple(data.values()))
-            await conn.commit()
-            return cur.lastrowid
+        async with get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, tuple(data.values()))
+                await conn.commit()
+                return cur.lastrowid
     except Exception as e:
         logger.error("Error inserting record into %s: %s", table, e, exc_info=e)
         raise
-    finally:
-        if conn:
-            conn.close()
+
+async def insert_returning(table: str, data: dict, returning: tuple[str, ...]) -> dict:
+    """
+    Insert a row and read back server-generated columns (IDs, defaults) in
+    the same statement via MariaDB's INSERT ... RETURNING (10.5+).
+    Returns the requested columns as a dict. Raises on error.
+    """
+    cols = ", ".join(f"`{col}`" for col in data.keys())
+    placeholders = ", ".join(["%s"] * len(data))
+    ret = ", ".join(f"`{col}`" for col in returning)
+    sql = f"INSERT INTO `{table}` ({cols}) VALUES ({placeholders}) RETURNING {ret}"
+    try:
+        async with get_conn() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
+                await cur.execute(sql, tuple(data.values()))
+                row = await cur.fetchone()
+                await conn.commit()
+                return row
+    except Exception as e:
+        logger.error("Error inserting record into %s: %s", table, e, exc_info=e)
+        raise
+
+async def insert_many(table: str, columns: tuple[str, ...], rows: list[tuple], ignore: bool = False) -> int:
+    """
+    Insert many rows with one multi-row INSERT statement (one commit).
+    With ignore=True rows whose key already exists are skipped, which makes
+    re-inserting the same rows idempotent. Returns rows affected.
+    """
+    if not rows:
+        return 0
+    cols = ", ".join(f"`{col}`" for col in columns)
+    row_ph = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    verb = "INSERT IGNORE" if ignore else "INSERT"
+    sql = f"{verb} INTO `{table}` ({cols}) VALUES " + ", ".join([row_ph] * len(rows))
+    params = tuple(v for row in rows for v in row)
+    try:
+        async with get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                await conn.commit()
+                return cur.rowcount
+    except Exception as e:
+        logger.error("Error bulk inserting %s rows into %s: %s", len(rows), table, e, exc_info=e)
+        raise
 
 async def update_records(
     table: str,
@@ -103,16 +207,43 @@ async def update_records(
     set_clause = ", ".join(f"`{col}` = %s" for col in data.keys())
     sql = f"UPDATE `{table}` SET {set_clause} WHERE {where_clause}"
     params = tuple(data.values()) + where_params
-    conn = None
     try:
-        conn = await get_conn()
-        async with conn.cursor() as cur:
-            await cur.execute(sql, params)
-            await conn.commit()
-            return cur.rowcount
+        async with get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                await conn.commit()
+                return cur.rowcount
     except Exception as e:
         logger.error("Error updating records in %s: %s", table, e, exc_info=e)
         raise
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+async def delete_records(table: str, where_clause: str, where_params: tuple = ()) -> int:
+    """
+    Delete rows from the specified table.
+    Returns number of rows affected. Raises on error.
+    """
+    sql = f"DELETE FROM `{table}` WHERE {where_clause}"
+    try:
+        async with get_conn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, where_params)
+                await conn.commit()
+                return cur.rowcount
+    except Exception as e:
+        logger.error("Error deleting records from %s: %s", table, e, exc_info=e)
+        raise
+async def fetch_query(sql: str, params: tuple = (), fetch_all: bool = True):
+    """
+    Run an arbitrary read-only query (e.g. a JOIN) and return rows as dicts.
+    Raises on errors after logging.
+    """
+    try:
+        async with get_conn() as conn:
+            async with conn.cursor(cursor=DictCursor) as cur:
+                await cur.execute(sql, params)
+                if fetch_all:
+                    return await cur.fetchall()
+                return await cur.fetchone()
+    except Exception as e:
+        logger.error("Error running query: %s\nSQL: %s", e, sql, exc_info=e)
+        raise
@@ -1,13 +1,16 @@
 from fastapi import WebSocket
 import services
+import outbound
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def handle_message(username: str, ws: WebSocket, msg: dict) -> None:
+async def handle_message(user: dict, ws: WebSocket, msg: dict) -> None:
     """
     Route a single inbound WebSocket message for a given user.
+    `user` is the identity resolved during the auth handshake.
     """
+    username = user["username"]
     logger.debug("Received message for %s: %s", username, msg)
 
     try:
@@ -15,43 +18,60 @@ async def handle_message(username: str, ws: WebSocket, msg: dict) -> None:
             # ----- CHAT MESSAGES / PRESENCE -----
 
             case {"type": "join_chat", "chatID": chatID}:
-                await services.join_chat(username, chatID, ws)
+                await services.join_chat(user, chatID, ws)
 
             case {"type": "leave_chat", "chatID": chatID}:
                 payload = await services.leave_chat(username, chatID, ws)
-                await ws.send_json(payload)
+                outbound.send(ws, payload)
 
             case {"type": "post_msg", "chatID": chatID, "text": text} if isinstance(text, str):
-                payload = await services.post_msg(username, chatID, text, ws)
-                await ws.send_json(payload)
+                payload = await services.post_msg(user, chatID, text, ws)
+                outbound.send(ws, payload)
 
             case {"type": "typing", "chatID": chatID}:
                 await services.broadcast_typing(username, chatID)
 
             case {"type": "chat_created", "chatID": chatID, "creator": creator}:
                 payload = await services.broadcast_chat_created(chatID, creator)
-                await ws.send_json(payload)
+                outbound.send(ws, payload)
 
             case {"type": "join_idle"}:
                 services.idle_subscriptions.add(ws)
 
+            # Heartbeat reply; receiving it already marked the socket alive
+            case {"type": "pong"}:
+                pass
+
             # ----- CALLING CASES -----
 
             case {"type": "call_invite", "chatID": chatID}:
-                payload = await services.calls.call_invite(caller=username, chatID=chatID)
-                await ws.send_json(payload)
+                payload = await services.calls.call_invite(user=user, chatID=chatID)
+                outbound.send(ws, payload)
 
             case {"type": "call_accept", "chatID": chatID, "call_id": call_id}:
                 payload = await services.calls.call_accept(username=username, chatID=chatID, call_id=call_id)
-                await ws.send_json(payload)
+                outbound.send(ws, payload)
 
             case {"type": "call_decline", "chatID": chatID}:
                 payload = await services.calls.call_decline(username=username, chatID=chatID)
-                await ws.send_json(payload)
+                outbound.send(ws, payload)
 
             case {"type": "call_end", "chatID": chatID}:
                 payload = await services.calls.call_end(username=username, chatID=chatID)
-                await ws.send_json(payload)
+                outbound.send(ws, payload)
+
+            # Signaling multiplexed over this socket, addressed by call_id
+            case {"type": "call_signal", "call_id": str(call_id), "data": dict(data)}:
+                error = await services.calls.signal(username, ws, call_id, data)
+                if error:
+                    outbound.send(ws, error)
+
+            case {"type": "call_join", "call_id": str(call_id)}:
+                payload = await services.calls.join_signaling(user, ws, call_id)
+                outbound.send(ws, payload)
+
+            case {"type": "call_leave", "call_id": str(call_id)}:
+                await services.calls.leave_signaling(call_id, ws)
 
             # ----- FALLBACKS -----
 
@@ -65,15 +85,7 @@ async def handle_message(username: str, ws: WebSocket, msg: dict) -> None:
 
     except ValueError as ve:
         logger.warning("Value error for user %s: %s", username, ve)
-        try:
-            await ws.send_json({"type": "error", "message": str(ve)})
-        except RuntimeError:
-            # WebSocket already closed; nothing else to do
-            pass
+        outbound.send(ws, {"type": "error", "message": str(ve)})
     except Exception as e:
         logger.error("Error handling message for %s: %s", username, e, exc_info=e)
-        try:
-            await ws.send_json({"type": "error", "message": "Internal server error"})
-        except RuntimeError:
-            # WebSocket already closed
-            pass
\ No newline at end of file
+        outbound.send(ws, {"type": "error", "message": "Internal server error"})
\ No newline at end of file
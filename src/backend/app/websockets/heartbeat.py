@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import time
+from fastapi import WebSocket
+import outbound
+
+logger = logging.getLogger(__name__)
+
+# Application-level heartbeat. Any inbound frame counts as a sign of life;
+# a connection that has been quiet for INTERVAL seconds gets a {"type":
+# "ping"} (clients answer with "pong"), and one that stays quiet for
+# TIMEOUT seconds is reaped: closed and run through its cleanup callback,
+# so half-open sockets stop lingering in the registries until some send
+# happens to fail.
+INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 25))
+TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", 60))
+SWEEP_INTERVAL = float(os.getenv("WS_HEARTBEAT_SWEEP_INTERVAL", 5))
+CLOSE_TIMEOUT = 2.0
+
+# Close code for reaped connections; the client reconnects as after any drop
+WS_1001_GOING_AWAY = 1001
+
+
+class _Tracked:
+    __slots__ = ("kind", "on_dead", "last_seen", "last_ping")
+
+    def __init__(self, kind: str, on_dead):
+        self.kind = kind
+        self.on_dead = on_dead
+        self.last_seen = time.monotonic()
+        self.last_ping = 0.0
+
+
+_tracked: dict[WebSocket, _Tracked] = {}
+_counters = {"pings": 0, "reaped": 0, "reaped_ws": 0, "reaped_call": 0}
+
+
+def register(ws: WebSocket, kind: str, on_dead) -> None:
+    """
+    Start watching `ws`. `on_dead()` is a coroutine function that removes
+    the connection from every registry; it must be safe to call twice.
+    """
+    _tracked[ws] = _Tracked(kind, on_dead)
+
+
+def unregister(ws: WebSocket) -> None:
+    _tracked.pop(ws, None)
+
+
+def touch(ws: WebSocket) -> None:
+    entry = _tracked.get(ws)
+    if entry is not None:
+        entry.last_seen = time.monotonic()
+
+
+async def _reap(ws: WebSocket, entry: _Tracked) -> None:
+    _tracked.pop(ws, None)
+    _counters["reaped"] += 1
+    _counters["reaped_" + entry.kind] += 1
+    try:
+        await asyncio.wait_for(ws.close(code=WS_1001_GOING_AWAY), CLOSE_TIMEOUT)
+    except Exception:
+        pass
+    try:
+        await entry.on_dead()
+    except Exception as e:
+        logger.error("Cleanup of reaped connection failed: %s", e, exc_info=e)
+
+
+async def sweep() -> int:
+    """
+    Ping quiet connections and reap unresponsive ones. Returns the number reaped.
+    """
+    now = time.monotonic()
+    dead = []
+    for ws, entry in list(_tracked.items()):
+        quiet = now - entry.last_seen
+        if quiet >= TIMEOUT or not outbound.is_open(ws):
+            dead.append((ws, entry))
+        elif quiet >= INTERVAL and now - entry.last_ping >= INTERVAL:
+            entry.last_ping = now
+            if outbound.send(ws, {"type": "ping"}):
+                _counters["pings"] += 1
+    for ws, entry in dead:
+        logger.info("Reaping unresponsive %s connection", entry.kind)
+        await _reap(ws, entry)
+    return len(dead)
+
+
+async def run_periodically() -> None:
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep()
+        except Exception as e:
+            logger.error("Heartbeat sweep failed: %s", e, exc_info=e)
+
+
+def heartbeat_stats() -> dict:
+    return {
+        **_counters,
+        "tracked": len(_tracked),
+        "interval": INTERVAL,
+        "timeout": TIMEOUT,
+    }
@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import time
+from fastapi import WebSocket, WebSocketDisconnect
+import outbound
+
+logger = logging.getLogger(__name__)
+
+# Inbound guards for the WebSocket endpoints: frames are size-checked before
+# they are parsed, and every message type is metered by a token bucket per
+# connection plus one per user (shared by all of the user's sockets, so
+# reconnecting or opening a second socket does not reset the budget).
+MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", 16384))
+CALL_MAX_FRAME_BYTES = int(os.getenv("WS_CALL_MAX_FRAME_BYTES", 65536))
+# Per-user buckets allow this many times the per-connection rate and burst
+USER_RATE_MULTIPLIER = float(os.getenv("WS_RATE_USER_MULTIPLIER", 2))
+# Minimum seconds between two rate_limited replies on one connection
+REJECT_NOTICE_INTERVAL = float(os.getenv("WS_RATE_NOTICE_INTERVAL", 1.0))
+
+
+def _parse_limits(spec: str | None, defaults: dict) -> dict:
+    """
+    Merge "type=rate/burst,type=rate/burst" overrides into `defaults`.
+    """
+    limits = dict(defaults)
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+# message type -> (tokens per second, burst)
+WS_LIMITS = _parse_limits(os.getenv("WS_RATE_LIMITS"), {
+    "post_msg": (5, 10),
+    "typing": (5, 10),
+    "join_chat": (10, 30),
+    "leave_chat": (10, 30),
+    "join_idle": (1, 5),
+    "chat_created": (1, 5),
+    "call_invite": (0.5, 3),
+    "call_accept": (1, 5),
+    "call_decline": (1, 5),
+    "call_end": (1, 5),
+    "call_join": (1, 5),
+    "call_leave": (1, 5),
+    # multiplexed signaling, see CALL_LIMITS
+    "call_signal": (50, 200),
+    "default": (5, 10),
+})
+# Call signaling sends ICE candidates in bursts
+CALL_LIMITS = _parse_limits(os.getenv("WS_CALL_RATE_LIMITS"), {
+    "default": (50, 200),
+})
+
+_counters = {
+    "frames": 0,
+    "rate_limited": 0,
+    "too_large": 0,
+    "invalid_json": 0,
+}
+
+
+class InboundError(Exception):
+    """A frame that was rejected before reaching the handler."""
+
+    def __init__(self, payload: dict):
+        super().__init__(payload.get("message"))
+        self.payload = payload
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def peek(self, now: float) -> float:
+        """
+        Seconds until one token is available (0 if one is available now).
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# (username, limits table id, message type) -> bucket
+_user_buckets: dict[tuple, TokenBucket] = {}
+_PRUNE_EVERY = 1000
+_checks_since_prune = 0
+
+
+def _prune_user_buckets(now: float) -> None:
+    global _checks_since_prune
+    _checks_since_prune = 0
+    for key in [k for k, b in _user_buckets.items() if b.idle(now)]:
+        del _user_buckets[key]
+
+
+class ConnectionLimiter:
+    """
+    Meters the messages of one connection. Rejected messages get a
+    structured RATE_LIMITED error (at most one per REJECT_NOTICE_INTERVAL).
+    """
+
+    def __init__(self, ws: WebSocket, username: str, limits: dict = WS_LIMITS):
+        self.ws = ws
+        self.username = username
+        self.limits = limits
+        self._buckets: dict[str, TokenBucket] = {}
+        self._next_notice = 0.0
+
+    def _bucket_name(self, msg_type) -> str:
+        return msg_type if isinstance(msg_type, str) and msg_type in self.limits else "default"
+
+    def allow(self, msg) -> bool:
+        global _checks_since_prune
+        now = time.monotonic()
+        msg_type = msg.get("type") if isinstance(msg, dict) else None
+        name = self._bucket_name(msg_type)
+        rate, burst = self.limits[name]
+
+        conn_bucket = self._buckets.get(name)
+        if conn_bucket is None:
+            conn_bucket = self._buckets[name] = TokenBucket(rate, burst)
+        user_key = (self.username, id(self.limits), name)
+        user_bucket = _user_buckets.get(user_key)
+        if user_bucket is None:
+            user_bucket = _user_buckets[user_key] = TokenBucket(
+                rate * USER_RATE_MULTIPLIER, burst * USER_RATE_MULTIPLIER
+            )
+
+        _checks_since_prune += 1
+        if _checks_since_prune >= _PRUNE_EVERY:
+            _prune_user_buckets(now)
+
+        retry_after = max(conn_bucket.peek(now), user_bucket.peek(now))
+        if retry_after == 0:
+            conn_bucket.take()
+            user_bucket.take()
+            return True
+
+        _counters["rate_limited"] += 1
+        if now >= self._next_notice:
+            self._next_notice = now + REJECT_NOTICE_INTERVAL
+            logger.warning("Rate limited %s on %s", self.username, name)
+            outbound.send(self.ws, {
+                "type": "error",
+                "code": "RATE_LIMITED",
+                "message": "Too many requests. Slow down.",
+                "action": msg_type if isinstance(msg_type, str) else None,
+                "retry_after": round(retry_after, 3),
+            })
+        return False
+
+
+def _too_large(size: int, max_bytes: int) -> InboundError:
+    _counters["too_large"] += 1
+    return InboundError({
+        "type": "error",
+        "code": "FRAME_TOO_LARGE",
+        "message": f"Frame exceeds {max_bytes} bytes.",
+        "limit": max_bytes,
+        "length": size,
+    })
+
+
+async def receive_message(ws: WebSocket, max_bytes: int = MAX_FRAME_BYTES, signal_max_bytes: int = 0):
+    """
+    Receive one frame and decode it as JSON, rejecting oversized frames
+    before they are parsed. Raises WebSocketDisconnect when the peer leaves
+    and InboundError for frames that should be answered with an error.
+
+    With `signal_max_bytes`, "call_signal" frames (SDP can be large) may be
+    up to that size; anything else still has to fit `max_bytes`.
+    """
+    limit = max(max_bytes, signal_max_bytes)
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    _counters["frames"] += 1
+
+    data = message.get("text")
+    if data is not None:
+        # a str is at most 4 bytes per character, so only encode when it could matter
+        size = len(data.encode("utf-8")) if len(data) * 4 > max_bytes else len(data)
+    else:
+        data = message.get("bytes") or b""
+        size = len(data)
+    if size > limit:
+        raise _too_large(size, limit)
+
+    try:
+        msg = json.loads(data)
+    except (ValueError, UnicodeDecodeError):
+        _counters["invalid_json"] += 1
+        raise InboundError({"type": "error", "code": "INVALID_JSON", "message": "Invalid JSON payload."})
+    if size > max_bytes and not (isinstance(msg, dict) and msg.get("type") == "call_signal"):
+        raise _too_large(size, max_bytes)
+    return msg
+
+
+def inbound_stats() -> dict:
+    return {
+        **_counters,
+        "user_buckets": len(_user_buckets),
+        "max_frame_bytes": MAX_FRAME_BYTES,
+        "call_max_frame_bytes": CALL_MAX_FRAME_BYTES,
+    }
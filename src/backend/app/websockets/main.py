@@ -1,10 +1,31 @@
 import logging
+import os
+import sys
 import asyncio  # Add asyncio for lock handling
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.websockets import WebSocketState
+
+# Runs as a script from this directory (flat imports); code shared with the
+# REST API, e.g. common.cache, lives in src/backend/common
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
 import services
 import uvicorn
 import handler
+import db_helper
+import outbound
+import presence
+import write_behind
+import typing_indicator
+import inbound
+import heartbeat
+import sharding
+import change_feed
+import membership
+import calls
+import call_manager
+from functools import partial
 
 # Configure module logger
 logger = logging.getLogger(__name__)
@@ -18,25 +39,73 @@ logging.basicConfig(level=logging.DEBUG)
 # ERROR    = 40  → serious problems in execution
 # CRITICAL = 50  → severe errors; program may fail
 
-app = FastAPI()
-call_rooms: dict[str, set[WebSocket]] = {}
-call_users: dict[str, set[str]] = {}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # --- STARTUP ---
+    await db_helper.init_pool()
+    await presence.load_all()
+    if write_behind.ENABLED:
+        await write_behind.writer.start()
+    reload_task = asyncio.create_task(presence.reload_periodically())
+    typing_task = asyncio.create_task(typing_indicator.expire_periodically(services.broadcast_typing_stop))
+    heartbeat_task = asyncio.create_task(heartbeat.run_periodically())
+    await services.bus.start(services.handle_backplane_event)
+    roster_task = asyncio.create_task(services.announce_roster_periodically())
+    await change_feed.start()
+    feed_task = asyncio.create_task(change_feed.run_periodically())
+    call_task = asyncio.create_task(call_manager.run_periodically(calls.expire_call))
+    yield
+    # --- SHUTDOWN ---
+    call_task.cancel()
+    feed_task.cancel()
+    roster_task.cancel()
+    await services.bus.stop()
+    reload_task.cancel()
+    typing_task.cancel()
+    heartbeat_task.cancel()
+    if write_behind.ENABLED:
+        await write_behind.writer.stop()
+    await db_helper.close_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 services.reset_variables()
 
 # Add a lock for managing concurrent connection attempts
 connection_locks: dict[str, asyncio.Lock] = {}
 
+@app.get("/stats")
+async def stats():
+    """Internal counters for monitoring. Only exposed when EXPOSE_STATS=true."""
+    if os.getenv("EXPOSE_STATS") != "true":
+        raise HTTPException(status_code=404)
+    return {
+        "db_pool": db_helper.pool_stats(),
+        "auth_cache": services.auth_cache.stats(),
+        "outbound": outbound.outbound_stats(),
+        "presence": presence.presence_stats(),
+        "write_behind": write_behind.writer.stats(),
+        "typing": typing_indicator.typing_stats(),
+        "inbound": inbound.inbound_stats(),
+        "heartbeat": heartbeat.heartbeat_stats(),
+        "backplane": services.bus.stats(),
+        "sharding": sharding.sharding_stats(),
+        "change_feed": change_feed.change_feed_stats(),
+        "membership": membership.membership_stats(),
+        "calls": call_manager.call_stats(),
+    }
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     await ws.accept()
 
     # --- AUTH HANDSHAKE ---
     try:
-        init_payload = await ws.receive_json()
-        username = await services.authenticate(ws, init_payload)
-        if not username:
+        init_payload = await inbound.receive_message(ws)
+        user = await services.authenticate(ws, init_payload)
+        if not user:
             return
+        username = user["username"]
     except Exception as e:
         logger.error("Authentication failed", exc_info=e)
         if ws.application_state != WebSocketState.DISCONNECTED:
@@ -55,13 +124,14 @@ async def websocket_endpoint(ws: WebSocket):
                 pass
 
         services.active_connections[username] = ws
+        services.track_session(ws, user, init_payload["token"])
 
     # --- SEND INITIAL STATE ---
     try:
-        await services.notify_status(username, True)
-        online_users = await services.get_online_users_for_user(username)
-        await ws.send_json({"type": "auth_ack", "status": "ok"})
-        await ws.send_json({"type": "online_users", "users": online_users})
+        await services.notify_status(user, True)
+        online_users = await services.get_online_users_for_user(user)
+        outbound.send(ws, {"type": "auth_ack", "status": "ok"})
+        outbound.send(ws, {"type": "online_users", "users": online_users})
     except Exception as e:
         logger.error("Error sending initial state to %s", username, exc_info=e)
 
@@ -69,16 +139,26 @@ async def websocket_endpoint(ws: WebSocket):
     # Main message loop#
     ####################
 
+    limiter = inbound.ConnectionLimiter(ws, username)
+    heartbeat.register(ws, "ws", partial(services.cleanup_connection, user, ws))
     try:
         while True:
-            msg = await ws.receive_json()
-            await handler.handle_message(username, ws, msg)
+            try:
+                msg = await inbound.receive_message(ws, signal_max_bytes=inbound.CALL_MAX_FRAME_BYTES)
+            except inbound.InboundError as e:
+                heartbeat.touch(ws)
+                outbound.send(ws, e.payload)
+                continue
+            heartbeat.touch(ws)
+            if limiter.allow(msg):
+                await handler.handle_message(user, ws, msg)
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected for user: %s", username)
     except Exception as e:
         logger.error("WebSocket error for %s: %s", username, e, exc_info=e)
     finally:
-        await services.cleanup_connection(username, ws)
+        heartbeat.unregister(ws)
+        await services.cleanup_connection(user, ws)
 
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -96,10 +176,11 @@ async def call_ws(ws: WebSocket, call_id: str):
 
     # --- AUTH HANDSHAKE ---
     try:
-        init_payload = await ws.receive_json()
-        username = await services.authenticate(ws, init_payload)
-        if not username:
+        init_payload = await inbound.receive_message(ws, inbound.CALL_MAX_FRAME_BYTES)
+        user = await services.authenticate(ws, init_payload)
+        if not user:
             return
+        username = user["username"]
     except Exception as e:
         logger.error("Authentication failed", exc_info=e)
         if ws.application_state != WebSocketState.DISCONNECTED:
@@ -119,7 +200,7 @@ async def call_ws(ws: WebSocket, call_id: str):
 
         services.active_call_connections[username] = ws
 
-    sess = services.call_sessions.get(call_id)
+    sess = call_manager.get(call_id)
     if not sess:
         try:
             await ws.send_json({
@@ -136,7 +217,7 @@ async def call_ws(ws: WebSocket, call_id: str):
             logger.warning("Attempted to close an already closed WebSocket for call_id: %s", call_id)
         return
 
-    state = sess.get("state")
+    state = sess.state
     if state not in ("ringing", "active"):
         try:
             await ws.send_json({
@@ -154,36 +235,72 @@ async def call_ws(ws: WebSocket, call_id: str):
             logger.warning("Attempted to close an already closed WebSocket for call_id: %s", call_id)
         return
 
-    call_rooms.setdefault(call_id, set()).add(ws)
+    # Only members of the chat may read its SDP/ICE (same check as calls.join_signaling)
+    try:
+        allowed = await membership.is_member(sess.chatID, user["userID"])
+    except Exception as e:
+        logger.error("Membership check for call %s failed: %s", call_id, e, exc_info=e)
+        allowed = False
+    if not allowed:
+        if services.active_call_connections.get(username) is ws:
+            services.active_call_connections.pop(username, None)
+        try:
+            await ws.send_json({
+                "type": "call_ws_error",
+                "call_id": call_id,
+                "code": "NOT_IN_CHAT",
+            })
+        except Exception:
+            pass
+        try:
+            if ws.application_state != WebSocketState.DISCONNECTED:
+                await ws.close(code=1008)
+        except RuntimeError:
+            logger.warning("Attempted to close an already closed WebSocket for call_id: %s", call_id)
+        return
+
+    # Dedicated signaling socket; clients can also signal over /ws (calls.join_signaling)
+    call_manager.join_room(call_id, ws, username)
+    services.track_session(ws, user, init_payload["token"])
+    await services.sync_call(sess.chatID)
+    limiter = inbound.ConnectionLimiter(ws, username, inbound.CALL_LIMITS)
+    heartbeat.register(ws, "call", partial(leave_call_room, call_id, ws, username))
 
     try:
         while True:
-            data = await ws.receive_json()
+            try:
+                data = await inbound.receive_message(ws, inbound.CALL_MAX_FRAME_BYTES)
+            except inbound.InboundError as e:
+                heartbeat.touch(ws)
+                outbound.send(ws, e.payload)
+                continue
+            heartbeat.touch(ws)
+            if isinstance(data, dict) and data.get("type") == "pong":
+                continue
+            if not limiter.allow(data):
+                continue
             # fan out signaling payload to other participant(s) in this call
-            for peer in list(call_rooms.get(call_id, set())):
-                if peer is not ws:
-                    try:
-                        await peer.send_json(data)
-                    except Exception:
-                        pass
+            await calls.signal(username, ws, call_id, data)
     except WebSocketDisconnect:
         pass
     finally:
-        try:
-            for peer in list(call_rooms.get(call_id, set())):
-                if peer is not ws:
-                    try:
-                        await peer.send_json({"type": "leave"})
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        heartbeat.unregister(ws)
+        await leave_call_room(call_id, ws, username)
 
-        room = call_rooms.get(call_id, set())
-        room.discard(ws)
-        if not room:
-            call_rooms.pop(call_id, None)
-            call_users.pop(call_id, None)
+async def leave_call_room(call_id: str, ws: WebSocket, username: str) -> None:
+    """
+    Remove a signaling socket from its call room and tell the peers.
+    Safe to call more than once.
+    """
+    if services.active_call_connections.get(username) is ws:
+        services.active_call_connections.pop(username, None)
+    services.socket_sessions.pop(ws, None)
+    await outbound.close_writer(ws)
+    await calls.leave_signaling(call_id, ws)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8765, log_level="info", use_colors=False)
\ No newline at end of file
+    # Transport-level backstop; frames above the app limits still get a structured error
+    uvicorn.run(
+        app, host="0.0.0.0", port=int(os.getenv("WS_PORT", 8765)), log_level="info", use_colors=False,
+        ws_max_size=4 * max(inbound.MAX_FRAME_BYTES, inbound.CALL_MAX_FRAME_BYTES),
+    )
\ No newline at end of file
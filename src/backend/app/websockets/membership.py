@@ -0,0 +1,72 @@
+import os
+from common.cache import TTLCache
+from db_helper import fetch_query
+
+# chatID -> ChatMembers, for membership checks and participant fan-out on
+# the message path. Entries are loaded on first use with one joined query,
+# the least recently used ones are evicted, and every membership change the
+# server hears of (change feed, chat_created, other nodes) invalidates the
+# chat. The TTL only bounds how long edits made outside the API stay unseen.
+_cache = TTLCache(
+    maxsize=int(os.getenv("MEMBERSHIP_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("MEMBERSHIP_CACHE_TTL", 600)),
+)
+# Bumped by every invalidation, so a load that raced with one is not cached
+_generation = 0
+
+_MEMBERS_SQL = """
+    SELECT p.userID, u.username, (u.disabled = FALSE AND u.deleted = FALSE) AS active
+    FROM participants p
+    JOIN users u ON u.userID = p.userID
+    WHERE p.chatID = %s
+"""
+
+
+class ChatMembers:
+    """
+    Members of one chat: every participant's userID, and the usernames of
+    the active ones (the only ones worth sending anything to).
+    """
+
+    __slots__ = ("user_ids", "usernames")
+
+    def __init__(self, rows):
+        self.user_ids = frozenset(row["userID"] for row in rows)
+        self.usernames = tuple(row["username"] for row in rows if row["active"])
+
+
+async def get(chatID: int) -> ChatMembers:
+    members = _cache.get(chatID)
+    if members is None:
+        generation = _generation
+        members = ChatMembers(await fetch_query(_MEMBERS_SQL, (chatID,)))
+        if generation == _generation:
+            _cache.set(chatID, members)
+    return members
+
+
+async def is_member(chatID: int, userID: int) -> bool:
+    return userID in (await get(chatID)).user_ids
+
+
+async def usernames(chatID: int) -> tuple[str, ...]:
+    return (await get(chatID)).usernames
+
+
+def invalidate(chatID: int) -> None:
+    global _generation
+    _generation += 1
+    _cache.pop(chatID)
+
+
+def invalidate_user(userID: int) -> None:
+    """
+    Forget every cached chat of a user, e.g. after a rename or deactivation.
+    """
+    global _generation
+    _generation += 1
+    _cache.pop_where(lambda members: userID in members.user_ids)
+
+
+def membership_stats() -> dict:
+    return _cache.stats()
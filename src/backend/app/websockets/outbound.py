@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from fastapi import WebSocket
+from fastapi.websockets import WebSocketState
+
+logger = logging.getLogger(__name__)
+
+# Per-connection outbound queue. Broadcasts only enqueue; a writer task per
+# socket does the actual (possibly slow) network send, so one bad client
+# can no longer stall delivery to everybody else in a chat.
+QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+OVERFLOW_POLICY = os.getenv("WS_SEND_OVERFLOW", "coalesce")  # drop | coalesce | disconnect
+OVERFLOW_POLICIES = ("drop", "coalesce", "disconnect")
+if OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"WS_SEND_OVERFLOW must be one of {OVERFLOW_POLICIES}")
+
+# Close code for slow consumers; the client treats it as retryable
+WS_1013_TRY_AGAIN_LATER = 1013
+
+# Frames that only carry the latest state of something. Under the
+# "coalesce" policy a newer frame replaces a queued one with the same key.
+COALESCE_KEYS = {
+    "user_typing": ("chatID", "username"),
+    "user_status": ("username",),
+    "online_users": (),
+    "call_state": ("chatID",),
+}
+
+_writers: dict[WebSocket, "ConnectionWriter"] = {}
+_counters = {
+    "sent": 0,
+    "dropped": 0,
+    "coalesced": 0,
+    "disconnected": 0,
+    "send_errors": 0,
+    "max_queue_depth": 0,
+}
+
+
+class Frame:
+    """
+    A payload encoded to its JSON text frame once, so a broadcast to many
+    sockets pays for serialization a single time.
+    """
+    __slots__ = ("payload", "text")
+
+    def __init__(self, payload):
+        self.payload = payload
+        # same encoding as Starlette's send_json
+        self.text = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode(payload) -> Frame:
+    return payload if isinstance(payload, Frame) else Frame(payload)
+
+
+def coalesce_key(payload) -> tuple | None:
+    if isinstance(payload, Frame):
+        payload = payload.payload
+    if not isinstance(payload, dict):
+        return None
+    fields = COALESCE_KEYS.get(payload.get("type"))
+    if fields is None:
+        return None
+    return (payload["type"], *(payload.get(f) for f in fields))
+
+
+def is_open(ws: WebSocket) -> bool:
+    return (
+        ws.application_state != WebSocketState.DISCONNECTED
+        and ws.client_state != WebSocketState.DISCONNECTED
+    )
+
+
+class ConnectionWriter:
+    """
+    Owns every send to one WebSocket: a bounded FIFO drained by one task.
+    """
+
+    def __init__(self, ws: WebSocket, maxsize: int = QUEUE_SIZE, policy: str = OVERFLOW_POLICY):
+        self.ws = ws
+        self.maxsize = maxsize
+        self.policy = policy
+        self.closed = False
+        self._queue: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, payload) -> bool:
+        """
+        Enqueue without blocking. Returns False if the frame was not queued.
+        `payload` is a dict or a pre-encoded Frame.
+        """
+        if self.closed:
+            return False
+        if len(self._queue) >= self.maxsize:
+            outcome = self._overflow(payload)
+            if outcome != "append":
+                return outcome == "merged"
+        self._queue.append(encode(payload))
+        depth = len(self._queue)
+        if depth > _counters["max_queue_depth"]:
+            _counters["max_queue_depth"] = depth
+        self._wakeup.set()
+        return True
+
+    def _overflow(self, payload) -> str:
+        """
+        Apply the overflow policy to a full queue.
+        Returns "append" if room was made, "merged" if `payload` replaced a
+        queued frame, or "dropped".
+        """
+        if self.policy == "disconnect":
+            logger.warning("Outbound queue full, disconnecting slow client")
+            _counters["disconnected"] += 1
+            self.closed = True
+            self._queue.clear()
+            asyncio.create_task(self._disconnect())
+            return "dropped"
+
+        if self.policy == "coalesce":
+            key = coalesce_key(payload)
+            if key is not None:
+                for i, queued in enumerate(self._queue):
+                    if coalesce_key(queued) == key:
+                        self._queue[i] = encode(payload)
+                        _counters["coalesced"] += 1
+                        return "merged"
+            # Evict the oldest state-only frame rather than a chat message
+            for i, queued in enumerate(self._queue):
+                if coalesce_key(queued) is not None:
+                    del self._queue[i]
+                    _counters["coalesced"] += 1
+                    return "append"
+
+        _counters["dropped"] += 1
+        return "dropped"
+
+    async def _disconnect(self):
+        try:
+            await self.ws.close(code=WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+        await self.close()
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                frame = self._queue.popleft()
+                await self.ws.send_text(frame.text)
+                _counters["sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("Outbound writer stopped: %s", e)
+            _counters["send_errors"] += 1
+        finally:
+            self.closed = True
+            self._queue.clear()
+            if _writers.get(self.ws) is self:
+                _writers.pop(self.ws, None)
+
+    async def close(self):
+        self.closed = True
+        self._queue.clear()
+        if _writers.get(self.ws) is self:
+            _writers.pop(self.ws, None)
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+def send(ws: WebSocket, payload) -> bool:
+    """
+    Queue `payload` for `ws` without waiting for the network.
+    For the same payload going to many sockets, pass encode(payload) so it
+    is serialized once. Returns False if the socket is gone or the frame
+    was dropped.
+    """
+    writer = _writers.get(ws)
+    if writer is None:
+        if not is_open(ws):
+            return False
+        writer = _writers[ws] = ConnectionWriter(ws)
+    return writer.put(payload)
+
+
+async def close_writer(ws: WebSocket) -> None:
+    """Stop the writer of a socket that is going away."""
+    writer = _writers.pop(ws, None)
+    if writer:
+        await writer.close()
+
+
+def outbound_stats() -> dict:
+    return {
+        **_counters,
+        "writers": len(_writers),
+        "queued": sum(len(w._queue) for w in _writers.values()),
+        "queue_size": QUEUE_SIZE,
+        "policy": OVERFLOW_POLICY,
+    }
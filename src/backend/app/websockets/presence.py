@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+from db_helper import fetch_query
+
+logger = logging.getLogger(__name__)
+
+# In-memory contact graph: who shares a chat with whom.
+# Loaded with one joined query on startup and kept current incrementally,
+# so presence fan-out is a set intersection instead of N+1 queries.
+chat_members: dict[int, set[int]] = {} # chatID -> userIDs
+user_chats: dict[int, set[int]] = {} # userID -> chatIDs
+usernames: dict[int, str] = {} # userID -> username (active users only)
+
+RELOAD_INTERVAL = float(os.getenv("PRESENCE_RELOAD_INTERVAL", 300))
+
+_MEMBERSHIP_SQL = """
+    SELECT p.chatID, u.userID, u.username
+    FROM participants p
+    JOIN users u ON u.userID = p.userID
+    WHERE u.disabled = FALSE AND u.deleted = FALSE
+"""
+
+_counters = {"full_loads": 0, "user_loads": 0, "chat_loads": 0}
+
+
+def _add(chatID: int, userID: int, username: str | None = None) -> None:
+    chat_members.setdefault(chatID, set()).add(userID)
+    user_chats.setdefault(userID, set()).add(chatID)
+    if username:
+        usernames[userID] = username
+
+
+async def load_all() -> None:
+    """
+    Rebuild the whole graph from the database in one query.
+    """
+    global chat_members, user_chats, usernames
+    rows = await fetch_query(_MEMBERSHIP_SQL)
+    members: dict[int, set[int]] = {}
+    chats: dict[int, set[int]] = {}
+    names: dict[int, str] = {}
+    for row in rows:
+        members.setdefault(row["chatID"], set()).add(row["userID"])
+        chats.setdefault(row["userID"], set()).add(row["chatID"])
+        names[row["userID"]] = row["username"]
+    chat_members, user_chats, usernames = members, chats, names
+    _counters["full_loads"] += 1
+    logger.info("Presence graph loaded: %s chats, %s users", len(members), len(names))
+
+
+async def load_user(userID: int) -> None:
+    """
+    (Re)load every chat of one user, with all co-members, in one query.
+    """
+    rows = await fetch_query(
+        _MEMBERSHIP_SQL + " AND p.chatID IN (SELECT chatID FROM participants WHERE userID = %s)",
+        (userID,),
+    )
+    fetched = {row["chatID"] for row in rows}
+    for chatID in user_chats.get(userID, set()) - fetched:
+        remove_member(chatID, userID)
+    for chatID in fetched:
+        remove_chat(chatID)
+    for row in rows:
+        _add(row["chatID"], row["userID"], row["username"])
+    user_chats.setdefault(userID, set())
+    _counters["user_loads"] += 1
+
+
+async def refresh_chat(chatID: int) -> None:
+    """
+    Reload the members of one chat, e.g. after it was created or edited.
+    """
+    rows = await fetch_query(_MEMBERSHIP_SQL + " AND p.chatID = %s", (chatID,))
+    remove_chat(chatID)
+    for row in rows:
+        _add(row["chatID"], row["userID"], row["username"])
+    _counters["chat_loads"] += 1
+
+
+async def ensure_user(userID: int, username: str | None = None) -> None:
+    """
+    Make sure a (possibly new) user's chats are in the graph.
+    """
+    if userID not in user_chats:
+        await load_user(userID)
+    if username:
+        usernames[userID] = username
+
+
+def add_member(chatID: int, userID: int, username: str | None = None) -> None:
+    _add(chatID, userID, username)
+
+
+def remove_member(chatID: int, userID: int) -> None:
+    members = chat_members.get(chatID)
+    if members is not None:
+        members.discard(userID)
+        if not members:
+            chat_members.pop(chatID, None)
+    chats = user_chats.get(userID)
+    if chats is not None:
+        chats.discard(chatID)
+
+
+def remove_chat(chatID: int) -> None:
+    for userID in chat_members.pop(chatID, set()):
+        chats = user_chats.get(userID)
+        if chats is not None:
+            chats.discard(chatID)
+
+
+def is_member(chatID: int, userID: int) -> bool:
+    return userID in chat_members.get(chatID, ())
+
+
+def contacts(userID: int) -> set[int]:
+    """
+    userIDs sharing at least one chat with `userID` (excluding itself).
+    """
+    related = set()
+    for chatID in user_chats.get(userID, ()):
+        related |= chat_members.get(chatID, set())
+    related.discard(userID)
+    return related
+
+
+def contact_names(userID: int) -> set[str]:
+    return {usernames[uid] for uid in contacts(userID) if uid in usernames}
+
+
+async def reload_periodically() -> None:
+    """
+    Safety net for membership changes made outside this process.
+    """
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            await load_all()
+        except Exception as e:
+            logger.error("Periodic presence reload failed: %s", e, exc_info=e)
+
+
+def presence_stats() -> dict:
+    return {
+        **_counters,
+        "chats": len(chat_members),
+        "users": len(user_chats),
+        "edges": sum(len(m) for m in chat_members.values()),
+    }
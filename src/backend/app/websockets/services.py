@@ -1,9 +1,20 @@
+import asyncio
 import logging
 import hashlib
+import os
 import mariadb
 from fastapi import WebSocket, status
-from db_helper import fetch_records, insert_record
+from db_helper import fetch_query, insert_record, insert_returning
+from common.cache import TTLCache
+import outbound
+import presence
+import membership
 import calls
+import call_manager
+import typing_indicator
+import backplane
+import sharding
+from write_behind import writer as message_writer, ENABLED as WRITE_BEHIND, BacklogFull
 
 logger = logging.getLogger(__name__)
 
@@ -11,26 +22,39 @@ logger = logging.getLogger(__name__)
 active_connections: dict[str, WebSocket] = {} # username -> WebSocket ; stores all active ws connections
 active_call_connections: dict[str, WebSocket] = {} # username -> WebSocket ; stores all active call ws connectionsabout:blank#blocked
 chat_subscriptions: dict[int, set[WebSocket]] = {} # chatID -> set of WebSockets ; stores ws connections subscribed to each chat
+socket_chats: dict[WebSocket, set[int]] = {} # WebSocket -> set of chatIDs ; reverse index of chat_subscriptions
 idle_subscriptions: set[WebSocket] = set() # stores ws connections subscribed to idle notifications
-pending_calls: dict[int, dict] = {} # chatID -> call_id ; stores pending call IDs per chat
-call_sessions: dict[str, dict] = {} # call_id -> session dict ; stores active call sessions
 user_status: dict[str, bool] = {} # username -> online status (True/False)
+remote_online: dict[str, dict[str, int]] = {} # node id -> {username: userID} ; users connected to other nodes
+socket_sessions: dict[WebSocket, tuple[int, str]] = {} # chat or call WebSocket -> (userID, session token hash) it authenticated with
+
+# Shared with the other WebSocket nodes (see backplane.py); started in main.lifespan
+bus = backplane.create()
+ROSTER_INTERVAL = float(os.getenv("WS_BACKPLANE_ROSTER_INTERVAL", 30))
+
+# token hash -> identity (see authenticate) ; revocations made through the REST API
+# arrive via the change feed (revoke_sessions), anything else is bounded by the TTL
+auth_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", 60)),
+)
 
 def reset_variables():
     """
     Resets all in-memory variables. Used on server startup.
     """
-    global active_connections, chat_subscriptions, idle_subscriptions, pending_calls, call_sessions, user_status
+    global active_connections, chat_subscriptions, socket_chats, idle_subscriptions, user_status, remote_online
     active_connections = {}
     chat_subscriptions = {}
+    socket_chats = {}
     idle_subscriptions = set()
-    pending_calls = {}
-    call_sessions = {}
     user_status = {}
+    remote_online = {}
 
-async def authenticate(websocket: WebSocket, msg: dict) -> str | None:
+async def authenticate(websocket: WebSocket, msg: dict) -> dict | None:
     """
     Token-only auth handshake over WebSocket.
+    Returns the user's identity { userID, username } or None after closing the socket.
     """
     # Validate payload
     if msg.get("type") != "auth" or not isinstance(msg.get("token"), str):
@@ -41,13 +65,23 @@ async def authenticate(websocket: WebSocket, msg: dict) -> str | None:
     token_plain = msg["token"]
     token_hash = hashlib.sha256(token_plain.encode()).hexdigest()
 
-    # Lookup session
+    cached = auth_cache.get(token_hash)
+    if cached is not None:
+        logger.info("User authenticated (cached): %s (userID=%s)", cached["username"], cached["userID"])
+        return cached
+
+    # Lookup session and its active user in one round trip
     try:
-        sessions = await fetch_records(
-            table="session_tokens",
-            where_clause="session_token = %s AND revoked = FALSE AND expires_at > CURRENT_TIMESTAMP()",
-            params=(token_hash,),
-            fetch_all=True
+        user = await fetch_query(
+            """
+            SELECT u.userID, u.username
+            FROM session_tokens s
+            JOIN users u ON u.userID = s.userID
+            WHERE s.session_token = %s AND s.revoked = FALSE AND s.expires_at > CURRENT_TIMESTAMP()
+              AND u.disabled = FALSE AND u.deleted = FALSE
+            """,
+            (token_hash,),
+            fetch_all=False
         )
     except mariadb.Error as e:
         logger.error("DB error during session lookup: %s", e, exc_info=e)
@@ -58,91 +92,83 @@ async def authenticate(websocket: WebSocket, msg: dict) -> str | None:
         await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
         return None
 
-    if not sessions:
+    if not user:
         logger.warning("Invalid or expired session token.")
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return None
 
-    user_id = sessions[0]["userID"]
-
-    # Fetch user record
-    try:
-        users = await fetch_records(
-            table="users",
-            where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
-            params=(user_id,),
-            fetch_all=True
-        )
-    except mariadb.Error as e:
-        logger.error("DB error during user lookup: %s", e, exc_info=e)
-        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
-        return None
-    except Exception as e:
-        logger.error("Unexpected error during user lookup: %s", e, exc_info=e)
-        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
-        return None
-
-    if not users:
-        logger.error("Session valid but no active user found (userID=%s).", user_id)
-        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
-        return None
-
-    username = users[0]["username"]
+    user = {"userID": user["userID"], "username": user["username"]}
+    auth_cache.set(token_hash, user)
 
-    logger.info("User authenticated: %s (userID=%s)", username, user_id)
-    return username
+    logger.info("User authenticated: %s (userID=%s)", user["username"], user["userID"])
+    return user
 
-async def join_chat(username: str, chatID: int, ws: WebSocket):
-    participant = await fetch_records(
-        table="participants",
-        where_clause="chatID = %s AND userID = (SELECT userID FROM users WHERE username = %s)",
-        params=(chatID, username),
-        fetch_all=True
-    )
-    if not participant:
+def _subscribe(chatID: int, ws: WebSocket) -> bool:
+    """
+    Add one subscription to both indexes. Returns True if it is the first
+    subscription to the chat on this node.
+    """
+    subs = chat_subscriptions.get(chatID)
+    first = not subs
+    if subs is None:
+        subs = chat_subscriptions[chatID] = set()
+    subs.add(ws)
+    socket_chats.setdefault(ws, set()).add(chatID)
+    return first
+
+def _unsubscribe(chatID: int, ws: WebSocket) -> None:
+    """
+    Drop one subscription from both indexes, pruning empty entries.
+    """
+    subs = chat_subscriptions.get(chatID)
+    if subs is not None:
+        subs.discard(ws)
+        if not subs:
+            chat_subscriptions.pop(chatID, None)
+    chats = socket_chats.get(ws)
+    if chats is not None:
+        chats.discard(chatID)
+        if not chats:
+            socket_chats.pop(ws, None)
+
+async def join_chat(user: dict, chatID: int, ws: WebSocket):
+    username = user["username"]
+    if not await membership.is_member(chatID, user["userID"]):
         return { "type": "error", "message": "Access denied for this chat." }
     try:
-        chat_subscriptions.setdefault(chatID, set()).add(ws)
+        if _subscribe(chatID, ws):
+            await sharding.subscribed(chatID)
         await emit_call_state(ws, chatID)
     except Exception as e:
         logger.error("Error adding %s to chat %s: %s", username, chatID, e, exc_info=e)
 
 async def leave_chat(username: str, chatID: int, ws: WebSocket):
     try:
-        chat_subscriptions.get(chatID, set()).discard(ws)
+        _unsubscribe(chatID, ws)
         logger.debug("%s left chat %s", username, chatID)
     except Exception as e:
         logger.error("Error removing %s from chat %s: %s", username, chatID, e, exc_info=e)
 
-async def post_msg(username: str, chatID: int, text, ws: WebSocket) -> dict | None:
+async def _is_participant(chatID: int, user_id: int, ws: WebSocket) -> bool:
+    """
+    Membership check for the message hot path. A socket that joined the
+    chat was already checked by join_chat; anything else is answered by the
+    membership cache, which only hits the database for chats not in it.
+    """
+    return chatID in socket_chats.get(ws, ()) or await membership.is_member(chatID, user_id)
+
+async def post_msg(user: dict, chatID: int, text, ws: WebSocket) -> dict | None:
     """
     Inserts and broadcasts a message. Returns the payload or error payload dict.
     """
 
     # Validate inputs
-    if not username or chatID is None or text is None:
+    if not user or chatID is None or text is None:
         return {"type": "error", "message": "Invalid message content."}
 
-    # Fetch userID
-    try:
-        users = await fetch_records(
-            table="users",
-            where_clause="username = %s",
-            params=(username,),
-            fetch_all=True
-        )
-    except mariadb.Error as e:
-        logger.error("DB error fetching user %s: %s", username, e, exc_info=e)
-        return { "type": "error", "message": "Interal server error." }
-    except Exception as e:
-        logger.error("Unexpected error fetching user %s: %s", username, e, exc_info=e)
-        return { "type": "error", "message": "Interal server error." }
-
-    if not users:
-        return { "type": "error", "message": "User not found." }
-    user_rec = users[0]
-    user_id = user_rec["userID"]
-    display_name = user_rec.get("username", username)
+    username = user["username"]
+    user_id = user["userID"]
+    display_name = username
 
     # Validate text
     if not text.strip():
@@ -152,21 +178,23 @@ async def post_msg(username: str, chatID: int, text, ws: WebSocket) -> dict | No
         logger.warning("Message too long (%s chars) from %s in chat %s", len(text), username, chatID)
         return {"status": "error", "code": "TOO_LONG", "message": "Message exceeds 2048-character limit.", "limit": 2048, "length": len(text)}
 
-    participant = await fetch_records(
-        table="participants",
-        where_clause="chatID=%s AND userID=%s",
-        params=(chatID, user_id),
-        fetch_all=True
-    )
-    if not participant:
+    if not await _is_participant(chatID, user_id, ws):
         return {"status": "error", "code": "NOT_IN_CHAT", "message": "You are not a member of this chat."}
 
-    # Insert message
+    # Insert message, reading its ID and timestamp back in the same round trip
+    # (or spool it for the next group commit when write-behind is enabled)
     try:
-        message_id = await insert_record(
-            "messages",
-            {"chatID": chatID, "userID": user_id, "message": text}
-        )
+        if WRITE_BEHIND:
+            row = message_writer.submit(chatID, user_id, text)
+        else:
+            row = await insert_returning(
+                "messages",
+                {"chatID": chatID, "userID": user_id, "message": text},
+                returning=("messageID", "timestamp")
+            )
+    except BacklogFull as e:
+        logger.warning("Refusing message from %s: %s", username, e)
+        return {"status": "error", "code": "SERVER_BUSY", "message": "Server is busy, please try again."}
     except mariadb.Error as e:
         logger.error("DB error inserting message for %s: %s", username, e, exc_info=e)
         return {"status": "error", "code": "DB_ERROR", "message": "Internal server error."}
@@ -174,154 +202,117 @@ async def post_msg(username: str, chatID: int, text, ws: WebSocket) -> dict | No
         logger.error("Unexpected error inserting message for %s: %s", username, e, exc_info=e)
         return {"status": "error", "code": "INTERNAL_ERROR", "message": "Internal server error."}
 
-    # Fetch inserted
-    try:
-        rows = await fetch_records(
-            table="messages",
-            where_clause="messageID = %s",
-            params=(message_id,),
-            fetch_all=True
-        )
-    except Exception as e:
-        logger.error("Error fetching inserted message %s: %s", message_id, e, exc_info=e)
-        return None
-
-    if not rows:
-        return None
-    row = rows[0]
-
     payload = {
         "type": "new_message",
         "messageID": row["messageID"],
-        "chatID": row["chatID"],
-        "userID": row["userID"],
+        "chatID": chatID,
+        "userID": user_id,
         "username": display_name,
-        "message": row["message"],
+        "message": text,
         "timestamp": row["timestamp"].isoformat()
     }
 
-    await broadcast_chat(chatID, payload, exclude_ws=ws)
+    # the sender gets the payload as the reply instead
+    await broadcast_chat(chatID, payload, exclude_ws={ws})
+    if typing_indicator.stop(username, chatID):
+        await broadcast_typing_stop(username, chatID)
     return payload
 
 async def broadcast_typing(username: str, chatID: int):
-    payload = {"type": "user_typing", "username": username, "chatID": chatID}
-    await broadcast_chat(chatID, payload, exclude_users=username)
+    """
+    Fan out a typing event, unless it only repeats the state others already see.
+    """
+    if not typing_indicator.typing(username, chatID):
+        return
+    payload = {"type": "user_typing", "username": username, "chatID": chatID, "typing": True}
+    await broadcast_chat(chatID, payload, exclude_users={username})
+
+async def broadcast_typing_stop(username: str, chatID: int):
+    payload = {"type": "user_typing", "username": username, "chatID": chatID, "typing": False}
+    await broadcast_chat(chatID, payload, exclude_users={username})
 
-async def notify_status(username: str, is_online: bool):
+async def notify_status(user: dict, is_online: bool):
     """
     Notify only users related to the given user about their status change.
     Updates the global user_status dictionary.
     """
+    username = user["username"]
     try:
         # Update the user_status dictionary
         user_status[username] = is_online
 
-        # Fetch all chat IDs the user is part of
-        user_chats = await fetch_records(
-            table="participants",
-            where_clause="userID = (SELECT userID FROM users WHERE username = %s)",
-            params=(username,),
-            fetch_all=True
-        )
-        chatIDs = {row["chatID"] for row in user_chats}
-
-        # Fetch all usernames of participants in those chats
-        related_users = set()
-        for chatID in chatIDs:
-            participants = await fetch_records(
-                table="participants",
-                where_clause="chatID = %s",
-                params=(chatID,),
-                fetch_all=True
-            )
-            related_users.update(
-                row["userID"] for row in participants if row["userID"] != username
-            )
-
-        # Fetch usernames for related user IDs
-        related_usernames = []
-        for user_id in related_users:
-            user_row = await fetch_records(
-                table="users",
-                where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
-                params=(user_id,),
-                fetch_all=False
-            )
-            if user_row:
-                related_usernames.append(user_row["username"])
-
-        # Notify only related users
-        payload = {"type": "user_status", "username": username, "online": is_online}
-        for related_username in related_usernames:
-            ws = active_connections.get(related_username)
-            if ws:
-                try:
-                    await ws.send_json(payload)
-                except Exception as e:
-                    logger.warning("Removing dead connection for %s: %s", related_username, e)
-                    active_connections.pop(related_username, None)
+        await presence.ensure_user(user["userID"], username)
+        _notify_contacts(user["userID"], username, is_online)
+        await bus.publish({"op": "status", "userID": user["userID"], "username": username, "online": is_online})
     except Exception as e:
         logger.error("Failed to notify status for %s: %s", username, e, exc_info=e)
 
-async def get_online_users_for_user(username: str) -> list[str]:
+def _notify_contacts(user_id: int, username: str, is_online: bool) -> None:
     """
-    Get a list of online users who share common chats with the given user.
+    Tell the related users connected to this node about a status change.
     """
-    try:
-        # Fetch all chat IDs the user is part of
-        user_chats = await fetch_records(
-            table="participants",
-            where_clause="userID = (SELECT userID FROM users WHERE username = %s)",
-            params=(username,),
-            fetch_all=True
-        )
-        chatIDs = {row["chatID"] for row in user_chats}
-
-        # Fetch all usernames of participants in those chats
-        related_users = set()
-        for chatID in chatIDs:
-            participants = await fetch_records(
-                table="participants",
-                where_clause="chatID = %s",
-                params=(chatID,),
-                fetch_all=True
-            )
-            related_users.update(
-                row["userID"] for row in participants if row["userID"] != username
-            )
+    payload = outbound.encode({"type": "user_status", "username": username, "online": is_online})
+    for related_username in presence.contact_names(user_id) & active_connections.keys():
+        _deliver(related_username, payload)
 
-        # Fetch usernames for related user IDs
-        online_users = []
-        for user_id in related_users:
-            user_row = await fetch_records(
-                table="users",
-                where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
-                params=(user_id,),
-                fetch_all=False
-            )
-            if user_row and user_status.get(user_row["username"], False):
-                online_users.append(user_row["username"])
+def is_online(username: str) -> bool:
+    """Online on this node or on any other node."""
+    return user_status.get(username, False) or any(username in users for users in remote_online.values())
 
-        return online_users
+async def get_online_users_for_user(user: dict) -> list[str]:
+    """
+    Get a list of online users who share common chats with the given user.
+    """
+    username = user["username"]
+    try:
+        await presence.ensure_user(user["userID"], username)
+        return [
+            name for name in presence.contact_names(user["userID"])
+            if is_online(name)
+        ]
     except Exception as e:
         logger.error("Failed to get online users for %s: %s", username, e, exc_info=e)
         return []
 
-async def send_to_user(username: str, payload: dict) -> bool:
+def _deliver(username: str, payload: dict | outbound.Frame) -> bool:
     """
-    Best-effort send to a specific online user.
-    Returns True if a connection existed and we attempted a send.
+    Queue payload for an online user without waiting on their socket.
+    Closed sockets are left to cleanup_connection (or the heartbeat reaper),
+    which also tells the user's contacts they went offline.
     """
     ws = active_connections.get(username)
     if not ws:
         return False
-    try:
-        await ws.send_json(payload)
-        return True
-    except Exception as e:
-        logger.warning("Dropping dead connection for %s: %s", username, e)
-        active_connections.pop(username, None)
-        return False
+    return outbound.send(ws, payload)
+
+async def send_to_user(username: str, payload: dict) -> bool:
+    """
+    Best-effort send to a specific online user, on whichever node they are.
+    Returns True if a local connection existed and the payload was queued,
+    or if the user is connected to another node.
+    """
+    if username in active_connections:
+        return _deliver(username, payload)
+    await bus.publish({"op": "users", "usernames": [username], "payload": _plain(payload)})
+    return is_online(username)
+
+async def _deliver_many(usernames, payload: dict | outbound.Frame) -> None:
+    """
+    Send one payload to several users: local ones directly, the rest with a
+    single backplane event.
+    """
+    frame = outbound.encode(payload)
+    remote = []
+    for username in usernames:
+        if username in active_connections:
+            _deliver(username, frame)
+        else:
+            remote.append(username)
+    if remote:
+        await bus.publish({"op": "users", "usernames": remote, "payload": frame.payload})
+
+def _plain(payload: dict | outbound.Frame) -> dict:
+    return payload.payload if isinstance(payload, outbound.Frame) else payload
 
 async def broadcast_chat(
     chatID: int,
@@ -330,14 +321,33 @@ async def broadcast_chat(
     exclude_ws: set | None = None,
 ) -> None:
     """
-    Send to everyone currently subscribed to chatID, excluding:
+    Send to everyone currently subscribed to chatID, on every node, excluding:
       - any usernames in exclude_users (mapped via active_connections)
-      - any websocket objects in exclude_ws
+      - any websocket objects in exclude_ws (local sockets only)
     """
+    _broadcast_local(chatID, payload, exclude_users, exclude_ws)
+    event = {
+        "op": "chat",
+        "chatID": chatID,
+        "payload": _plain(payload),
+        "exclude_users": list(exclude_users or ()),
+    }
+    if sharding.ENABLED:
+        await sharding.route_chat(event)
+    else:
+        await bus.publish(event)
+
+def _broadcast_local(
+    chatID: int,
+    payload: dict | outbound.Frame,
+    exclude_users: set[str] | None = None,
+    exclude_ws: set | None = None,
+) -> None:
     subs = chat_subscriptions.get(chatID, set())
     if not subs:
         return
 
+    frame = outbound.encode(payload)
     exc_ws = set(exclude_ws or ())
     if exclude_users:
         for u in exclude_users:
@@ -345,29 +355,24 @@ async def broadcast_chat(
             if ws:
                 exc_ws.add(ws)
 
-    for ws in set(subs):
+    for ws in list(subs):
         if ws in exc_ws:
             continue
-        try:
-            await ws.send_json(payload)
-        except Exception as e:
-            logger.warning("Removing dead connection in chat %s: %s", chatID, e)
-            subs.discard(ws)
+        if not outbound.send(ws, frame) and not outbound.is_open(ws):
+            logger.warning("Removing dead connection in chat %s", chatID)
+            _unsubscribe(chatID, ws)
 
 async def emit_call_state(ws: WebSocket, chatID: int) -> None:
     """Send current call state for a chat to a single websocket, if any."""
-    call_id = pending_calls.get(chatID)
-    if not call_id:
-        return
-    session = call_sessions.get(call_id)
+    session = call_manager.for_chat(chatID)
     if not session:
         return
     return {
         "type": "call_state",
         "chatID": chatID,
-        "call_id": call_id,
-        "initiator": session.get("initiator"),
-        "state": session.get("state", "ringing"),
+        "call_id": session.call_id,
+        "initiator": session.initiator,
+        "state": session.state,
     }
 
 async def broadcast_chat_created(chatID: int, creator_username: str):
@@ -375,94 +380,118 @@ async def broadcast_chat_created(chatID: int, creator_username: str):
     Broadcast 'chat_created' to all participants of the chat except the creator.
     """
     try:
-        # Step 1: fetch userIDs of participants
-        participants_rows = await fetch_records(
-            table="participants",
-            where_clause="chatID = %s",
-            params=(chatID,)
-        )
-        if not participants_rows:
+        membership.invalidate(chatID)
+        await presence.refresh_chat(chatID)
+        usernames = await membership.usernames(chatID)
+        if not usernames:
             return
 
-        user_ids = [row["userID"] for row in participants_rows]
-
-        # Step 2: fetch usernames for those userIDs
-        usernames = []
-        for uid in user_ids:
-            user_row = await fetch_records(
-                table="users",
-                where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
-                params=(uid,),
-                fetch_all=False
-            )
-            if user_row:
-                usernames.append(user_row["username"])
-
-        payload = {
+        payload = outbound.encode({
             "type": "chat_created",
             "chatID": chatID,
             "creator": creator_username,
-        }
+        })
 
-        for username in usernames:
-            if username == creator_username:
-                continue
-            ws = active_connections.get(username)
-            if ws:
-                try:
-                    await ws.send_json(payload)
-                except Exception as e:
-                    logging.warning("Failed to send chat_created to %s: %s", username, e)
-                    active_connections.pop(username, None)
+        await bus.publish({"op": "chat_changed", "chatID": chatID})
+        await _deliver_many((u for u in usernames if u != creator_username), payload)
 
     except Exception as e:
         logging.error("Failed to broadcast chat_created: %s", e)
 
-async def cleanup_connection(username: str, ws: WebSocket) -> None:
+def forget_identity(user_id: int) -> int:
+    """
+    Drop every cached identity of a user, e.g. after their sessions were revoked.
+    """
+    return auth_cache.pop_where(lambda identity: identity["userID"] == user_id)
+
+def unsubscribe_user(username: str, chatID: int) -> None:
+    """Stop delivering a chat to a user who was removed from it."""
+    ws = active_connections.get(username)
+    if ws:
+        _unsubscribe(chatID, ws)
+
+def track_session(ws: WebSocket, user: dict, token: str) -> None:
+    """Remember which session a socket authenticated with, for revoke_sessions."""
+    socket_sessions[ws] = (user["userID"], hashlib.sha256(token.encode()).hexdigest())
+
+async def revoke_sessions(user_id: int, code: int, reason: str = "",
+                          session: str | None = None, keep: str | None = None) -> None:
+    """
+    Forget cached identities of revoked sessions and close the sockets that
+    use them: one session (by token hash) if `session` is given, otherwise
+    every session of the user except `keep`.
+    """
+    if session is not None:
+        auth_cache.pop(session)
+    else:
+        forget_identity(user_id)
+    for ws, (uid, token_hash) in list(socket_sessions.items()):
+        if uid != user_id or token_hash == keep or (session is not None and token_hash != session):
+            continue
+        if outbound.is_open(ws):
+            try:
+                await ws.close(code=code, reason=reason)
+            except Exception as e:
+                logger.debug("Closing socket of user %s failed: %s", user_id, e)
+
+async def disconnect_user(username: str, code: int, reason: str = "") -> None:
+    """
+    Close the chat and call sockets of a user; the endpoints clean up after them.
+    """
+    for registry in (active_connections, active_call_connections):
+        ws = registry.get(username)
+        if ws and outbound.is_open(ws):
+            try:
+                await ws.close(code=code, reason=reason)
+            except Exception as e:
+                logger.debug("Closing socket of %s failed: %s", username, e)
+
+async def cleanup_connection(user: dict, ws: WebSocket) -> None:
     """
     Remove this websocket from all registries and mark the user offline.
     Safe to call even if things are already partially cleaned up.
     """
-    # Remove from all chat subscriptions
-    for subs in chat_subscriptions.values():
-        subs.discard(ws)
+    username = user["username"]
+    socket_sessions.pop(ws, None)
+    # Remove from the chats this socket joined (and only those)
+    for chatID in list(socket_chats.get(ws, ())):
+        _unsubscribe(chatID, ws)
 
     # Remove from idle subscriptions
     idle_subscriptions.discard(ws)
 
-    # Remove from active_connections *only if* this ws is still the one stored
+    # Leave the call rooms it joined for signaling
+    try:
+        await calls.leave_all_signaling(ws)
+    except Exception as e:
+        logger.error("Failed to leave call rooms for %s: %s", username, e, exc_info=e)
+
+    # Stop its writer; anything still queued is undeliverable
+    await outbound.close_writer(ws)
+
+    # Remove from active_connections *only if* this ws is still the one stored.
+    # A socket that was already replaced by a reconnect (or already cleaned
+    # up by the heartbeat reaper) must not mark the user offline.
     current_ws = active_connections.get(username)
-    if current_ws is ws:
-        active_connections.pop(username, None)
+    if current_ws is not ws:
+        return
+    active_connections.pop(username, None)
+    for chatID in typing_indicator.stop_user(username):
+        await broadcast_typing_stop(username, chatID)
+    try:
+        await calls.caller_disconnected(username)
+    except Exception as e:
+        logger.error("Failed to end calls of %s: %s", username, e, exc_info=e)
 
     # Notify others the user is offline (also updates user_status)
     try:
-        await notify_status(username, is_online=False)
+        await notify_status(user, is_online=False)
     except Exception as e:
         logger.error("Failed to notify status for %s: %s", username, e, exc_info=e)
 
 async def get_chat_participant_usernames(chatID: int) -> list[str]:
   try:
-    participants_rows = await fetch_records(
-      table="participants",
-      where_clause="chatID = %s",
-      params=(chatID,),
-      fetch_all=True,
-    )
-    if not participants_rows:
-      return []
-
-    usernames: list[str] = []
-    for row in participants_rows:
-      user_row = await fetch_records(
-        table="users",
-        where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
-        params=(row["userID"],),
-        fetch_all=False,
-      )
-      if user_row:
-        usernames.append(user_row["username"])
-    return usernames
+    return list(await membership.usernames(chatID))
   except Exception as e:
     logger.error("Failed to get usernames for chat %s: %s", chatID, e, exc_info=e)
     return []
@@ -473,12 +502,76 @@ async def broadcast_call_to_chat_participants(chatID: int, payload: dict) -> Non
   Does not depend on chat_subscriptions / join_chat.
   """
   usernames = await get_chat_participant_usernames(chatID)
-  for username in usernames:
-    ws = active_connections.get(username)
-    if not ws:
-      continue
-    try:
-      await ws.send_json(payload)
-    except Exception as e:
-      logger.warning("Removing dead connection for %s: %s", username, e)
-      active_connections.pop(username, None)
\ No newline at end of file
+  await _deliver_many(usernames, payload)
+
+async def sync_call(chatID: int) -> None:
+    """
+    Share the current call state of a chat with the other nodes, so a call
+    started on one node can be answered and joined from another.
+    """
+    session = call_manager.for_chat(chatID)
+    await bus.publish({
+        "op": "call",
+        "chatID": chatID,
+        "call_id": session.call_id if session else None,
+        "session": session.to_dict() if session else None,
+    })
+
+async def handle_backplane_event(event: dict) -> None:
+    """
+    Deliver an event published by another node to this node's sockets.
+    """
+    if await sharding.handle_event(event):
+        return
+    op = event.get("op")
+    origin = event.get("origin")
+    if op == "chat":
+        deliver_chat_event(event)
+    elif op == "users":
+        frame = outbound.encode(event["payload"])
+        for username in event["usernames"]:
+            _deliver(username, frame)
+    elif op == "status":
+        users = remote_online.setdefault(origin, {})
+        if event["online"]:
+            users[event["username"]] = event["userID"]
+        else:
+            users.pop(event["username"], None)
+        await presence.ensure_user(event["userID"], event["username"])
+        _notify_contacts(event["userID"], event["username"], event["online"])
+    elif op == "roster":
+        remote_online[origin] = dict(event["users"])
+    elif op == "node_down":
+        # Everyone on the lost node went offline with it
+        for username, user_id in remote_online.pop(event["node"], {}).items():
+            if not is_online(username):
+                _notify_contacts(user_id, username, False)
+    elif op == "chat_changed":
+        membership.invalidate(event["chatID"])
+        await presence.refresh_chat(event["chatID"])
+    elif op == "call_signal":
+        call_manager.relay(event["call_id"], event["data"])
+    elif op == "call":
+        ended = call_manager.apply_remote(event["chatID"], event["call_id"], event.get("session"))
+        if ended:
+            await call_manager.close_room(ended)
+    else:
+        logger.warning("Ignoring unknown backplane event %s", op)
+
+def deliver_chat_event(event: dict) -> None:
+    """Deliver a chat event from another node to this node's subscribers."""
+    _broadcast_local(event["chatID"], event["payload"], set(event.get("exclude_users") or ()))
+
+async def announce_roster_periodically() -> None:
+    """
+    Periodically publish who is connected here. Lets nodes that joined late
+    learn the online users, and repairs any missed status events.
+    """
+    while True:
+        try:
+            user_ids = {name: uid for uid, name in presence.usernames.items()}
+            users = {name: user_ids[name] for name in active_connections if name in user_ids}
+            await bus.publish({"op": "roster", "users": users})
+        except Exception as e:
+            logger.error("Failed to announce roster: %s", e, exc_info=e)
+        await asyncio.sleep(ROSTER_INTERVAL)
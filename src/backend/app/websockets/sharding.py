@@ -0,0 +1,168 @@
+import bisect
+import hashlib
+import logging
+import os
+import services
+
+logger = logging.getLogger(__name__)
+
+# Chat-affinity sharding on top of the backplane (WS_SHARDING=true).
+#
+# Every chatID has an owner node, picked by consistent hashing over the live
+# nodes. Instead of publishing each chat event to every node, a node hands
+# it to the chat's owner, and the owner forwards it only to the nodes that
+# have sockets subscribed to that chat. Nodes register that interest with
+# the owner when a chat gets its first local subscriber; stale interest is
+# dropped lazily (a node that receives an event for a chat it no longer
+# has subscribers for tells the owner). When nodes join or leave, ownership
+# of ~1/N of the chats moves and every node re-registers its interest with
+# the new owners.
+ENABLED = os.getenv("WS_SHARDING") == "true"
+VNODES = int(os.getenv("WS_SHARD_VNODES", 128))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with `vnodes` points per node, so removing a node
+    only moves the keys it owned and load stays even across nodes.
+    """
+
+    def __init__(self, nodes=(), vnodes: int = VNODES):
+        self.vnodes = vnodes
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        self.nodes: frozenset[str] = frozenset()
+        self.set_nodes(nodes)
+
+    def set_nodes(self, nodes) -> bool:
+        """
+        Replace the node set. Returns True if it changed.
+        """
+        nodes = frozenset(nodes)
+        if nodes == self.nodes:
+            return False
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+        self.nodes = nodes
+        return True
+
+    def owner(self, key) -> str | None:
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[i]
+
+
+ring = HashRing()
+chat_nodes: dict[int, set[str]] = {} # chatID -> other nodes with subscribers (owned chats only)
+_counters = {
+    "owned_fanouts": 0,
+    "forwarded": 0,
+    "targeted_events": 0,
+    "rebalances": 0,
+    "stale_interest": 0,
+}
+
+
+def owner(chatID: int) -> str:
+    return ring.owner(chatID) or services.bus.node_id
+
+
+def is_owner(chatID: int) -> bool:
+    return owner(chatID) == services.bus.node_id
+
+
+async def route_chat(event: dict) -> None:
+    """
+    Send a chat event, already delivered locally, to the other nodes that need it.
+    """
+    if is_owner(event["chatID"]):
+        await _fan_out(event, skip=services.bus.node_id)
+    else:
+        _counters["forwarded"] += 1
+        await services.bus.publish({**event, "op": "chat_fwd"}, to=owner(event["chatID"]))
+
+
+async def _fan_out(event: dict, skip: str) -> None:
+    _counters["owned_fanouts"] += 1
+    for node in list(chat_nodes.get(event["chatID"], ())):
+        if node != skip:
+            _counters["targeted_events"] += 1
+            await services.bus.publish({
+                "op": "chat",
+                "chatID": event["chatID"],
+                "payload": event["payload"],
+                "exclude_users": event.get("exclude_users", []),
+            }, to=node)
+
+
+async def subscribed(chatID: int) -> None:
+    """
+    A chat got its first subscriber on this node; tell its owner.
+    """
+    if ENABLED and not is_owner(chatID):
+        await services.bus.publish({"op": "subscribe", "chatID": chatID, "node": services.bus.node_id}, to=owner(chatID))
+
+
+async def _rebalance() -> None:
+    _counters["rebalances"] += 1
+    me = services.bus.node_id
+    for chatID in [c for c in chat_nodes if owner(c) != me]:
+        del chat_nodes[chatID]
+    for chatID in list(services.chat_subscriptions):
+        if owner(chatID) != me:
+            await services.bus.publish({"op": "subscribe", "chatID": chatID, "node": me}, to=owner(chatID))
+    logger.info("Shard ring now has %s nodes", len(ring.nodes))
+
+
+async def handle_event(event: dict) -> bool:
+    """
+    Handle sharding and membership events. Returns True if the event was
+    consumed; "chat" and "node_down" still need the regular handling.
+    """
+    op = event.get("op")
+    if op in ("nodes", "node_up", "node_down"):
+        if op == "node_down":
+            for nodes in chat_nodes.values():
+                nodes.discard(event["node"])
+        if ring.set_nodes(services.bus.nodes) and ENABLED:
+            await _rebalance()
+        return op != "node_down"
+    if op == "subscribe":
+        chat_nodes.setdefault(event["chatID"], set()).add(event["node"])
+        return True
+    if op == "unsubscribe":
+        nodes = chat_nodes.get(event["chatID"])
+        if nodes is not None:
+            nodes.discard(event["node"])
+            if not nodes:
+                chat_nodes.pop(event["chatID"], None)
+        return True
+    if op == "chat_fwd":
+        services.deliver_chat_event(event)
+        await _fan_out(event, skip=event.get("origin"))
+        return True
+    if op == "chat" and ENABLED and event["chatID"] not in services.chat_subscriptions:
+        _counters["stale_interest"] += 1
+        await services.bus.publish(
+            {"op": "unsubscribe", "chatID": event["chatID"], "node": services.bus.node_id},
+            to=owner(event["chatID"]),
+        )
+        return True
+    return False
+
+
+def sharding_stats() -> dict:
+    me = services.bus.node_id
+    return {
+        **_counters,
+        "enabled": ENABLED,
+        "nodes": len(ring.nodes),
+        "owned_chats_with_remote_subscribers": len(chat_nodes),
+        "local_chats_owned": sum(1 for c in services.chat_subscriptions if owner(c) == me),
+    }
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Server-side typing aggregation. Clients send "typing" on every keystroke;
+# only state changes are fanned out: one "user_typing" when someone starts,
+# a refresh every REFRESH_INTERVAL while they keep going (clients hide the
+# indicator ~3s after the last frame), and a "typing": false stop once they
+# have been quiet for TIMEOUT seconds or their message was posted.
+REFRESH_INTERVAL = float(os.getenv("TYPING_REFRESH_INTERVAL", 2.0))
+TIMEOUT = float(os.getenv("TYPING_TIMEOUT", 3.0))
+SWEEP_INTERVAL = float(os.getenv("TYPING_SWEEP_INTERVAL", 0.5))
+
+# (username, chatID) -> [last event seen, last frame broadcast]
+_active: dict[tuple[str, int], list[float]] = {}
+_counters = {
+    "events": 0,
+    "broadcasts": 0,
+    "suppressed": 0,
+    "timeout_stops": 0,
+    "explicit_stops": 0,
+}
+
+
+def typing(username: str, chatID: int) -> bool:
+    """
+    Record a typing event. Returns True if it should be broadcast.
+    """
+    now = time.monotonic()
+    _counters["events"] += 1
+    state = _active.get((username, chatID))
+    if state is None:
+        _active[(username, chatID)] = [now, now]
+        _counters["broadcasts"] += 1
+        return True
+    state[0] = now
+    if now - state[1] >= REFRESH_INTERVAL:
+        state[1] = now
+        _counters["broadcasts"] += 1
+        return True
+    _counters["suppressed"] += 1
+    return False
+
+
+def stop(username: str, chatID: int) -> bool:
+    """
+    Forget a typing state, e.g. because the message was sent.
+    Returns True if a stop should be broadcast.
+    """
+    if _active.pop((username, chatID), None) is None:
+        return False
+    _counters["explicit_stops"] += 1
+    return True
+
+
+def stop_user(username: str) -> list[int]:
+    """
+    Forget every typing state of a user. Returns the affected chatIDs.
+    """
+    chats = [chatID for (name, chatID) in _active if name == username]
+    for chatID in chats:
+        del _active[(username, chatID)]
+    _counters["explicit_stops"] += len(chats)
+    return chats
+
+
+def expire() -> list[tuple[str, int]]:
+    """
+    Drop states that went quiet and return them so stops can be sent.
+    """
+    cutoff = time.monotonic() - TIMEOUT
+    expired = [key for key, (last_seen, _) in _active.items() if last_seen <= cutoff]
+    for key in expired:
+        del _active[key]
+    _counters["timeout_stops"] += len(expired)
+    return expired
+
+
+async def expire_periodically(send_stop) -> None:
+    """
+    Background task: send an automatic stop for everyone who went quiet.
+    `send_stop(username, chatID)` is a coroutine function.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        for username, chatID in expire():
+            try:
+                await send_stop(username, chatID)
+            except Exception as e:
+                logger.error("Failed to send typing stop for %s in %s: %s", username, chatID, e, exc_info=e)
+
+
+def typing_stats() -> dict:
+    return {**_counters, "active": len(_active)}
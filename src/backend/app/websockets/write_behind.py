@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from db_helper import fetch_query, insert_many
+
+logger = logging.getLogger(__name__)
+
+# Optional group-commit mode for chat messages.
+#
+# post_msg gets its messageID and timestamp from here instead of the
+# database, the message is appended to a local spool file and acknowledged,
+# and a background task writes pending messages in multi-row INSERTs once
+# BATCH_SIZE are queued or FLUSH_INTERVAL has passed. On startup the spool
+# is replayed with INSERT IGNORE, so messages acknowledged before a crash
+# are never lost and never duplicated.
+#
+# IDs are allocated in-process from MAX(messageID), so only one process may
+# write messages while this mode is on: start() refuses to run when the
+# server is configured for several nodes, and a batch whose IDs were taken
+# anyway is renumbered rather than dropped (see _resolve_collisions).
+# Timestamps follow the database clock, like those of CURRENT_TIMESTAMP.
+ENABLED = os.getenv("MESSAGE_WRITE_BEHIND") == "true"
+MULTI_NODE = os.getenv("WS_BACKPLANE", "local") != "local" or os.getenv("WS_SHARDING") == "true"
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_MS", 50)) / 1000
+SPOOL_PATH = os.getenv(
+    "WRITE_BEHIND_SPOOL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "message_spool.jsonl"),
+)
+# "always": fsync every append before acknowledging (survives power loss)
+# "batch":  flush every append, fsync once per DB batch (survives process crashes)
+FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "batch")
+# Rewrite the spool once it grows past this while messages are still pending
+SPOOL_COMPACT_BYTES = int(os.getenv("WRITE_BEHIND_SPOOL_COMPACT_BYTES", 16 * 1024 * 1024))
+# Messages waiting for the database before new ones are refused
+MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+# How often the offset to the database clock is re-read
+CLOCK_SYNC_INTERVAL = 300
+
+DUPLICATE_KEY = 1062
+
+COLUMNS = ("messageID", "chatID", "userID", "message", "timestamp")
+
+
+class BacklogFull(Exception):
+    """MAX_PENDING messages are waiting for the database already."""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class MessageWriter:
+    def __init__(self):
+        self._pending: list[dict] = []
+        self._next_id = None
+        self._clock_offset = None # database clock minus UTC
+        self._clock_synced = 0.0
+        self._spool = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._counters = {
+            "submitted": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "replayed": 0,
+            "rejected_full": 0,
+            "id_collisions": 0,
+            "max_batch": 0,
+            "flush_time_total": 0.0,
+            "max_flush_ms": 0.0,
+            "max_commit_lag_ms": 0.0,
+        }
+
+    # ---- lifecycle ----
+
+    async def start(self) -> None:
+        """
+        Replay the spool left by a previous run, then start flushing.
+        """
+        if MULTI_NODE:
+            raise RuntimeError(
+                "MESSAGE_WRITE_BEHIND allocates message IDs in-process and cannot be used "
+                "with WS_BACKPLANE=socket or WS_SHARDING; disable one of them"
+            )
+        await self._replay()
+        await self._sync_clock()
+        row = await fetch_query("SELECT COALESCE(MAX(messageID), 0) AS max_id FROM messages", fetch_all=False)
+        self._next_id = row["max_id"] + 1
+        self._spool = open(SPOOL_PATH, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+        logger.info("Message write-behind enabled (batch=%s, interval=%ss)", BATCH_SIZE, FLUSH_INTERVAL)
+
+    async def stop(self) -> None:
+        """
+        Flush everything that is pending and stop the background task.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            if not await self._flush():
+                logger.error("Shutting down with %s unflushed messages; they stay in the spool", len(self._pending))
+                break
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+
+    # ---- hot path ----
+
+    def submit(self, chatID: int, userID: int, text: str) -> dict:
+        """
+        Assign an ID and timestamp, make the message durable in the spool
+        and queue it for the next batch. Returns {messageID, timestamp}.
+        Raises BacklogFull while MAX_PENDING messages are unflushed.
+        """
+        if len(self._pending) >= MAX_PENDING:
+            self._counters["rejected_full"] += 1
+            raise BacklogFull(f"{len(self._pending)} messages waiting for the database")
+        now = (_utcnow() + self._clock_offset).replace(microsecond=0)
+        msg = {
+            "messageID": self._next_id,
+            "chatID": chatID,
+            "userID": userID,
+            "message": text,
+            "timestamp": now,
+            "queued_at": time.monotonic(),
+        }
+        self._next_id += 1
+
+        record = {k: msg[k] for k in COLUMNS}
+        record["timestamp"] = now.isoformat()
+        self._spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._spool.flush()
+        if FSYNC == "always":
+            os.fsync(self._spool.fileno())
+
+        self._pending.append(msg)
+        self._counters["submitted"] += 1
+        if len(self._pending) >= BATCH_SIZE:
+            self._wakeup.set()
+        return {"messageID": msg["messageID"], "timestamp": now}
+
+    # ---- flushing ----
+
+    async def _run(self) -> None:
+        backoff = FLUSH_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if time.monotonic() - self._clock_synced >= CLOCK_SYNC_INTERVAL:
+                try:
+                    await self._sync_clock()
+                except Exception as e:
+                    logger.warning("Could not read the database clock: %s", e)
+            if not self._pending:
+                continue
+            if await self._flush():
+                backoff = FLUSH_INTERVAL
+            else:
+                backoff = min(max(backoff * 2, 0.1), 5.0)
+
+    async def _sync_clock(self) -> None:
+        row = await fetch_query("SELECT NOW() AS now", fetch_all=False)
+        self._clock_offset = row["now"] - _utcnow()
+        self._clock_synced = time.monotonic()
+
+    async def _flush(self) -> bool:
+        batch = self._pending[:BATCH_SIZE]
+        if FSYNC == "batch" and self._spool:
+            os.fsync(self._spool.fileno())
+        started = time.monotonic()
+        try:
+            # plain INSERT: a messageID someone else took must fail loudly, not be skipped
+            await insert_many("messages", COLUMNS, [tuple(m[c] for c in COLUMNS) for m in batch])
+        except Exception as e:
+            if e.args and e.args[0] == DUPLICATE_KEY:
+                return await self._resolve_collisions(batch, started)
+            self._counters["flush_errors"] += 1
+            logger.error("Write-behind flush of %s messages failed: %s", len(batch), e, exc_info=e)
+            return False
+
+        self._flushed(batch, started)
+        return True
+
+    async def _resolve_collisions(self, batch: list[dict], started: float) -> bool:
+        """
+        Some IDs of `batch` exist already. Rows that are ours (an earlier
+        attempt committed) are done; the others were taken by another writer
+        and get new IDs past MAX(messageID), so they are stored instead of
+        lost. Clients keep the old ID until they reload the chat.
+        """
+        ids = [m["messageID"] for m in batch]
+        try:
+            rows = await fetch_query(
+                "SELECT messageID, chatID, userID, message FROM messages WHERE messageID IN ("
+                + ", ".join(["%s"] * len(ids)) + ")",
+                tuple(ids),
+            )
+            existing = {r["messageID"]: (r["chatID"], r["userID"], r["message"]) for r in rows}
+            todo, taken = [], []
+            for m in batch:
+                found = existing.get(m["messageID"])
+                if found is None:
+                    todo.append(m)
+                elif found != (m["chatID"], m["userID"], m["message"]):
+                    todo.append(m)
+                    taken.append(m)
+            if taken:
+                row = await fetch_query("SELECT COALESCE(MAX(messageID), 0) AS max_id FROM messages", fetch_all=False)
+                self._next_id = max(self._next_id, row["max_id"] + 1)
+                for m in taken:
+                    logger.error("messageID %s in chat %s was taken by another writer; storing it as %s",
+                                 m["messageID"], m["chatID"], self._next_id)
+                    m["messageID"] = self._next_id
+                    self._next_id += 1
+                self._counters["id_collisions"] += len(taken)
+            await insert_many("messages", COLUMNS, [tuple(m[c] for c in COLUMNS) for m in todo])
+        except Exception as e:
+            self._counters["flush_errors"] += 1
+            logger.error("Write-behind flush of %s messages failed: %s", len(batch), e, exc_info=e)
+            return False
+        self._flushed(batch, started)
+        return True
+
+    def _flushed(self, batch: list[dict], started: float) -> None:
+        finished = time.monotonic()
+        del self._pending[:len(batch)]
+        flush_ms = 1000 * (finished - started)
+        lag_ms = 1000 * (finished - batch[0]["queued_at"])
+        c = self._counters
+        c["flushes"] += 1
+        c["flushed_rows"] += len(batch)
+        c["max_batch"] = max(c["max_batch"], len(batch))
+        c["flush_time_total"] += finished - started
+        c["max_flush_ms"] = max(c["max_flush_ms"], round(flush_ms, 3))
+        c["max_commit_lag_ms"] = max(c["max_commit_lag_ms"], round(lag_ms, 3))
+
+        self._trim_spool()
+        if len(self._pending) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def _trim_spool(self) -> None:
+        """
+        Everything in the spool that is also in the database can go.
+        """
+        if not self._spool:
+            return
+        if not self._pending:
+            self._spool.truncate(0)
+            self._spool.seek(0)
+            return
+        if self._spool.tell() < SPOOL_COMPACT_BYTES:
+            return
+        tmp = SPOOL_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for m in self._pending:
+                record = {k: m[k] for k in COLUMNS}
+                record["timestamp"] = m["timestamp"].isoformat()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._spool.close()
+        os.replace(tmp, SPOOL_PATH)
+        self._spool = open(SPOOL_PATH, "a", encoding="utf-8")
+
+    async def _replay(self) -> None:
+        if not os.path.exists(SPOOL_PATH):
+            return
+        rows = []
+        with open(SPOOL_PATH, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn final line from a crash mid-write; it was never acknowledged
+                    logger.warning("Skipping unreadable spool line")
+                    continue
+                r["timestamp"] = datetime.fromisoformat(r["timestamp"])
+                rows.append(tuple(r[c] for c in COLUMNS))
+        # IGNORE: rows of a batch that was committed before the crash are skipped
+        for i in range(0, len(rows), BATCH_SIZE):
+            await insert_many("messages", COLUMNS, rows[i:i + BATCH_SIZE], ignore=True)
+        os.remove(SPOOL_PATH)
+        self._counters["replayed"] += len(rows)
+        if rows:
+            logger.info("Replayed %s spooled messages", len(rows))
+
+    def stats(self) -> dict:
+        c = self._counters
+        return {
+            **c,
+            "enabled": ENABLED,
+            "pending": len(self._pending),
+            "max_pending": MAX_PENDING,
+            "oldest_pending_ms": round(1000 * (time.monotonic() - self._pending[0]["queued_at"]), 3) if self._pending else 0.0,
+            "avg_flush_ms": round(1000 * c["flush_time_total"] / c["flushes"], 3) if c["flushes"] else 0.0,
+        }
+
+
+writer = MessageWriter()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark: cost of fanning one chat message out to N subscribers.
+
+Compares encoding the payload for every recipient (the old send_json path)
+against encoding it once into an outbound.Frame and queueing that buffer.
+Sockets are in-memory fakes, so this measures the event-loop CPU spent per
+broadcast, not network time.
+
+Usage (from src/backend):
+    python benchmarks/bench_fanout.py [--sizes 10,50,100,500,1000] [--rounds 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "websockets"))
+
+from fastapi.websockets import WebSocketState  # noqa: E402
+import outbound  # noqa: E402
+
+
+class FakeSocket:
+    application_state = WebSocketState.CONNECTED
+    client_state = WebSocketState.CONNECTED
+
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+PAYLOAD = {
+    "type": "new_message",
+    "messageID": 123456,
+    "chatID": 42,
+    "userID": 7,
+    "username": "benchmark_user",
+    "message": "The quick brown fox jumps over the lazy dog. " * 8,
+    "timestamp": "2026-01-01T12:00:00",
+}
+
+
+async def per_recipient(sockets, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for ws in sockets:
+            await ws.send_json(PAYLOAD)
+    return time.perf_counter() - started
+
+
+async def encode_once(sockets, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        frame = outbound.encode(PAYLOAD)
+        for ws in sockets:
+            outbound.send(ws, frame)
+        # let the writers drain so queues never overflow
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    for ws in sockets:
+        await outbound.close_writer(ws)
+    return elapsed
+
+
+async def main(sizes, rounds):
+    print(f"{'subscribers':>11} {'per-recipient us':>17} {'encode-once us':>15} {'speedup':>8}")
+    for n in sizes:
+        sockets = [FakeSocket() for _ in range(n)]
+        old = await per_recipient(sockets, rounds)
+        new = await encode_once(sockets, rounds)
+        print(f"{n:>11} {1e6 * old / rounds:>17.1f} {1e6 * new / rounds:>15.1f} {old / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,50,100,500,1000")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main([int(x) for x in args.sizes.split(",")], args.rounds))
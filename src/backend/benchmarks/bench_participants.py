@@ -0,0 +1,116 @@
+"""
+Benchmark: latency of resolving the usernames of a chat's participants,
+the first step of ringing a call or announcing a new chat.
+
+Compares the old path (one participants query, then one users query per
+participant, awaited in sequence) with the single joined query behind
+membership.py, cold and from its cache.
+
+By default queries run against an in-memory fake that waits --rtt-ms per
+round trip, so the numbers show how the old path scales with group size.
+With --live CHAT_ID both paths run against the database configured in
+app/websockets/.env instead.
+
+Usage (from src/backend):
+    python benchmarks/bench_participants.py [--sizes 2,10,50,300,1000] [--rtt-ms 0.5]
+    python benchmarks/bench_participants.py --live 42
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "websockets"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), ".."))
+
+import db_helper  # noqa: E402
+import membership  # noqa: E402
+
+
+async def old_participant_usernames(fetch_records, chatID):
+    """The resolver before membership.py, kept here for comparison."""
+    rows = await fetch_records(table="participants", where_clause="chatID = %s", params=(chatID,), fetch_all=True)
+    usernames = []
+    for row in rows:
+        user_row = await fetch_records(
+            table="users",
+            where_clause="userID = %s AND disabled = FALSE AND deleted = FALSE",
+            params=(row["userID"],),
+            fetch_all=False,
+        )
+        if user_row:
+            usernames.append(user_row["username"])
+    return usernames
+
+
+class FakeDB:
+    """participants/users of one chat, answering after one simulated round trip."""
+
+    def __init__(self, size, rtt):
+        self.rtt = rtt
+        self.users = {uid: {"userID": uid, "username": f"user{uid}"} for uid in range(size)}
+        self.queries = 0
+
+    async def fetch_records(self, table, where_clause, params=(), fetch_all=True):
+        self.queries += 1
+        await asyncio.sleep(self.rtt)
+        if table == "participants":
+            return [{"chatID": params[0], "userID": uid} for uid in self.users]
+        return self.users.get(params[0])
+
+    async def fetch_query(self, sql, params=(), fetch_all=True):
+        self.queries += 1
+        await asyncio.sleep(self.rtt)
+        return [{**u, "active": 1} for u in self.users.values()]
+
+
+async def timed(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = await fn()
+    return (time.perf_counter() - started) / rounds, result
+
+
+async def compare(fetch_records, chatID, rounds):
+    old, old_names = await timed(lambda: old_participant_usernames(fetch_records, chatID), rounds)
+
+    async def cold():
+        membership.invalidate(chatID)
+        return await membership.usernames(chatID)
+
+    new, new_names = await timed(cold, rounds)
+    cached, _ = await timed(lambda: membership.usernames(chatID), rounds)
+    assert sorted(old_names) == sorted(new_names), "resolvers disagree"
+    return len(old_names), old, new, cached
+
+
+def row(size, old, new, cached, queries=""):
+    print(f"{size:>8} {queries:>8} {1e3 * old:>10.2f} {1e3 * new:>10.3f} {1e6 * cached:>10.1f} {old / new:>8.1f}x")
+
+
+async def main(sizes, rtt, rounds, live):
+    print(f"{'members':>8} {'queries':>8} {'old ms':>10} {'joined ms':>10} {'cached us':>10} {'speedup':>9}")
+    if live is not None:
+        await db_helper.init_pool()
+        try:
+            size, old, new, cached = await compare(db_helper.fetch_records, live, rounds)
+            row(size, old, new, cached, f"{size + 1}/1")
+        finally:
+            await db_helper.close_pool()
+        return
+    for size in sizes:
+        db = FakeDB(size, rtt)
+        membership.fetch_query = db.fetch_query
+        size, old, new, cached = await compare(db.fetch_records, 1, rounds)
+        row(size, old, new, cached, f"{size + 1}/1")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="2,10,50,300,1000")
+    parser.add_argument("--rtt-ms", type=float, default=0.5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--live", type=int, metavar="CHAT_ID")
+    args = parser.parse_args()
+    asyncio.run(main([int(x) for x in args.sizes.split(",")], args.rtt_ms / 1000, args.rounds, args.live))
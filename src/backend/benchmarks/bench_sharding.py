@@ -0,0 +1,115 @@
+"""
+Benchmark: chat event throughput vs. number of WebSocket workers, with the
+backplane publishing every chat event to every worker ("broadcast") versus
+chat-affinity sharding, where an event only reaches the chat's owner and
+the workers that actually have subscribers for it ("sharded").
+
+The workload mixes a few large group chats with many small DMs. Users are
+spread over the workers by hashing, as a load balancer would. Each worker
+runs in its own process and does what a node does per received event:
+decode it, look up local subscribers, encode the frame once, queue it per
+socket. Throughput is events / CPU time of the busiest worker, i.e. what
+the cluster sustains when every worker has a core of its own (so the
+numbers stay meaningful on a machine with fewer cores than workers).
+
+Usage (from src/backend):
+    python benchmarks/bench_sharding.py [--workers 1,2,4,8] [--events 100000]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "websockets"))
+
+from sharding import HashRing  # noqa: E402
+
+
+def build_workload(groups, group_size, dms, events, group_share, seed=1):
+    rnd = random.Random(seed)
+    members = {}
+    users = group_size * groups + 2 * dms
+    for chatID in range(groups):
+        members[chatID] = rnd.sample(range(users), group_size)
+    for chatID in range(groups, groups + dms):
+        members[chatID] = rnd.sample(range(users), 2)
+    stream = [
+        rnd.randrange(groups) if rnd.random() < group_share else rnd.randrange(groups, groups + dms)
+        for _ in range(events)
+    ]
+    return members, stream
+
+
+def plan(members, stream, workers, mode):
+    """
+    Per worker: local subscriber counts per chat, and the events it receives.
+    """
+    nodes = [f"w{i}" for i in range(workers)]
+    placement = HashRing(nodes)
+    owners = HashRing(nodes)
+    local = {n: {} for n in nodes}
+    for chatID, users in members.items():
+        for u in users:
+            node = placement.owner(f"user:{u}")
+            local[node][chatID] = local[node].get(chatID, 0) + 1
+
+    inbox = {n: [] for n in nodes}
+    for i, chatID in enumerate(stream):
+        line = json.dumps({"op": "chat", "chatID": chatID, "payload": {
+            "type": "new_message", "messageID": i, "chatID": chatID,
+            "username": "bench", "message": "hello there, how is it going?",
+        }})
+        if mode == "broadcast":
+            targets = nodes
+        else:
+            targets = {owners.owner(chatID)} | {n for n in nodes if chatID in local[n]}
+        for n in targets:
+            inbox[n].append(line)
+    return [(local[n], inbox[n]) for n in nodes]
+
+
+def run_worker(args):
+    subscribers, lines = args
+    queue = []
+    started = time.process_time()
+    for line in lines:
+        event = json.loads(line)
+        count = subscribers.get(event["chatID"], 0)
+        if not count:
+            continue
+        text = json.dumps(event["payload"], separators=(",", ":"), ensure_ascii=False)
+        queue.extend([text] * count)
+        if len(queue) > 10000:
+            queue.clear()
+    return time.process_time() - started, len(lines)
+
+
+def main(worker_counts, events, groups, group_size, dms, group_share):
+    members, stream = build_workload(groups, group_size, dms, events, group_share)
+    print(f"{groups} groups x {group_size} members, {dms} DMs, {events} events ({group_share:.0%} to groups)")
+    print(f"{'workers':>7} {'mode':>10} {'events/s':>12} {'max inbox':>10} {'scaling':>8}")
+    base = {}
+    for workers in worker_counts:
+        for mode in ("broadcast", "sharded"):
+            jobs = plan(members, stream, workers, mode)
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(run_worker, jobs)
+            slowest = max(t for t, _ in results)
+            rate = events / slowest
+            base.setdefault(mode, rate)
+            print(f"{workers:>7} {mode:>10} {rate:>12,.0f} {max(n for _, n in results):>10} {rate / base[mode]:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--group-size", type=int, default=500)
+    parser.add_argument("--dms", type=int, default=20000)
+    parser.add_argument("--group-share", type=float, default=0.2)
+    args = parser.parse_args()
+    main([int(x) for x in args.workers.split(",")], args.events, args.groups, args.group_size, args.dms, args.group_share)
@@ -124,12 +124,14 @@ def create_database_and_tables():
                     CREATE TABLE IF NOT EXISTS users (
                       userID         INT AUTO_INCREMENT PRIMARY KEY,
                       username       VARCHAR(20)  NOT NULL UNIQUE,
+                      username_key   VARCHAR(20)  AS (LOWER(username)) PERSISTENT,  # normalized lookup key
                       password       VARCHAR(128) NOT NULL,
                       email          VARCHAR(100),
                       created_at     DATETIME     DEFAULT CURRENT_TIMESTAMP,
                       email_verified BOOLEAN      DEFAULT FALSE,
                       disabled       BOOLEAN      DEFAULT FALSE,
-                      deleted        BOOLEAN      DEFAULT FALSE
+                      deleted        BOOLEAN      DEFAULT FALSE,
+                      UNIQUE INDEX uq_users_username_key (username_key)
                     ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
                     """,
 
@@ -194,7 +196,8 @@ def create_database_and_tables():
                       chatID     INT AUTO_INCREMENT PRIMARY KEY,
                       created_at DATETIME          DEFAULT CURRENT_TIMESTAMP,
                       type       ENUM('private','group') NOT NULL DEFAULT 'private',
-                      group_name VARCHAR(100) DEFAULT NULL
+                      group_name VARCHAR(100) DEFAULT NULL,
+                      member_version INT NOT NULL DEFAULT 0
                     ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
                     """,
 
@@ -221,7 +224,52 @@ def create_database_and_tables():
                       userID    INT NOT NULL,
                       message   TEXT,
                       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                      INDEX idx_msg_chat_ts (chatID, timestamp)
+                      INDEX idx_msg_chat_ts (chatID, timestamp),
+                      INDEX idx_msg_chat_id (chatID, messageID)
+                    ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                    """,
+
+                    # membership_changes: recent member edits per chat, see get_members(since_version)
+                    """
+                    CREATE TABLE IF NOT EXISTS membership_changes (
+                      chatID  INT NOT NULL,
+                      version INT NOT NULL,
+                      userID  INT NOT NULL,
+                      action  ENUM('added','removed') NOT NULL,
+                      PRIMARY KEY (chatID, version, userID),
+                      CONSTRAINT fk_membership_changes_chats
+                        FOREIGN KEY (chatID) REFERENCES chats(chatID)
+                    ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                    """,
+
+                    # ws_outbox: change events from the REST API for the WebSocket server
+                    """
+                    CREATE TABLE IF NOT EXISTS ws_outbox (
+                      eventID    BIGINT AUTO_INCREMENT PRIMARY KEY,
+                      event      VARCHAR(40) NOT NULL,
+                      payload    TEXT NOT NULL,
+                      created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      INDEX idx_outbox_created (created_at)
+                    ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                    """,
+
+                    # mail_queue: outbound mail, sent by the workers in app/services/mail_queue.py
+                    """
+                    CREATE TABLE IF NOT EXISTS mail_queue (
+                      mailID          BIGINT AUTO_INCREMENT PRIMARY KEY,
+                      recipient       VARCHAR(255) NOT NULL,
+                      subject         VARCHAR(255) NOT NULL,
+                      body            TEXT NOT NULL,
+                      status          ENUM('pending','sent','failed') NOT NULL DEFAULT 'pending',
+                      attempts        INT NOT NULL DEFAULT 0,
+                      next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                      locked_by       VARCHAR(64) NULL,
+                      locked_until    DATETIME NULL,
+                      last_error      VARCHAR(255) NULL,
+                      sent_at         DATETIME NULL,
+                      created_at      DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      INDEX idx_mail_due (status, next_attempt_at),
+                      INDEX idx_mail_locked_by (locked_by)
                     ) CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
                     """
                 ]
@@ -231,6 +279,36 @@ def create_database_and_tables():
 
                 logging.info("All tables created or verified successfully.")
 
+                # Upgrades for databases created by older versions.
+                # Each statement must be safe to re-run.
+                migration_statements = [
+                    # users.username_key: LOWER(username), backfilled by the ALTER itself
+                    """
+                    ALTER TABLE users
+                      ADD COLUMN IF NOT EXISTS username_key VARCHAR(20)
+                        AS (LOWER(username)) PERSISTENT AFTER username;
+                    """,
+                    """
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_users_username_key
+                      ON users (username_key);
+                    """,
+                    # keyset pagination of /chat/messages
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_msg_chat_id
+                      ON messages (chatID, messageID);
+                    """,
+                    # versioned group membership
+                    """
+                    ALTER TABLE chats
+                      ADD COLUMN IF NOT EXISTS member_version INT NOT NULL DEFAULT 0;
+                    """,
+                ]
+
+                for stmt in migration_statements:
+                    cursor.execute(stmt)
+
+                logging.info("All migrations applied successfully.")
+
         # 2) Create/grant app user in a fresh connection; autocommit=True
         if DB_ROOT_ACCESS == True:
           with connect(host=DB_HOST, port=DB_PORT, user=user, password=password) as conn:
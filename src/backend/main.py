@@ -1,5 +1,6 @@
 from app import create_app
 from app.database.db_helper import close_db
+from app.services import mail_queue
 from waitress import serve
 import logging
 from dotenv import load_dotenv
@@ -18,9 +19,14 @@ def teardown_db(exception):
 
 if __name__ == "__main__":
     try:
+        # outbound mail is queued by requests and sent by these threads
         if os.getenv("FLASK_ENV") == "dev":
+            # the reloader runs this block in its parent too; only the serving child sends mail
+            if os.getenv("WERKZEUG_RUN_MAIN") == "true":
+                mail_queue.start_workers(app)
             app.run(host='0.0.0.0', port=5123, debug=True)
         else:
+            mail_queue.start_workers(app)
             serve(app, host='0.0.0.0', port=5123, threads=os.getenv("THREADS", 4))
             print("Serving in production mode with Waitress")
     except Exception as e:
@@ -0,0 +1,162 @@
+"""
+Local SMTP stand-in for development: accepts every login and every mail,
+prints a one-line summary of each and optionally saves them as .eml files.
+Nothing is delivered. --fail-rate answers a share of mails with a
+temporary 451 error to exercise the retries of the mail queue.
+
+Point the backend at it with (in .env):
+    MAIL_SMTP_HOST=127.0.0.1
+    MAIL_SMTP_PORT=2525
+    MAIL_SMTP_SSL=false
+
+Usage (from src/backend):
+    python smtp_standin.py [--port 2525] [--save-dir mails] [--fail-rate 0.2] [--latency-ms 50]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import time
+from email import message_from_bytes
+
+stats = {"sessions": 0, "logins": 0, "accepted": 0, "rejected": 0}
+
+
+class Session:
+    def __init__(self, reader, writer, args):
+        self.reader = reader
+        self.writer = writer
+        self.args = args
+        self.sender = None
+        self.recipients = []
+
+    async def reply(self, line: str) -> None:
+        self.writer.write(line.encode() + b"\r\n")
+        await self.writer.drain()
+
+    async def read_line(self) -> str | None:
+        line = await self.reader.readline()
+        if not line:
+            return None
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    async def auth(self, arg: str) -> None:
+        mechanism, _, initial = arg.partition(" ")
+        mechanism = mechanism.upper()
+        if mechanism == "PLAIN":
+            if not initial:
+                await self.reply("334 ")
+                initial = await self.read_line() or ""
+        elif mechanism == "LOGIN":
+            await self.reply("334 " + base64.b64encode(b"Username:").decode())
+            await self.read_line()
+            await self.reply("334 " + base64.b64encode(b"Password:").decode())
+            await self.read_line()
+        else:
+            await self.reply("504 Unrecognized authentication type")
+            return
+        stats["logins"] += 1
+        await self.reply("235 Authentication successful")
+
+    async def data(self) -> None:
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            lines.append(line[1:] if line.startswith(b"..") else line)
+        if self.args.latency_ms:
+            await asyncio.sleep(self.args.latency_ms / 1000)
+        if random.random() < self.args.fail_rate:
+            stats["rejected"] += 1
+            await self.reply("451 Temporary failure, try again later")
+        else:
+            stats["accepted"] += 1
+            self.store(b"".join(lines))
+            await self.reply(f"250 OK queued as {stats['accepted']}")
+        self.sender, self.recipients = None, []
+
+    def store(self, raw: bytes) -> None:
+        subject = message_from_bytes(raw).get("Subject", "")
+        print(f"[mail #{stats['accepted']}] {self.sender} -> {', '.join(self.recipients)}: {subject}", flush=True)
+        if self.args.save_dir:
+            os.makedirs(self.args.save_dir, exist_ok=True)
+            path = os.path.join(self.args.save_dir, f"{time.time():.6f}-{stats['accepted']}.eml")
+            with open(path, "wb") as f:
+                f.write(raw)
+
+    async def run(self) -> None:
+        stats["sessions"] += 1
+        await self.reply("220 chatcli-standin ESMTP ready")
+        while True:
+            line = await self.read_line()
+            if line is None:
+                return
+            command, _, arg = line.partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                await self.reply("250-chatcli-standin")
+                await self.reply("250-AUTH PLAIN LOGIN")
+                await self.reply("250 8BITMIME")
+            elif command == "HELO":
+                await self.reply("250 chatcli-standin")
+            elif command == "AUTH":
+                await self.auth(arg)
+            elif command == "MAIL":
+                self.sender, self.recipients = arg.partition(":")[2].strip().strip("<>"), []
+                await self.reply("250 OK")
+            elif command == "RCPT":
+                if self.sender is None:
+                    await self.reply("503 Need MAIL first")
+                    continue
+                self.recipients.append(arg.partition(":")[2].strip().strip("<>"))
+                await self.reply("250 OK")
+            elif command == "DATA":
+                if not self.recipients:
+                    await self.reply("503 Need RCPT first")
+                    continue
+                await self.reply("354 End data with <CR><LF>.<CR><LF>")
+                await self.data()
+            elif command == "RSET":
+                self.sender, self.recipients = None, []
+                await self.reply("250 OK")
+            elif command == "NOOP":
+                await self.reply("250 OK")
+            elif command == "QUIT":
+                await self.reply("221 Bye")
+                return
+            else:
+                await self.reply("502 Command not implemented")
+
+
+async def main(args):
+    async def handle(reader, writer):
+        try:
+            await Session(reader, writer, args).run()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, args.host, args.port)
+    print(f"SMTP stand-in listening on {args.host}:{args.port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        print(f"Stats: {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--save-dir", help="write every accepted mail to this directory")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of mails answered with 451")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before answering DATA")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,11 +1,18 @@
 import { store } from '../core/store.js';
+import { WSSend } from '../sockets/websocket_services.js';
 
+// Signaling runs over the chat socket: frames are wrapped in
+// { type: 'call_signal', call_id, data } and relayed to the call room.
 let pc = null;
-let ws = null;
-let baseURL = store.CALL_URL || null;
-let callingURL = null;
+let callId = null;
+let isInitiator = false;
 let hasSentOffer = false;
 
+function sendSignal(data) {
+  if (!callId) return;
+  WSSend({ type: 'call_signal', call_id: callId, data });
+}
+
 async function getMic() {
   const { initMedia } = await import('./media.js');
 
@@ -62,14 +69,8 @@ async function createPeerConnection() {
   };
 
   pc.onicecandidate = (ev) => {
-    if (!ev.candidate || !ws || ws.readyState !== WebSocket.OPEN) return;
-
-    const msg = { type: 'candidate', payload: ev.candidate };
-    try {
-      ws.send(JSON.stringify(msg));
-    } catch (e) {
-      console.error('[RTC] send candidate failed', e);
-    }
+    if (!ev.candidate) return;
+    sendSignal({ type: 'candidate', payload: ev.candidate });
   };
 
   pc.onconnectionstatechange = () => {
@@ -82,70 +83,56 @@ async function createPeerConnection() {
   return pc;
 }
 
-async function ensureSignalingSocket(callId, isInitiator = false) {
-  try { ws?.close(); } catch {}
-  ws = null;
+async function onSignal(msg) {
+  if (!msg || msg.call_id !== callId) return;
 
-  store.call.currentCallId = callId;
-  callingURL =  baseURL + encodeURIComponent(callId);
-
-  ws = new WebSocket(callingURL);
-  store.call.callWS = ws;
-  hasSentOffer = false;
-
-  ws.onopen = () => {
-    try {
-      ws.send(JSON.stringify({ type: 'ready' }));
-    } catch (e) {
-      console.error('[RTC] Failed to send READY', e);
-    }
-  };
+  if (msg.type === 'call_joined') {
+    sendSignal({ type: 'ready' });
+    return;
+  }
+  if (msg.type === 'call_ws_error') {
+    console.error('[RTC] call_ws_error:', msg);
+    endCall('ws_error');
+    return;
+  }
 
-  ws.onmessage = async (event) => {
-    let data;
-    try { data = JSON.parse(event.data); } catch { return; }
-
-    const { type, payload } = data || {};
-    if (!type) return;
-
-    try {
-      if (type === 'ready') {
-        if (isInitiator && !hasSentOffer) {
-          try {
-            const pcInstance = await createPeerConnection();
-            const offer = await pcInstance.createOffer();
-            await pcInstance.setLocalDescription(offer);
-
-            ws.send(JSON.stringify({ type: 'offer', payload: offer }));
-            hasSentOffer = true;
-          } catch (e) {
-            console.error('[RTC] creating/sending offer failed', e);
-          }
+  const { type, payload } = msg.data || {};
+  try {
+    if (type === 'ready') {
+      if (isInitiator && !hasSentOffer) {
+        try {
+          const pcInstance = await createPeerConnection();
+          const offer = await pcInstance.createOffer();
+          await pcInstance.setLocalDescription(offer);
+
+          sendSignal({ type: 'offer', payload: offer });
+          hasSentOffer = true;
+        } catch (e) {
+          console.error('[RTC] creating/sending offer failed', e);
         }
+      }
 
-      } else if (type === 'offer') {
-        await handleOffer(payload);
-
-      } else if (type === 'answer') {
-        await handleAnswer(payload);
+    } else if (type === 'offer') {
+      await handleOffer(payload);
 
-      } else if (type === 'candidate') {
-        await handleCandidate(payload);
+    } else if (type === 'answer') {
+      await handleAnswer(payload);
 
-      } else if (type === 'call_ws_error') {
-        console.error('[RTC] call_ws_error:', payload);
-        endCall('ws_error');
-      }
-    } catch (e) {
-      console.error('[RTC] error handling signaling msg', e);
+    } else if (type === 'candidate') {
+      await handleCandidate(payload);
     }
-  };
-
-  ws.onerror = (e) => {
-    console.error('[RTC] Signaling WS ERROR', e);
-  };
+  } catch (e) {
+    console.error('[RTC] error handling signaling msg', e);
+  }
 }
 
+window.addEventListener('call:signal', (ev) => onSignal(ev.detail));
+
+// The server forgets our room membership when the chat socket drops
+window.addEventListener('chat:ws-open', () => {
+  if (callId) WSSend({ type: 'call_join', call_id: callId });
+});
+
 /** ---------- Signaling handlers ---------- */
 
 async function handleOffer(offer) {
@@ -155,7 +142,7 @@ async function handleOffer(offer) {
   const answer = await pcInstance.createAnswer();
   await pcInstance.setLocalDescription(answer);
 
-  ws?.send(JSON.stringify({ type: 'answer', payload: answer }));
+  sendSignal({ type: 'answer', payload: answer });
 }
 
 async function handleAnswer(answer) {
@@ -182,9 +169,13 @@ async function handleCandidate(candidate) {
 
 /** ---------- Public API ---------- */
 
-export async function joinCall({ callId, isInitiator = false }) {
+export async function joinCall({ callId: id, isInitiator: initiator = false }) {
   await clearPC();
-  await ensureSignalingSocket(callId, isInitiator);
+  callId = id;
+  isInitiator = initiator;
+  hasSentOffer = false;
+  store.call.currentCallId = id;
+  WSSend({ type: 'call_join', call_id: id });
 }
 
 export async function toggleMute() {
@@ -217,14 +208,12 @@ export function endCall(reason = 'user') {
 
   pc = null;
 
-  try {
-    if (ws && ws.readyState === WebSocket.OPEN) {
-      ws.close();
-    }
-  } catch {}
+  if (callId) {
+    WSSend({ type: 'call_leave', call_id: callId });
+  }
 
-  ws = null;
-  store.call.callWS = null;
+  callId = null;
+  isInitiator = false;
   store.call.currentCallId = null;
   store.call.remoteStream = null;
   store.call.localStream = null;
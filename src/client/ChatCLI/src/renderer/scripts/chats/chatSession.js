@@ -364,6 +364,12 @@ export function onWSTyping({ detail: username }) {
   updateTypingIndicator();
 }
 
+export function onWSTypingStop({ detail: username }) {
+  clearTimeout(store.typingTimeouts.get(username));
+  store.typingTimeouts.delete(username);
+  if (store.typingUsers.delete(username)) updateTypingIndicator();
+}
+
 export function onWSUserStatus({ detail: msg }) {
   const chatItems = document.querySelectorAll(`.chat-item[data-username="${msg.username}"]`);
   chatItems.forEach(el => {
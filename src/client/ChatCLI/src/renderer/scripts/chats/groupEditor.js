@@ -4,6 +4,7 @@ import { showToast } from '../ui/toasts.js';
 import { hideModal, showModal, showConfirmationModal } from '../ui/modals.js';
 import { loadChats } from './chatList.js';
 import { selectChat } from './chatSession.js';
+import { fetchMembers } from './groupService.js';
 
 // Initializes event listeners for the group editor modal
 export function initGroupEditor() {
@@ -89,10 +90,7 @@ export async function openGroupEditor() {
   if (!store.currentChatID) return;
   let members;
   try {
-    const res = await apiRequest('/chat/get-members', {
-      body: JSON.stringify({ session_token: store.token, chatID: store.currentChatID })
-    });
-    members = res.members;
+    members = await fetchMembers(store.currentChatID);
   } catch (err) {
     return showToast('Failed to load group members: ' + err.message, 'error');
   }
@@ -2,11 +2,52 @@ import { store } from '../core/store.js';
 import { apiRequest } from '../core/api.js';
 import { showToast } from '../ui/toasts.js';
 
+// chatID -> { version, members }; refreshed with membership deltas
+// (get-members since_version) instead of refetching the whole list
+const memberCache = new Map();
+
+function applyDelta(members, added, removed) {
+  const gone = new Set(removed);
+  const next = members.filter(name => !gone.has(name));
+  added.forEach(name => { if (!next.includes(name)) next.push(name); });
+  return next;
+}
+
+// Current members of a group chat
+export async function fetchMembers(chatID) {
+  const cached = memberCache.get(chatID);
+  const res = await apiRequest('/chat/get-members', {
+    body: JSON.stringify({
+      session_token: store.token,
+      chatID,
+      ...(cached ? { since_version: cached.version } : {})
+    })
+  });
+  let members;
+  if (Array.isArray(res.members)) members = res.members;
+  else if (res.up_to_date) members = cached.members;
+  else members = applyDelta(cached.members, res.added || [], res.removed || []);
+  memberCache.set(chatID, { version: res.version, members });
+  return [...members];
+}
+
+// member_added / member_removed from the socket. Only the next version can
+// be applied; after a gap the next fetchMembers catches up with a delta.
+export function onWSMembersChanged(ev) {
+  const msg = ev.detail;
+  const cached = memberCache.get(msg.chatID);
+  if (!cached || msg.version !== cached.version + 1) return;
+  const names = msg.usernames || [];
+  cached.members = msg.type === 'member_added'
+    ? applyDelta(cached.members, names, [])
+    : applyDelta(cached.members, [], names);
+  cached.version = msg.version;
+}
+
 // Load and display the members of a group chat
 export async function loadGroupMembers(chatID) {
   try {
-    const { members } = await apiRequest('/chat/get-members',
-      { body: JSON.stringify({ session_token: store.token, chatID }) });
+    const members = await fetchMembers(chatID);
     const list = store.refs.groupMemberList || document.querySelector('#groupEditorModal .user-list');
     list.innerHTML = '';
     members.forEach(name => {
@@ -22,7 +22,6 @@ export const store = {
 
   // call
   call: {
-    callWS: null,
     currentCallId: null,
     pc: null,
     localStream: null,
@@ -7,8 +7,9 @@ import { initChatSearch, reapplyChatSearch } from './chats/search.js';
 import { apiRequest } from './core/api.js';
 import { loadChats, onWSChatCreated } from './chats/chatList.js';
 import { handleArchiveChat, archiveChat } from './chats/archive.js';
-import { selectChat, sendMessage, updateSendButtonState, onWSNewMessage, onWSTyping, onWSUserStatus, onWSOnlineUsers } from './chats/chatSession.js';
+import { selectChat, sendMessage, updateSendButtonState, onWSNewMessage, onWSTyping, onWSTypingStop, onWSUserStatus, onWSOnlineUsers } from './chats/chatSession.js';
 import { openGroupEditor, initGroupEditor } from './chats/groupEditor.js';
+import { onWSMembersChanged } from './chats/groupService.js';
 import { showToast } from './ui/toasts.js';
 import { sendCallInviteViaGlobal, sendCallAcceptViaGlobal, sendCallDeclineViaGlobal, sendCallEndViaGlobal } from './calls/callSockets.js';
 import { toggleMute, endCall, joinCall } from './calls/rtc.js';
@@ -19,9 +20,11 @@ import { playRingback, stopRingback, playRingtone, stopRingtone, initMedia } fro
 // --- events from ws
 window.addEventListener('chat:new-message', onWSNewMessage);
 window.addEventListener('chat:user-typing', onWSTyping);
+window.addEventListener('chat:user-typing-stop', onWSTypingStop);
 window.addEventListener('chat:user-status', onWSUserStatus);
 window.addEventListener('chat:chat_created', onWSChatCreated);
 window.addEventListener('chat:online-users', onWSOnlineUsers);
+window.addEventListener('chat:members-changed', onWSMembersChanged);
 
 // archive UX events
 window.addEventListener('chat:archive', (ev) => handleArchiveChat(ev.detail.chatID));
@@ -126,7 +129,6 @@ document.addEventListener('DOMContentLoaded', async () => {
 
   window.addEventListener('beforeunload', () => {
     try { endCall('Unload'); } catch {}
-    try { store.call?.callWS?.close(); } catch {}
   });
 
   store.callIncoming = store.callIncoming || null;
@@ -537,9 +539,6 @@ document.addEventListener('DOMContentLoaded', async () => {
           });
           const chatID = result.chatID;
           showToast('Private chat created!', 'info');
-          try {
-            WSSend({ type : 'chat_created', chatID : chatID, 'creator': store.username });
-          } catch (err) {showToast(err.message, 'error')}
           hideModal(createChatModal);
           newChatInput.value = '';
           await loadChats();
@@ -561,9 +560,6 @@ document.addEventListener('DOMContentLoaded', async () => {
           if (!result.chatID) throw new Error('Failed to create group');
           const chatID = result.chatID;
           showToast('Group created!', 'info');
-          try {
-            WSSend({ type: 'chat_created', chatID : chatID, 'creator': store.username });
-          } catch (err) {showToast(err.message + "send chat_created", 'error')}
           hideModal(createChatModal);
           newGroupNameInput.value = '';
           groupMemberInput.value = '';
@@ -71,6 +71,7 @@ export function connectWS() {
       ws.send(JSON.stringify({ type: 'auth', token: store.token }));
     }
     ws.send(JSON.stringify({ type: 'join_idle' }));
+    window.dispatchEvent(new Event('chat:ws-open'));
   });
 
   ws.addEventListener('close', (event) => {
@@ -133,6 +134,18 @@ export function connectWS() {
       return;
     }
 
+    // Server heartbeat
+    if (msg && msg.type === 'ping') {
+      WSSend({ type: 'pong' });
+      return;
+    }
+
+    // Call signaling, multiplexed by call_id (see calls/rtc.js)
+    if (msg && (msg.type === 'call_signal' || msg.type === 'call_joined' || msg.type === 'call_ws_error')) {
+      window.dispatchEvent(new CustomEvent('call:signal', { detail: msg }));
+      return;
+    }
+
     // Handle the "online_users" message type
     if (msg.type === 'online_users') {
       window.dispatchEvent(new CustomEvent('chat:online-users', { detail: msg.users }));
@@ -155,7 +168,8 @@ export function connectWS() {
     if (msg.type === 'user_typing' &&
         msg.chatID === store.currentChatID &&
         msg.username.toLowerCase() !== (store.username || '').toLowerCase()) {
-      window.dispatchEvent(new CustomEvent('chat:user-typing', { detail: msg.username }));
+      const event = msg.typing === false ? 'chat:user-typing-stop' : 'chat:user-typing';
+      window.dispatchEvent(new CustomEvent(event, { detail: msg.username }));
       return;
     }
 
@@ -169,6 +183,15 @@ export function connectWS() {
       window.dispatchEvent(new CustomEvent('chat:chat_created', { detail: msg }));
       return;
     }
+
+    // Changes made through the REST API (by us on another device, or by others)
+    if (msg.type === 'member_added' || msg.type === 'member_removed') {
+      window.dispatchEvent(new CustomEvent('chat:members-changed', { detail: msg }));
+    }
+    if (['member_added', 'member_removed', 'chat_archived', 'chat_unarchived', 'profile_updated'].includes(msg.type)) {
+      window.dispatchEvent(new CustomEvent('chat:reload'));
+      return;
+    }
     window.dispatchEvent(new CustomEvent('global:msg', { detail: msg }));
   });
 }